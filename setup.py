@@ -6,5 +6,5 @@ setup(name='steppir',
       version='1.2',
       description='SteppIR serial controller',
       author='Asgeir Bjorgan & Curt Mills',
-      py_modules=['steppir'],
+      py_modules=['steppir', 'steppir_sim', 'steppird', 'steppir_cat'],
      )
@@ -7,20 +7,22 @@
 # 1) A CLIENT socket connection to a radio's CAT port at port 21000.
 #
 # 2) A SERVER socket for a CAT port at 19090 for various clients to connect
-#    to (Fldigi, Wsjt-x, Js8call, etc).
+#    to (Fldigi, Wsjt-x, Js8call, etc), any number of them at once.
 #
 # 3) A GUI full of buttons which can control an SDA-100 controller and display
 #    the current frequency the antenna is tuned to.
 #
 # 4) Serial control of an SDA-100 controller by use of the steppir.py" library
-#    (included). This serial port can be remotely located via "socat".
+#    (included). The controller can also be remote: Set SERIAL_PORT to a URL
+#    like "socket://host:port" (ser2net and the like) or "rfc2217://host:port".
 #
-# A separate thread each is used for #1, #2, #3, and #4 above.
+# #1 and #2 share one thread running the event loop in steppir_cat.py, #3 and
+# #4 each have their own.
 #
-# Data received via the server port gets forwarded to the client CAT port.
-# Data received via the client CAT port gets forwarded to the server port, and
-# is parsed for frequency data: If frequency data is found that data is sent
-# via the serial port to the SDA-100 SteppIR controller.
+# Commands received via the server port get forwarded to the radio's CAT port.
+# Replies from the radio go back to the client that asked for them, and are
+# parsed for frequency data: If frequency data is found that data is sent via
+# the serial port to the SDA-100 SteppIR controller.
 #
 # Buttons pushed on the GUI affect the SteppIR controller directly and enable/
 # disable tuning the SteppIR beam via data received from the other ports.
@@ -33,9 +35,11 @@
 
 import tkinter as tk
 import steppir
+import steppir_cat
 import time
 from threading import Thread
-import socket
+import os
+import functools
 
 
 # Adjust these for your radio's CAT port. Port CANNOT be the same as the
@@ -45,19 +49,62 @@ RADIO_CAT_PORT = 21000
 
 # Port that software which wishes to control the radio will connect to.
 # Things like WSJT-X, Fldigi, Js8call, etc.
+# Any number of them can be connected at the same time.
 CAT_HOST = "127.0.0.1"
 CAT_LISTENER_PORT = 19090
 
-# Serial port parameters
+# Ask the radio for its frequency when no CAT client has for this many seconds,
+# None to only follow what the clients ask for.
+CAT_POLL_INTERVAL = 5.0
+
+# Answer read-only queries (FA;, IF;, ...) from replies up to this many
+# seconds old instead of asking the radio again, 0 to always ask the radio.
+CAT_CACHE_TTL = 0.5
+
+# Serial port parameters. SERIAL_PORT may also be a "socket://host:port" or
+# "rfc2217://host:port" URL for a controller on a remote serial server.
 SERIAL_PORT = "/dev/ttyUSB0"
 BAUD_RATE = 1200
 
+# Set BAUD_RATE to None to have the library find the controller's rate. The
+# rate found is remembered here so the next start finds it right away.
+BAUD_CACHE = os.path.expanduser("~/.steppir-baud.json")
+
+# Bands for BAND UP/BAND DOWN and the retune tolerances: A region from
+# steppir.BAND_PLANS, limited to what the antenna tunes (40m to 6m for the
+# Yagis). Set BAND_PLAN_CONFIG to a JSON file to load the plan from there
+# instead (see steppir.BandPlan.load()).
+BAND_REGION = "IARU2"
+ANTENNA_LOW = 6800000
+ANTENNA_HIGH = 54000000
+BAND_PLAN_CONFIG = None
+
+# The last frequency and direction used on each band is kept here, so BAND
+# UP/BAND DOWN go back to it.
+BAND_MEMORY = os.path.expanduser("~/.steppir-bands.json")
+
+
+# The buttons that send a command just show the retract or calibrate in
+# progress instead of failing while the antenna is busy.
+def unless_homing(handler):
+    @functools.wraps(handler)
+    def wrapper(self):
+        try:
+            handler(self)
+        except steppir.HomingInProgress as error:
+            print(error)
+            # Already being followed if it was started from this GUI
+            if self.homing is not error.operation:
+                self.homing = error.operation
+                self.show_homing()
+    return wrapper
 
  
 class SteppirApp(tk.Frame):
 
     # Class variables
     frequency = 0
+    homing = None
 
     def __init__(self, master=None):
         super().__init__(master)
@@ -130,6 +177,7 @@ class SteppirApp(tk.Frame):
         self.quit.grid(row=0, column=3)
 
     # Frequency + 10kHz
+    @unless_homing
     def up_10khz(self):
         #print("frequency + 10 kHz")
         (frequency) = step.get_frequency()
@@ -140,6 +188,7 @@ class SteppirApp(tk.Frame):
         self.display.config(text="%6.3f MHz" % freq_mhz)
 
     # Frequency - 10 kHz
+    @unless_homing
     def down_10khz(self):
         #print("frequency - 10 kHz")
         (frequency) = step.get_frequency()
@@ -150,6 +199,7 @@ class SteppirApp(tk.Frame):
         self.display.config(text="%6.3f MHz" % freq_mhz)
 
     # Frequency + 100 kHz
+    @unless_homing
     def up_100khz(self):
         #print("frequency + 100 kHz")
         (frequency) = step.get_frequency()
@@ -160,6 +210,7 @@ class SteppirApp(tk.Frame):
         self.display.config(text="%6.3f MHz" % freq_mhz)
 
     # Frequency - 100 kHz
+    @unless_homing
     def down_100khz(self):
         #print("frequency - 100 kHz")
         (frequency) = step.get_frequency()
@@ -170,6 +221,7 @@ class SteppirApp(tk.Frame):
         self.display.config(text="%6.3f MHz" % freq_mhz)
  
     # Frequency + 1 MHz
+    @unless_homing
     def up_1mhz(self):
         #print("frequency + 1 MHz")
         (frequency) = step.get_frequency()
@@ -180,6 +232,7 @@ class SteppirApp(tk.Frame):
         self.display.config(text="%6.3f MHz" % freq_mhz)
  
     # Frequency - 1 MHz
+    @unless_homing
     def down_1mhz(self):
         #print("frequency - 1 MHz")
         (frequency) = step.get_frequency()
@@ -189,71 +242,72 @@ class SteppirApp(tk.Frame):
         step.set_frequency(frequency)
         self.display.config(text="%6.3f MHz" % freq_mhz)
 
+    @unless_homing
     def band_up(self):
         #print("band up")
-        (frequency) = step.get_frequency()
-        if frequency  <   7300001:  # 40 meters
-            frequency =  10100000   # 30 meter bottom
-        elif frequency < 10150001:  # 30 meters
-            frequency =  14000000   # 20 meter bottom
-        elif frequency < 14350001:  # 20 meters
-            frequency =  18068000   # 17 meter bottom
-        elif frequency < 18168001:  # 17 meters
-            frequency =  21000000   # 15 meter bottom
-        elif frequency < 21450001:  # 15 meters
-            frequency =  24890000   # 12 meter bottom
-        elif frequency < 24990001:  # 12 meters
-            frequency =  28000000   # 10 meter bottom
-        elif frequency < 29700001:  # 10 meters
-            frequency =  50000000   # 6 meter bottom
-        elif frequency < 54000001:  # 6 meters
-            frequency =   7000000   # 40 meter bottom
-        freq_mhz = frequency / 1000000
+        # Back to the frequency and direction last used on the next band up
+        status = step.change_band(1, band_plan, band_memory)
+        freq_mhz = status.frequency / 1000000
         #print("New frequency %5.3f MHz" % freq_mhz)
-        step.set_frequency(frequency)
         self.display.config(text="%6.3f MHz" % freq_mhz)
- 
+
+    @unless_homing
     def band_down(self):
         #print("band down")
-        (frequency) = step.get_frequency()
-        if frequency >   49999999:  # 6 meters
-            frequency =  28000000   # 10 meter bottom
-        elif frequency > 27999999:  # 10 meters
-            frequency =  24890000   # 12 meter bottom
-        elif frequency > 24889999:  # 12 meters
-            frequency =  21000000   # 15 meter bottom
-        elif frequency > 20999999:  # 15 meters
-            frequency =  18068000   # 17 meter bottom
-        elif frequency > 18067999:  # 17 meters
-            frequency =  14000000   # 20 meter bottom
-        elif frequency > 13999999:  # 20 meters
-            frequency =  10100000   # 30 meter bottom
-        elif frequency > 10099999:  # 30 meters
-            frequency =   7000000   # 40 meter bottom
-        elif frequency >  6999999:  # 40 meters
-            frequency =  50000000   # 6 meter bottom
-        freq_mhz = frequency / 1000000
+        status = step.change_band(-1, band_plan, band_memory)
+        freq_mhz = status.frequency / 1000000
         #print("New frequency %5.3f MHz" % freq_mhz)
-        step.set_frequency(frequency)
         self.display.config(text="%6.3f MHz" % freq_mhz)
 
+    @unless_homing
     def autotrack_on(self):
         #print("autotrack ON")
         step.set_autotrack_ON()
 
+    @unless_homing
     def autotrack_off(self):
         #print("autotrack OFF")
         step.set_autotrack_OFF()
 
+    # Retract and calibrate run in the background (up to 45/90 seconds) so
+    # the GUI stays responsive. show_homing() follows them on the Tk thread.
     def retract(self):
         #print("retract")
-        step.retract_antenna()
+        try:
+            self.homing = step.start_retract()
+        except steppir.HomingInProgress as error:
+            print(error)
+            return
+        self.show_homing()
  
     def calibrate(self):
         #print("calibrate")
-        step.calibrate_antenna()
+        try:
+            self.homing = step.start_calibrate()
+        except steppir.HomingInProgress as error:
+            print(error)
+            return
+        self.show_homing()
+
+    def show_homing(self):
+        operation = self.homing
+        if operation.done():
+            try:
+                (frequency, active_motors, direction, dir_label, version) = operation.result()
+                freq_mhz = frequency / 1000000
+                self.display.config(text="%6.3f MHz" % freq_mhz)
+            except Exception as error:
+                print(operation.kind, "failed:", error)
+            return
+
+        text = "%s %ds" % (operation.kind.title(), operation.elapsed)
+        if operation.remaining is not None:
+            text += " (~%ds)" % operation.remaining
+        self.display.config(text=text)
+        self.after(250, self.show_homing)
 
     # If frequency = 0, elements are "Homed" 
+    @unless_homing
     def direction_normal(self):
         #print("direction: normal")
         step.set_dir_normal()
@@ -263,6 +317,7 @@ class SteppirApp(tk.Frame):
         freq_mhz = frequency / 1000000
         self.display.config(text="%6.3f MHz" % freq_mhz)
 
+    @unless_homing
     def direction_180(self):
         #print("direction: 180")
         step.set_dir_180()
@@ -272,6 +327,7 @@ class SteppirApp(tk.Frame):
         freq_mhz = frequency / 1000000
         self.display.config(text="%6.3f MHz" % freq_mhz)
 
+    @unless_homing
     def direction_bi(self):
         #print("direction: bidirectional")
         step.set_dir_bidirectional()
@@ -283,155 +339,13 @@ class SteppirApp(tk.Frame):
 
 
 
-class RadioCATLoop(Thread):
-    # Handles the radio CAT interface. Connects to port with a socket
-    # connection. Used to connect to linHPSDR's CAT port.
-    #
-    # If a frequency string is seen, report that back so the SteppIR can be
-    # set to the same frequency.
-    #
-    # If a frequency string is never seen, add code to periodically query the
-    # radio's frequency so it can be sent to the SteppIR if it changes.
-
-    s = 0
-    receive_buffer = 0x00
-
-    def __init__(self, process_name):
-        super().__init__()
-        self.process_name = process_name
-
-    # Run a thread asynchronously
-    def run(self):
-        self.receive_buffer = 0x00
-        #print("    Starting Radio CAT listener")
-        last_frequency = 0
-        while True:
-            # Open network port to CAT port of linHPSDR S/W
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as self.s:
-#                self.s.settimeout(120.1)   # Timeout for listening in seconds
-                try:
-                    self.s.connect((RADIO_HOST, RADIO_CAT_PORT))
-                    while stop_threads == False:
-                        self.receive_buffer = self.s.recv(1024)
-#                        print("From RADIO:", self.receive_buffer)
-                        key = self.receive_buffer[0:2]  # Byte array
-                        if key == b'FA':    # Compare byte array
-                            # Found a frequency response
-#                            print("Found a frequency response!")
-                            f_temp = self.receive_buffer[2:13]
-                            frequency = int(f_temp) # Frequency in Hz
-                            freq_mhz = frequency / 1000000
-                            if last_frequency != frequency:
-                                #print("    Changing frequency")
-                                last_frequency = frequency
-                                text="%8.6f MHz" % freq_mhz
-                                #print('Received', text)
-                                #print("New Frequency %5.3f MHz" % freq_mhz)
-
-                                # Send new frequency to the SteppIR
-#                               step.set_frequency(frequency)
-                                steppir_serial_thread.serial_bytes = frequency    # Frequency data
-                                steppir_serial_thread.serial_send = True  # Send to steppir_serial_thread
-
-                                # Update the GUI frequency display
-                                app.display.config(text="%6.3f MHz" % freq_mhz)
-
-                        # Echo received data out ClientCATLoop server port 
-                        if client_CAT_thread and client_CAT_thread.conn:
-                            client_CAT_thread.conn.send(self.receive_buffer)
-                        #else:
-                            #print("No client thread to send to")
-
-                except socket.timeout:
-                    print("    Radio socket timeout")
-                    pass
-                except:
-                    print("    Radio socket problem")
-                    raise
-
-
-
-class RadioQueryLoop(Thread):
-    # If there's no CAT controller connected to the server
-    # port, send "FA;" through periodically (query the
-    # radio's frequency). Send the radio's response to the
-    # SteppIR controller. For this particular case the
-    # radio controls the SteppIR frequency.
-
-    def __init__(self, process_name):
-        super().__init__()
-        self.process_name = process_name
-
-    # Run a thread asynchronously
-    def run(self):
-        #print("    Starting Radio Query Loop")
-        # Wait for other threads to come up / get connected
-        time.sleep(5.0)
-        while stop_threads == False:
-            # If no CAT controller is currently connected
-            if not client_CAT_thread or not client_CAT_thread.conn:
-                #print("Sending frequency query to radio")
-                # Send data out the Radio socket (if any)
-                if radio_CAT_thread:
-                    radio_CAT_thread.s.send(b'FA;')
-                #else:
-                #    print("No radio thread to send to")
-                time.sleep(5.0)
-
-
-
-class ClientCATLoop(Thread):
-    # Handles the client CAT interface. Handles connections to port
-    # from various clients trying to control the CAT port like: Fldigi,
-    # Wsjtx, Js8call, etc. Opens up a listening socket.
-
-    s = 0
-    conn = 0
-    receive_buffer = 0x00
-
-    def __init__(self, process_name):
-        super().__init__()
-        self.process_name = process_name
-
-    # Run a listener thread asynchronously
-    def run(self):
-        self.receive_buffer = 0x00
-        #print("    Starting Client CAT listener")
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as self.s:
-#            self.s.settimeout(60.0)   # Timeout for listening in seconds
-            self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.s.bind((CAT_HOST, CAT_LISTENER_PORT))
-            self.s.listen(0) # '0' means to allow no backlog of connections
-
-            # Keep accepting client connections, one after the other
-            # unless stop_threads == True
-            while stop_threads == False:
-                try:
-                    self.conn = 0   # Need this so other threads can test for socket
-                    self.conn, addr = self.s.accept() # Accept one client connection
-                    with self.conn:
-                        print('    Connected by', addr)
-                        while True: # Keep processing commands until client disconnects
-                            self.receive_buffer = self.conn.recv(1024)
-#                            print("From CLIENT:", self.receive_buffer)
-
-                            # Send data out the Radio socket (if any)
-                            if radio_CAT_thread:
-                                radio_CAT_thread.s.send(self.receive_buffer)
-                            else:
-                                print("No radio thread to send to")
- 
-                            if not self.receive_buffer:
-                                break
-                            if stop_threads == True:
-                                self.stop()
-
-                except socket.timeout:
-                    print("    Listener socket timeout")
-                    pass
-                except:
-                    print("    Listener socket problem")
-                    raise
+def cat_frequency(frequency):
+    # Called by cat_proxy whenever the radio reports a new frequency. Send it
+    # to the SteppIR (only the newest pending frequency is kept) and update
+    # the GUI frequency display.
+    tune_queue.submit(frequency)
+    if app:
+        app.display.config(text="%6.3f MHz" % (frequency / 1000000))
 
 
 
@@ -455,26 +369,32 @@ class SteppirStatusLoop(Thread):
 class SteppirSerialLoop(Thread):
     # Sends/receives data over a serial port to communicate with a SteppIR
     # SDA-100 controller. This may receive tune-frequency data from the
-    # ClientCATLoop or RadioCATLoop threads. This code was put into a separate
-    # thread because the serial communication is much too slow to have it get
-    # in the way of the socket communications of the other threads.
-
-    serial_send = False
-    serial_bytes = 0x00 # Frequency data
+    # CAT proxy thread via tune_queue. This code was put
+    # into a separate thread because the serial communication is much too slow
+    # to have it get in the way of the socket communications of the other
+    # threads.
+    #
+    # tune_queue keeps only the newest frequency, and a newer frequency aborts
+    # the retry loop of the one being tuned, so the antenna follows the radio
+    # with bounded lag instead of working through a backlog.
 
     def __init__(self, process_name):
         super().__init__()
         self.process_name = process_name
 
-    # Run a thread asynchronously
+    # Run a thread asynchronously. Sleeps inside tune_queue until a frequency
+    # arrives (no busy-wait), and exits once tune_queue is closed at shutdown.
+    # A failed tune (serial error, short reply, controller unreachable) is
+    # logged and the thread waits for the next frequency instead of dying.
     def run(self):
-        while stop_threads == False:
-            if self.serial_send == True:
-                #print("            SteppIR Serial Processing")
-                # Send new frequency to the SteppIR
-                step.set_frequency(self.serial_bytes) # Send frequency
-                self.serial_send = False
-                time.sleep(1.0)
+        while not tune_queue.closed:
+            #print("            SteppIR Serial Processing")
+            # Send newest frequency to the SteppIR
+            try:
+                tune_queue.tune(step)
+            except Exception as error:
+                print("Tune failed:", error)
+            #print("Coalesced:", tune_queue.coalesced, "Superseded:", tune_queue.superseded)
 
 
 
@@ -492,26 +412,34 @@ step = steppir.SteppIR(
     2.0,        # write_timeout
     False,      # dsrdtr
     None,       # inter_byte_timeout
-    None)       # exclusive port access
+    None,       # exclusive port access
+    status_ttl=0.5, # Share status replies between threads for 0.5 seconds
+    baud_cache=BAUD_CACHE)
+
+if BAND_PLAN_CONFIG:
+    band_plan = steppir.BandPlan.load(BAND_PLAN_CONFIG)
+else:
+    band_plan = steppir.BandPlan.region(BAND_REGION).covering(ANTENNA_LOW, ANTENNA_HIGH)
+band_memory = steppir.BandMemory.load(BAND_MEMORY)
 
 # Start up processing thread(s)
 stop_threads = False
 
-client_CAT_thread = ClientCATLoop("Client")
-client_CAT_thread.start()
+# Frequency updates waiting to be sent to the SteppIR. Small moves within a
+# band (see steppir.RETUNE_TOLERANCES) don't move the elements.
+tune_queue = steppir.TuneQueue(policy=steppir.RetunePolicy(plan=band_plan))
 
-radio_CAT_thread = RadioCATLoop("Radio")
-radio_CAT_thread.start()
+app = None
 
-# Note: Cannot run this while a CAT control program is connected to the
-# listening port, else they'll interact and the CAT control program may get
-# upset and disconnect. WSJT-X does this. Need to enable this thread only when
-# nothing is connected to the listening port, and kill this thread when
-# something connects there. By doing that we'll be able to control the SteppIR
-# from the radio when nothing else is controlling the radio.
-#
-#radio_query_thread = RadioQueryLoop("Radio Query")
-#radio_query_thread.start()
+# Radio CAT port shared with all CAT clients. Each client gets the replies to
+# its own queries, so the radio can also be polled for its frequency while
+# WSJT-X and friends are connected: That way the SteppIR follows the radio
+# even when nothing else is controlling it.
+cat_proxy = steppir_cat.CATProxy(RADIO_HOST, RADIO_CAT_PORT, CAT_HOST, CAT_LISTENER_PORT,
+    on_frequency=cat_frequency, poll_interval=CAT_POLL_INTERVAL, cache_ttl=CAT_CACHE_TTL,
+    plan=band_plan)
+cat_thread = Thread(target=cat_proxy.serve_forever, name="CAT")
+cat_thread.start()
 
 steppir_serial_thread = SteppirSerialLoop("Serial")
 steppir_serial_thread.start()
@@ -526,9 +454,9 @@ app.mainloop()
 
 # Stop all parallel threads
 stop_threads = True
-client_CAT_thread.join()
-radio_CAT_thread.join()
-#radio_query_thread.join()
+tune_queue.close()  # Wakes up steppir_serial_thread
+cat_proxy.shutdown()
+cat_thread.join()
 steppir_serial_thread.join()
 #steppir_monitor_thread.join()
 
@@ -1,8 +1,17 @@
 #!/usr/bin/env python3
 
+import asyncio
+import bisect
+import concurrent.futures
+import functools
+import json
+import os
 import serial
+import socket
 import struct
+import threading
 import time
+import urllib.parse
 
 
 """
@@ -62,328 +71,3762 @@ when commands are accepted/completed when the H/W unit is tuning the antenna.
 
 
 
-class SteppIR:
+class CommandAborted(Exception):
+    """
+    Raised when a command is aborted (via its "abort" event) while it is
+    waiting for the controller to finish.
     """
-    Serial interface for controlling SteppIR controllers like the SDA-100.
 
-    For details on the serial interface, see "Transceiver interface operation
-    for Steppir"
-    (https://consumer.steppir.com/wp-content/uploads/2011/10/Transceiver-Interface-Operation-5-28-09.pdf).
 
-    Note: The document is no longer available from SteppIR, but versions can
-    still be found around the 'net. The most recent one found:
-    Transceiver-Interface-Operation-6_23_2011.pdf
 
-    For the SDA-2000 controller there is a protocol document dated 10/09/2018
-    that is otherwise similar to the above documents but included a few more
-    protocol details that may only be found in the SDA-2000 controller.
+class HomingInProgress(Exception):
+    """
+    Raised when a command is sent while another thread is retracting or
+    calibrating the antenna. "operation" is the HomingOperation in progress.
     """
 
-    # Class variables
-    serial_port = None
-    baud_rate = None
-    bytesize = None
-    parity = None
-    stopbits = None
-    read_timeout = None
-    xonxoff = None
-    rtscts = None
-    write_timeout = None
-    dsrdtr = None
-    inter_byte_timeout = None
-    exclusive = None
+    def __init__(self, operation):
+        super().__init__("Antenna is busy (%s, %.0f seconds so far), try again when it is done"
+            % (operation.kind, operation.elapsed))
+        self.operation = operation
+
+
+
+# Direction (or wavelength for verticals) labels, indexed by the top three
+# bits of the direction byte (direction >> 5)
+DIRECTION_LABELS = (
+    "Normal",           # 0x00
+    "3/4 Wave",         # 0x20 (For vertical antennas only)
+    "180 degrees",      # 0x40
+    "Normal",           # 0x60
+    "Bidirectional",    # 0x80
+    "Normal",           # 0xa0
+    "Pattern",          # 0xc0 (Pattern selected by the "pa" byte)
+    "Normal",           # 0xe0
+    )
+
+# Status reply from the controller:
+#   0 1   2 3 4 5     6              7          8 9       10
+#   ? ?   frequency   active_motors  direction  version   \r
+STATUS_STRUCT = struct.Struct('>2xIBB2sx')
+
+# "Set" command to the controller:
+#   0 1   2 3 4 5     6   7          8        9      10
+#   @ A   frequency   pa  direction  command  0x00   \r
+COMMAND_STRUCT = struct.Struct('>2sIBBc2s')
+
 
 
+class StatusFrame:
+    """
+    One decoded status reply from the controller.
+
+    Attributes are "frequency" (Hz), "active_motors", "direction",
+    "dir_label", "version" and "timestamp" (time.monotonic() when the reply
+    was read, None if unknown). See SteppIR.get_status() for what each one
+    means. Frames are immutable.
+
+    For existing callers a StatusFrame also behaves like the 5-tuple
+    get_status() used to return:
+
+        (frequency, active_motors, direction, dir_label, version) = step.get_status()
+    """
+
+    __slots__ = ('frequency', 'active_motors', 'direction', 'dir_label', 'version', 'timestamp')
+
+    def __init__(self, frequency, active_motors, direction, dir_label, version, timestamp=None):
+        setattr = object.__setattr__
+        setattr(self, 'frequency', frequency)
+        setattr(self, 'active_motors', active_motors)
+        setattr(self, 'direction', direction)
+        setattr(self, 'dir_label', dir_label)
+        setattr(self, 'version', version)
+        setattr(self, 'timestamp', timestamp)
+
 
-    def __init__(self, port, baudrate, bytesize, parity, stopbits, read_timeout, xonxoff, rtscts, write_timeout, dsrdtr, inter_byte_timeout, exclusive):
+
+    @classmethod
+    def decode(cls, frame, timestamp=None):
         """
-        Set serial parameters.
+        Decode an 11-byte status frame (see StatusDecoder).
 
         Parameters:
         -----------
-        serial_interface: str
-            Path to serial interface, e.g. /dev/ttyUSB0.
+        frame: bytes
+            The frame as received from the controller
 
-        baud_rate: int
-            Baud rate, must match baud rate set in controller.
+        timestamp: float
+            Optional time the frame was received
 
-        bytesize: int
-            Should be 8
+        Returns:
+        --------
+        status: StatusFrame
+        """
 
-        parity: str
-            Should be 'N'
+        (frequency, active_motors, direction, version) = STATUS_STRUCT.unpack(frame)
+        direction &= 0xe0
+        return cls(frequency * 10, active_motors, direction, DIRECTION_LABELS[direction >> 5], version, timestamp)
 
-        stopbits: int
-            Should be 1
 
-        read_timeout: float
-            Serial read timeout in seconds, float
 
-        xonxoff: Boolean
-            Software handshaking, should be False
+    def __setattr__(self, name, value):
+        raise AttributeError("StatusFrame is immutable")
 
-        rtscts: Boolean
-            RTS/CTS hardware handshaking, should be False
+    def __delattr__(self, name):
+        raise AttributeError("StatusFrame is immutable")
 
-        write_timeout: float
-            Serial write timeout in seconds, float
+    def _tuple(self):
+        return (self.frequency, self.active_motors, self.direction, self.dir_label, self.version)
 
-        dsrdtr: Boolean
-            DSR/DTR Hardware handshaking, should be False
+    def __iter__(self):
+        return iter(self._tuple())
 
-        inter_byte_timeout: float
-            Should be None
+    def __len__(self):
+        return 5
+
+    def __getitem__(self, index):
+        return self._tuple()[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (StatusFrame, tuple)):
+            return self._tuple() == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._tuple())
+
+    def __repr__(self):
+        return "StatusFrame(frequency=%d, active_motors=0x%02x, direction=0x%02x, dir_label=%r, version=%r)" % (
+            self.frequency, self.active_motors, self.direction, self.dir_label, self.version)
+
+
+
+class FrameError(Exception):
+    """
+    Raised when no valid status frame could be read from the controller.
+    """
+
+
+
+class ShortFrameError(FrameError):
+    """
+    Raised when the controller stopped sending before a complete status frame
+    arrived (read timeout).
+    """
+
+
+
+class StatusDecoder:
+    """
+    Incremental decoder for the 11-byte status replies from the controller.
+
+    Bytes are fed in as they arrive from the serial port, in pieces of any
+    size, and complete frames are taken out with next_frame(). A frame is 11
+    bytes ending in a carriage return, with a zero in byte 2 (the top byte of
+    the frequency). Bytes that can't be the start of a valid frame, like
+    leftovers from an earlier exchange, are skipped so the decoder
+    resynchronizes on the next good frame.
+
+    The receive buffer is a fixed bytearray which is reused for the life of
+    the decoder. If it fills up the oldest bytes are dropped.
+    """
+
+    FRAME_LENGTH = 11
+    TERMINATOR = 0x0d
+
+    def __init__(self, size=64):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self.frames = 0
+        self.discarded = 0
 
-        exclusive: Boolean
-            Serial port exclusive access, should be False
-        """
 
-        # Set the Class variables based on the parameters received
-        self.serial_port = port
-        self.baud_rate = baudrate
-        self.bytesize = bytesize
-        self.parity = parity
-        self.stopbits = stopbits
-        self.read_timeout = read_timeout
-        self.xonxoff = xonxoff
-        self.rtscts = rtscts
-        self.write_timeout = write_timeout
-        self.dsrdtr = dsrdtr
-        self.inter_byte_timeout = inter_byte_timeout
-        self.exclusive = exclusive
 
-        # Needed to assure we don't run commands too close together
-        time.sleep(0.1)
+    def __len__(self):
+        return self._end - self._start
 
 
 
-    def get_status(self):
+    def needed(self):
+        """
+        Number of bytes still missing for a complete frame, assuming the
+        buffered bytes are the start of one. Always at least 1.
         """
-        Get current parameters from SteppIR controller.
 
-        The controller returns 11 bytes: We break them out into individual
-        parameters and return them to the calling function. This "get_status"
-        function is used by all functions in this library that need status
-        from the controller.
+        return max(1, self.FRAME_LENGTH - len(self))
+
 
-        This command does NOT retry automatically.
+
+    def reset(self):
+        """
+        Throw away everything buffered.
+        """
+
+        self.discarded += len(self)
+        self._start = 0
+        self._end = 0
+
+
+
+    def feed(self, data):
+        """
+        Add bytes received from the controller.
 
         Parameters:
         -----------
-        -none-
+        data: bytes
+            Received bytes, any length
 
         Returns:
         --------
-        frequency: int
-            Current frequency in Hz
+        -nothing-
+        """
 
-        active_motors
-            An 8-bit value specifying motors which are currently "busy".
-	    A value of 0xff indicates the controller is in SETUP mode or
-	    has just been given a command to process.
-		Bit 0x01 Is always a '1'
-		Bit 0x02
-		Bit 0x04 Appears to indicate AUTOTRACK mode ON/OFF?
-		Bit 0x08
-		Bit 0x10
-		Bit 0x20
-		Bit 0x40
-		Bit 0x80
+        size = len(self._buffer)
+        if len(data) > size:
+            self.discarded += len(data) - size
+            data = data[-size:]
 
-        direction
-            An 8-bit value specifying the direction the antenna is pointing:
-                0x00 Normal direction
-                0x20 3/4 wave (For vertical antennas only)
-                0x40 180 direction from normal
-                0x80 Bidirectional antenna pattern
+        # Make room at the end: Move what we have to the front, dropping the
+        # oldest bytes if that still isn't enough
+        if self._end + len(data) > size:
+            keep = min(len(self), size - len(data))
+            self.discarded += len(self) - keep
+            self._view[0:keep] = self._view[self._end - keep:self._end]
+            self._start = 0
+            self._end = keep
 
-        dir_label
-            A printable string version of the direction:
-                "Bidirectional"
-                "180 Degrees"
-                "3/4 Wave" (For vertical antennas only)
-                "Normal"
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
 
-        interface_version
-            Two ASCII chars specifying transceiver interface version
+
+
+    def next_frame(self):
         """
+        Take the next complete frame out of the buffer.
 
-        with serial.Serial(self.serial_port, 
-            self.baud_rate, 
-            self.bytesize, 
-            self.parity, 
-            self.stopbits, 
-            self.read_timeout, 
-            self.xonxoff, 
-            self.rtscts, 
-            self.write_timeout, 
-            self.dsrdtr, 
-            self.inter_byte_timeout, 
-            self.exclusive) as self.serial:
+        Returns:
+        --------
+        frame: bytes
+            11-byte status frame, or None if no complete frame is buffered yet
+        """
 
-            # Send 3-byte status command
-            self.serial.write(b'?A\r')
+        last = self.FRAME_LENGTH - 1
+        search = self._start + last
+        while True:
+            end = self._buffer.find(self.TERMINATOR, search, self._end)
+            if end < 0:
+                return None
 
-            # Controller returns 11-byte string
-            message = self.serial.read(11)
+            start = end - last
+            if self._buffer[start + 2] == 0x00:
+                frame = bytes(self._view[start:end + 1])
+                self.discarded += start - self._start
+                self._start = end + 1
+                if self._start == self._end:
+                    self._start = 0
+                    self._end = 0
+                self.frames += 1
+                return frame
 
-            # Needed to assure we don't run commands too close together
-            time.sleep(0.1)
+            # Carriage return inside the data, or garbage: Keep looking
+            search = end + 1
 
-            # Bytes at position 2, 3, 4, 5 correspond to frequency, but the first is always 0.
-            frequency = struct.unpack('>i', message[2:6])[0]
-            frequency = frequency * 10
 
-            # Active Motors. I couldn't figure out the mapping for each motor from
-            # the docs. Any info on this mapping would be appreciated. So far I'm
-            # seeing 0x07 for this parameter when the motors are busy. There are
-            # four bits defined in the docs plus another note that says this byte
-            # will get set to 0xff (all bits set) to acknowledge successful receipt
-            # of a command. For a DB18e antenna there are six stepper motors, most
-            # likely driven in pairs, so that would result in 3 bits being set if
-            # all motors are busy.
-            active_motors = message[6]
 
-            # Direction (or wavelength for verticals)
-            direction = message[7] & 0xe0
-            if direction == 0x80:
-                dir_label = "Bidirectional"
-            elif direction == 0x40:
-                dir_label = "180 degrees"
-            elif direction == 0x20:
-                dir_label = "3/4 Wave"
-            else: dir_label = "Normal"
+class SteppIRMetrics:
+    """
+    Counters, latency histograms and gauges for a SteppIR object.
+
+    Pass one to SteppIR(..., metrics=SteppIRMetrics()) to turn instrumentation
+    on. Without it (the default) the library only pays for an "is None" check
+    per call.
+
+    Counters:
+        commands            Set commands sent (set_parameters)
+        status_queries      Status queries sent
+        short_reads         Status replies that were incomplete or garbled
+        io_errors           Serial I/O errors (the port is reopened)
+        retries             Retries, by method
+        timeouts            Waits for the motors that timed out, by method
+
+    Histograms (seconds, fixed buckets):
+        method_seconds      Time spent in each public method
+        roundtrip_seconds   Raw serial exchanges, "status" or "command"
+
+    Gauges:
+        frequency_hz        Last frequency reported by the controller
+        direction           Last direction byte reported by the controller
+        active_motors       Last "ac" byte reported by the controller
+
+    Read everything with snapshot(), or export it in the Prometheus text
+    format with prometheus().
+    """
 
-            version = message[8:10]
+    # Upper bounds of the histogram buckets, in seconds
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+    _HELP = {
+        "commands": ("counter", "Set commands sent to the controller"),
+        "status_queries": ("counter", "Status queries sent to the controller"),
+        "short_reads": ("counter", "Status replies that were incomplete or garbled"),
+        "io_errors": ("counter", "Serial I/O errors"),
+        "retries": ("counter", "Command retries by method"),
+        "timeouts": ("counter", "Waits for the motors that timed out, by method"),
+        "method_seconds": ("histogram", "Time spent in each SteppIR method"),
+        "roundtrip_seconds": ("histogram", "Serial exchange round-trip time"),
+        "frequency_hz": ("gauge", "Last frequency reported by the controller"),
+        "direction": ("gauge", "Last direction byte reported by the controller"),
+        "active_motors": ("gauge", "Last active motors byte reported by the controller"),
+        }
+
+    _LABELS = {
+        "retries": "method",
+        "timeouts": "method",
+        "method_seconds": "method",
+        "roundtrip_seconds": "kind",
+        }
+
+    def __init__(self, prefix="steppir", buckets=None):
+        """
+        Parameters:
+        -----------
+        prefix: str
+            Prefix for the exported metric names
 
-            #print("Message:", hex(message[0]), hex(message[1]), hex(message[2]), hex(message[3]), hex(message[4]), hex(message[5]), hex(message[6]), hex(message[7]), hex(message[8]), hex(message[9]), hex(message[10]))
-            #print("Freq:", frequency, "\tActive Motors:", active_motors, "\tDir:", direction, "\tInterface Vers:", version)
+        buckets: tuple
+            Histogram bucket upper bounds in seconds, default BUCKETS
+        """
 
-            return frequency, active_motors, direction, dir_label, version
+        self.prefix = prefix
+        self.buckets = tuple(buckets) if buckets is not None else self.BUCKETS
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
 
 
 
-    def set_parameters(self, frequency, direction, command ):
+    def count(self, name, label=None, amount=1):
+        """
+        Add "amount" to a counter.
         """
-        Send parameters to the SteppIR controller.
 
-        Here we send exactly 10 bytes to the controller. This "set_parameters"
-        function is used by all other functions in this library that need to send
-        something to the controller. Always set a valid frequency when sending
-        the set_parameters command.
+        key = (name, label)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
 
-        This command does NOT retry automatically.
 
-        Requesting status immediately after a command: The controller sets the "ac"
-        byte (retrieved via the "get_status" command) to 0xff when it receives a
-        valid command string. It clears "ac" (minus the motor busy bits) when it is
-        done processing a command. Consider "frequency", "direction", and "ac" bytes
-        valid only when "ac" is NOT equal to 0xff. These may be SDA-2000 features
-        and not included in the SDA-100 protocol?
 
-        If "direction" is 0xc0, the byte preceeding it (called "pa", always 0x00 in
-        the code below) selects antenna pattern 0 through 15. This hasn't been tried
-        in the code yet but should correspond to hex numbers 0x00 to 0x0F. 0x00 is
-        the default direction for "pa". May be an SDA-2000 only feature?
+    def observe(self, name, label, seconds):
+        """
+        Record one latency in a histogram.
+        """
 
-        Parameters:
-        -----------
-        frequency: int
-            Frequency in Hz
+        key = (name, label)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
 
-        direction: int
-            The direction the antenna is pointing
-            0x00 = Normal direction
-            0x40 = 180 direction
-            0x80 = Bidirectional
-            0x20 = 3/4 wave (For vertical antennas only)
-	    0xc0 = Use pattern value in "pa" byte (not implemented in this library yet)
 
-        command: ascii
-            '1' = Set frequency and direction
-            'R' = Turn ON AUTOTRACK. Needed after Home/Retract to re-enable full control
-            'U' = Turn OFF AUTOTRACK
-            'S' = Home the antenna (Retract the elements into the hubs)
-            'V' = Calibrate the antenna
+
+    def set_gauge(self, name, value):
+        """
+        Set a gauge to its latest value.
+        """
+
+        with self._lock:
+            self._gauges[name] = value
+
+
+
+    def snapshot(self):
+        """
+        Copy of all metrics.
 
         Returns:
         --------
-        -nothing-
+        snapshot: dict
+            "counters": {name: value or {label: value}}
+            "histograms": {name: {label: {"buckets": {bound: cumulative count},
+                "sum": seconds, "count": n}}}
+            "gauges": {name: value}
         """
 
-        with serial.Serial(self.serial_port, 
-            self.baud_rate, 
-            self.bytesize, 
-            self.parity, 
-            self.stopbits, 
-            self.read_timeout, 
-            self.xonxoff, 
-            self.rtscts, 
-            self.write_timeout, 
-            self.dsrdtr, 
-            self.inter_byte_timeout, 
-            self.exclusive) as self.serial:
- 
-            # Scale frequency by 10
-            frequency /= 10
+        with self._lock:
+            counters = {}
+            for ((name, label), value) in self._counters.items():
+                if label is None:
+                    counters[name] = value
+                else:
+                    counters.setdefault(name, {})[label] = value
+
+            histograms = {}
+            for ((name, label), (counts, total, count)) in self._histograms.items():
+                cumulative = 0
+                buckets = {}
+                for (bound, bucket_count) in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    buckets[bound] = cumulative
+                histograms.setdefault(name, {})[label] = {"buckets": buckets, "sum": total, "count": count}
+
+            return {"counters": counters, "histograms": histograms, "gauges": dict(self._gauges)}
+
+
+
+    def prometheus(self):
+        """
+        All metrics in the Prometheus text exposition format.
+
+        Returns:
+        --------
+        text: str
+        """
+
+        snapshot = self.snapshot()
+        lines = []
+
+        def header(name):
+            (kind, text) = self._HELP.get(name, ("untyped", name))
+            metric = "%s_%s" % (self.prefix, name)
+            if kind == "counter":
+                metric += "_total"
+            lines.append("# HELP %s %s" % (metric, text))
+            lines.append("# TYPE %s %s" % (metric, kind))
+            return metric
+
+        for (name, value) in sorted(snapshot["counters"].items()):
+            metric = header(name)
+            if isinstance(value, dict):
+                for (label, label_value) in sorted(value.items()):
+                    lines.append('%s{%s="%s"} %d' % (metric, self._LABELS.get(name, "label"), label, label_value))
+            else:
+                lines.append("%s %d" % (metric, value))
+
+        for (name, series) in sorted(snapshot["histograms"].items()):
+            metric = header(name)
+            label_name = self._LABELS.get(name, "label")
+            for (label, histogram) in sorted(series.items()):
+                for (bound, count) in histogram["buckets"].items():
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket{%s="%s",le="%s"} %d' % (metric, label_name, label, le, count))
+                lines.append('%s_sum{%s="%s"} %r' % (metric, label_name, label, histogram["sum"]))
+                lines.append('%s_count{%s="%s"} %d' % (metric, label_name, label, histogram["count"]))
+
+        for (name, value) in sorted(snapshot["gauges"].items()):
+            metric = header(name)
+            lines.append("%s %r" % (metric, value))
+
+        return "\n".join(lines) + "\n"
+
+
+
+class TravelModel:
+    """
+    Learns how long the antenna takes to finish a move, so completion polls
+    can be scheduled near the finish instead of from the moment the command
+    is sent.
+
+    Each operation is recorded as (start frequency, end frequency, direction
+    changed, seconds until done) under a kind: "tune" for frequency and
+    direction changes, "retract" and "calibrate". Per kind the model fits
+
+        seconds = a + b * |end - start| in MHz + c * (1 if the direction changed)
+
+    by least squares over the most recent samples. Retracting runs the
+    elements in from the start frequency, so retract and calibrate samples
+    are recorded with an end frequency of 0.
+
+    Give one to each SteppIR (the fit belongs to one antenna) with
+    SteppIR(..., travel_model=TravelModel.load("db18e.json")). With a path
+    the samples and fit are saved every SAVE_EVERY operations and when the
+    SteppIR is closed (flush()); export() returns the same data for
+    inspection.
+    """
+
+    # Fit a kind once it has this many samples
+    MIN_SAMPLES = 3
+
+    # Keep this many recent samples per kind
+    MAX_SAMPLES = 200
+
+    # Poll first at this fraction of the predicted time. A first poll that
+    # finds the move already done records a shorter time, so the model
+    # corrects itself downwards as well as upwards.
+    EARLY = 0.8
+
+    # Wait up to this multiple of the predicted time for the motors to stop,
+    # or MAX_TRAVEL seconds until there is a prediction
+    TIMEOUT_FACTOR = 2.0
+    MAX_TRAVEL = 60.0
+
+    # Save to "path" after this many new samples (and on flush())
+    SAVE_EVERY = 10
+
+    def __init__(self, path=None):
+        """
+        Parameters:
+        -----------
+        path: str
+            Optional. File the model is saved to as operations are
+            recorded.
+        """
+
+        self.path = path
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._coefficients = {}
+
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a model saved by save(). A missing file gives an empty model
+        that will be saved to "path".
+        """
+
+        model = cls(path)
+        try:
+            with open(path) as input_file:
+                data = json.load(input_file)
+        except FileNotFoundError:
+            return model
+
+        for (kind, entry) in data.get("models", {}).items():
+            model._samples[kind] = [tuple(sample) for sample in entry.get("samples", [])][-cls.MAX_SAMPLES:]
+            model._fit(kind)
+        return model
+
+
+
+    def export(self):
+        """
+        The samples and fitted coefficients as a dict, the same layout save()
+        writes:
+
+            {"version": 1, "models": {kind: {
+                "coefficients": [a, b, c] or None,
+                "samples": [[start_hz, end_hz, direction_changed, seconds], ...]}}}
+        """
+
+        with self._lock:
+            models = {}
+            for (kind, samples) in self._samples.items():
+                coefficients = self._coefficients.get(kind)
+                models[kind] = {
+                    "coefficients": list(coefficients) if coefficients is not None else None,
+                    "samples": [list(sample) for sample in samples],
+                    }
+            return {"version": 1, "models": models}
+
+
+
+    def save(self, path=None):
+        """
+        Write the model to "path" (default the path it was created with). The
+        file is replaced atomically, so a crash never leaves half a model.
+        """
+
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the travel model to")
+
+        with self._lock:
+            self._unsaved = 0
+        data = self.export()
+        temporary = path + ".tmp"
+        with open(temporary, 'w') as output:
+            json.dump(data, output, indent=1)
+        os.replace(temporary, path)
+
+
+
+    def flush(self):
+        """
+        Save the model if it has a path and samples that aren't saved yet.
+        """
+
+        with self._lock:
+            unsaved = self._unsaved
+        if (self.path is not None) and unsaved:
+            self.save()
+
+
+
+    def timeout(self, expected):
+        """
+        Seconds to wait for the motors to stop on a move predicted to take
+        "expected" seconds (None if there is no prediction yet).
+        """
+
+        if expected is None:
+            return self.MAX_TRAVEL
+        return min(self.MAX_TRAVEL, max(1.0, expected * self.TIMEOUT_FACTOR))
+
+
+
+    @staticmethod
+    def _features(start, end, direction_changed):
+        return (1.0, abs(end - start) / 1e6, 1.0 if direction_changed else 0.0)
+
+
+
+    def _fit(self, kind):
+        """
+        Least squares fit of one kind's samples. Called with the lock held.
+        """
+
+        samples = self._samples.get(kind, [])
+        if len(samples) < self.MIN_SAMPLES:
+            self._coefficients.pop(kind, None)
+            return
+
+        # Normal equations, with a little ridge so a feature that never
+        # varies (say, no direction changes yet) doesn't make them singular
+        matrix = [[0.0] * 3 for i in range(3)]
+        vector = [0.0] * 3
+        for (start, end, direction_changed, seconds) in samples:
+            x = self._features(start, end, direction_changed)
+            for i in range(3):
+                vector[i] += x[i] * seconds
+                for j in range(3):
+                    matrix[i][j] += x[i] * x[j]
+        for i in range(3):
+            matrix[i][i] += 1e-6
+
+        # Gaussian elimination with partial pivoting
+        for column in range(3):
+            pivot = max(range(column, 3), key=lambda row: abs(matrix[row][column]))
+            (matrix[column], matrix[pivot]) = (matrix[pivot], matrix[column])
+            (vector[column], vector[pivot]) = (vector[pivot], vector[column])
+            for row in range(column + 1, 3):
+                factor = matrix[row][column] / matrix[column][column]
+                for j in range(column, 3):
+                    matrix[row][j] -= factor * matrix[column][j]
+                vector[row] -= factor * vector[column]
+        coefficients = [0.0] * 3
+        for row in (2, 1, 0):
+            total = vector[row] - sum(matrix[row][j] * coefficients[j] for j in range(row + 1, 3))
+            coefficients[row] = total / matrix[row][row]
+
+        self._coefficients[kind] = tuple(coefficients)
+
+
+
+    def record(self, kind, start, end, direction_changed, seconds):
+        """
+        Add one finished operation and refit its kind.
+
+        Parameters:
+        -----------
+        kind: str
+            "tune", "retract" or "calibrate"
+
+        start: int
+            Frequency in Hz before the operation
+
+        end: int
+            Frequency in Hz after the operation (0 for retract/calibrate)
+
+        direction_changed: Boolean
+            True if the operation changed the direction
+
+        seconds: float
+            Time from sending the command until the controller reported the
+            motors stopped
+        """
+
+        with self._lock:
+            samples = self._samples.setdefault(kind, [])
+            samples.append((int(start), int(end), bool(direction_changed), float(seconds)))
+            del samples[:-self.MAX_SAMPLES]
+            self._fit(kind)
+            self._unsaved += 1
+            unsaved = self._unsaved
+
+        if (self.path is not None) and (unsaved >= self.SAVE_EVERY):
+            self.save()
+
+
+
+    def predict(self, kind, start, end, direction_changed):
+        """
+        Predicted seconds for an operation, or None until the kind has
+        MIN_SAMPLES samples.
+        """
+
+        with self._lock:
+            coefficients = self._coefficients.get(kind)
+        if coefficients is None:
+            return None
+
+        x = self._features(start, end, direction_changed)
+        return max(0.0, sum(c * f for (c, f) in zip(coefficients, x)))
+
+
+
+def _timed(method):
+    """
+    Decorator for SteppIR methods: Records the time spent in the method in
+    the "method_seconds" histogram when metrics are enabled.
+    """
+
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            metrics.observe("method_seconds", name, time.perf_counter() - start)
+
+    return wrapper
+
+
+
+class HomingOperation:
+    """
+    Handle for a retract or calibrate, returned by SteppIR.start_retract()
+    and SteppIR.start_calibrate().
+
+    The operation runs on its own thread. While it runs, commands from other
+    threads are refused with HomingInProgress; status queries still work.
+
+    Progress callbacks are called with the operation after every status read
+    (on the operation's thread, so GUIs should hand the update over to their
+    own thread). "status", "active_motors", "elapsed" and "remaining" can also
+    be read at any time.
+    """
+
+    def __init__(self, kind, abort=None):
+        """
+        Parameters:
+        -----------
+        kind: str
+            "retract" or "calibrate"
+
+        abort: threading.Event
+            Optional. Event that cancels the operation, default a new one
+        """
+
+        self.kind = kind
+        self.thread = None
+        self.status = None
+        self.expected = None
+        self.started = time.monotonic()
+        self._abort = abort if abort is not None else threading.Event()
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._error = None
+        self._progress_callbacks = []
+        self._done_callbacks = []
+
+
+
+    def __repr__(self):
+        state = "done" if self.done() else "running"
+        return "HomingOperation(%s, %s, %.1fs)" % (self.kind, state, self.elapsed)
+
+
+
+    @property
+    def active_motors(self):
+        """
+        The "ac" byte from the last status read, None before the first one.
+        """
+
+        return None if self.status is None else self.status.active_motors
+
+
+
+    @property
+    def elapsed(self):
+        """
+        Seconds since the operation started.
+        """
+
+        return time.monotonic() - self.started
+
+
+
+    @property
+    def remaining(self):
+        """
+        Estimated seconds until done, from the SteppIR's TravelModel. None
+        without a model or before it has learned this kind of operation.
+        """
+
+        if self.expected is None:
+            return None
+        return max(0.0, self.expected - self.elapsed)
+
+
+
+    def add_progress_callback(self, callback):
+        """
+        Call "callback(operation)" after every status read.
+        """
+
+        with self._lock:
+            self._progress_callbacks.append(callback)
+
+
+
+    def add_done_callback(self, callback):
+        """
+        Call "callback(operation)" when the operation finishes, or right away
+        if it already has.
+        """
+
+        with self._lock:
+            if not self._finished.is_set():
+                self._done_callbacks.append(callback)
+                return
+        callback(self)
+
+
+
+    def cancel(self):
+        """
+        Stop waiting for the motors. The controller keeps moving them, but
+        the SteppIR object accepts other commands again.
+
+        Returns:
+        --------
+        cancelled: Boolean
+            False if the operation had already finished
+        """
+
+        if self._finished.is_set():
+            return False
+        self._abort.set()
+        return True
+
+
+
+    def cancelled(self):
+        return isinstance(self._error, CommandAborted)
+
+
+
+    def done(self):
+        return self._finished.is_set()
+
+
+
+    def wait(self, timeout=None):
+        """
+        Wait for the operation to finish. Returns True if it has.
+        """
+
+        return self._finished.wait(timeout)
+
+
+
+    def result(self, timeout=None):
+        """
+        Wait for the operation and return the last status read.
+
+        Raises TimeoutError if it is still running after "timeout" seconds,
+        CommandAborted if it was cancelled, or the error it failed with.
+        """
+
+        if not self._finished.wait(timeout):
+            raise TimeoutError("%s still running after %.1f seconds" % (self.kind, self.elapsed))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+
+    def _report(self, status, elapsed, remaining):
+        """
+        Progress hook for wait_for_completion().
+        """
+
+        self.status = status
+        with self._lock:
+            callbacks = list(self._progress_callbacks)
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as error:
+                print("Progress callback failed:", error)
+
+
+
+    def _finish(self, result=None, error=None):
+        with self._lock:
+            self._result = result
+            self._error = error
+            self._finished.set()
+            callbacks = self._done_callbacks
+            self._done_callbacks = []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as error:
+                print("Done callback failed:", error)
+
+
+
+def _set_keepalive(sock, idle=10, interval=5, count=3):
+    """
+    Turn on TCP keep-alive so a dead link to a remote controller is noticed
+    in about idle + interval * count seconds instead of hours. The timing
+    options are only set where the platform has them.
+    """
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for (option, value) in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+
+class TCPTransport:
+    """
+    Raw TCP connection to a serial server (ser2net, a terminal server, ...)
+    that looks enough like a serial.Serial port for SteppIR. Used for
+    "socket://host:port" URLs.
+
+    Nagle is turned off so the short commands go out at once, keep-alive
+    catches dead links, and read() works to a deadline for the whole request
+    the way a serial port does, however the reply is split into segments.
+    """
+
+    def __init__(self, host, port, timeout=2.0, write_timeout=2.0, connect_timeout=5.0):
+        """
+        Parameters:
+        -----------
+        host: str
+            Host name or address of the serial server
+
+        port: int
+            TCP port
+
+        timeout: float
+            Read timeout in seconds, None to wait forever
+
+        write_timeout: float
+            Write timeout in seconds, None to wait forever
+
+        connect_timeout: float
+            Timeout for establishing the connection in seconds
+        """
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.connect_timeout = connect_timeout
+        self.is_open = False
+        self._socket = None
+        self._buffer = bytearray()
+
+
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """
+        Create a transport for "socket://host:port".
+        """
+
+        parts = urllib.parse.urlsplit(url)
+        if (parts.scheme != "socket") or not parts.hostname or not parts.port:
+            raise ValueError("Expected socket://host:port, not %r" % (url,))
+        return cls(parts.hostname, parts.port, **kwargs)
+
+
+
+    def open(self):
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        except OSError as error:
+            raise serial.SerialException("Could not connect to %s:%d: %s" % (self.host, self.port, error))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _set_keepalive(sock)
+        self._socket = sock
+        self._buffer.clear()
+        self.is_open = True
+        return self
+
+
+
+    def close(self):
+        self.is_open = False
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            finally:
+                self._socket = None
+
+
+
+    def _receive(self, timeout):
+        """
+        Append whatever arrives within "timeout" seconds to the buffer.
+        """
+
+        self._socket.settimeout(timeout)
+        try:
+            data = self._socket.recv(4096)
+        except (socket.timeout, BlockingIOError):
+            return
+        if not data:
+            raise serial.SerialException("Connection closed by %s:%d" % (self.host, self.port))
+        self._buffer += data
+
+
+
+    @property
+    def in_waiting(self):
+        self._receive(0.0)
+        return len(self._buffer)
+
+
+
+    def reset_input_buffer(self):
+        while self.in_waiting:
+            self._buffer.clear()
+
+
+
+    def read(self, size=1):
+        """
+        Read "size" bytes, or fewer if the timeout runs out first.
+        """
+
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+        while len(self._buffer) < size:
+            if self.timeout is None:
+                remaining = None
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            self._receive(remaining)
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+
+    def write(self, data):
+        self._socket.settimeout(self.write_timeout)
+        try:
+            self._socket.sendall(data)
+        except socket.timeout:
+            raise serial.SerialTimeoutException("Write timeout to %s:%d" % (self.host, self.port))
+        return len(data)
+
+
+
+# Capture files: A header line, then one record per read or write:
+#   timestamp (time.monotonic(), double) | kind (b'W', b'R' or b'O') | length (uint16) | data
+# 'O' marks the port being (re)opened, its data is the port name.
+CAPTURE_HEADER = b'SteppIR capture 1\n'
+CAPTURE_RECORD = struct.Struct('>dcH')
+
+
+
+class CaptureTap:
+    """
+    Records every byte SteppIR writes to and reads from the controller, with
+    monotonic timestamps, in an append-only capture file. Replay the file
+    with ReplayTransport ("replay://" URLs).
+
+    Pass one to SteppIR(..., capture=CaptureTap("field.cap")). Records are
+    flushed as they are written, so a capture survives a crash up to the
+    last exchange.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_HEADER)
+            self._file.flush()
+
+
+
+    def record(self, kind, data):
+        """
+        Append one record. "kind" is b'W' (written), b'R' (read) or b'O'
+        (port opened).
+        """
+
+        if not data and kind != b'O':
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(CAPTURE_RECORD.pack(time.monotonic(), kind, len(data)) + data)
+            self._file.flush()
+
+
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+
+    def __enter__(self):
+        return self
+
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+
+def read_capture(path):
+    """
+    Read a capture file written by CaptureTap.
+
+    Returns:
+    --------
+    records: list
+        (timestamp, kind, data) tuples in the order they were recorded
+    """
+
+    with open(path, 'rb') as input_file:
+        content = input_file.read()
+    if not content.startswith(CAPTURE_HEADER):
+        raise ValueError("%s is not a SteppIR capture file" % (path,))
+
+    records = []
+    offset = len(CAPTURE_HEADER)
+    while offset + CAPTURE_RECORD.size <= len(content):
+        (timestamp, kind, length) = CAPTURE_RECORD.unpack_from(content, offset)
+        offset += CAPTURE_RECORD.size
+        data = content[offset:offset + length]
+        if len(data) < length:
+            # Truncated by a crash mid-write
+            break
+        offset += length
+        records.append((timestamp, kind, data))
+    return records
+
+
+
+class _TappedPort:
+    """
+    Wraps an open port and copies everything written and read to a
+    CaptureTap.
+    """
+
+    def __init__(self, port, tap):
+        self.port = port
+        self.tap = tap
+
+    @property
+    def is_open(self):
+        return self.port.is_open
+
+    @property
+    def in_waiting(self):
+        return self.port.in_waiting
+
+    def read(self, size=1):
+        data = self.port.read(size)
+        self.tap.record(b'R', data)
+        return data
+
+    def write(self, data):
+        self.tap.record(b'W', data)
+        return self.port.write(data)
+
+    def close(self):
+        self.port.close()
+
+
+
+class ReplayTransport:
+    """
+    Plays a capture file back to SteppIR in place of the controller. Used
+    for "replay://path?speed=N" URLs.
+
+    Each write moves on to the next write in the capture, and the reads
+    recorded after it are returned in order. A read that finds no more
+    recorded data before the next write comes back short, the way the real
+    read timed out in the recording. Writes that differ from the recording
+    are counted in "mismatches" but replay carries on; writing past the end
+    of the capture raises EOFError.
+
+    The transport keeps its own clock on the recording's time line, and
+    SteppIR uses it (for pacing, timeouts and polling) while replaying, so
+    the library makes the same decisions it made live at any speed. "speed"
+    scales how fast that clock runs against the wall clock: 1 replays in
+    real time, 10 ten times faster, 0 as fast as possible.
+    """
+
+    def __init__(self, path, speed=1.0, timeout=2.0):
+        """
+        Parameters:
+        -----------
+        path: str
+            Capture file written by CaptureTap
+
+        speed: float
+            Replay speed, 0 for as fast as possible
+
+        timeout: float
+            Read timeout in seconds of recorded time
+        """
+
+        self.path = path
+        self.speed = speed
+        self.timeout = timeout
+        self.records = [record for record in read_capture(path) if record[1] != b'O']
+        self.is_open = False
+        self.writes = 0
+        self.mismatches = 0
+        self._cursor = 0
+        self._partial = b''
+        self.now = self.records[0][0] if self.records else 0.0
+
+
+
+    @classmethod
+    def from_url(cls, url, timeout=2.0):
+        """
+        Create a transport for "replay://path[?speed=N]".
+        """
+
+        parts = urllib.parse.urlsplit(url)
+        path = parts.netloc + parts.path
+        if not path:
+            raise ValueError("Expected replay://path, not %r" % (url,))
+        query = urllib.parse.parse_qs(parts.query)
+        return cls(path, float(query.get("speed", ["1"])[0]), timeout)
+
+
+
+    def open(self):
+        self.is_open = True
+        return self
+
+
+
+    def close(self):
+        self.is_open = False
+
+
+
+    def clock(self):
+        """
+        Current time on the recording's time line.
+        """
+
+        return self.now
+
+
+
+    def _advance(self, until):
+        if until > self.now:
+            if self.speed:
+                time.sleep((until - self.now) / self.speed)
+            self.now = until
+
+
+
+    def sleep(self, seconds):
+        self._advance(self.now + seconds)
+
+
+
+    def _next_read(self):
+        """
+        The next recorded read before the next write, or None.
+        """
+
+        if self._cursor < len(self.records) and self.records[self._cursor][1] == b'R':
+            return self.records[self._cursor]
+        return None
+
+
+
+    @property
+    def in_waiting(self):
+        # Reads recorded before the next write were of bytes already waiting
+        waiting = len(self._partial)
+        index = self._cursor
+        while index < len(self.records) and self.records[index][1] == b'R':
+            waiting += len(self.records[index][2])
+            index += 1
+        return waiting
+
+
+
+    def read(self, size=1):
+        data = bytearray(self._partial)
+        while len(data) < size:
+            record = self._next_read()
+            if record is None:
+                # Nothing more came in the recording: The read timed out
+                self.sleep(self.timeout)
+                break
+            self._advance(record[0])
+            data += record[2]
+            self._cursor += 1
+
+        self._partial = bytes(data[size:])
+        return bytes(data[:size])
+
+
+
+    def write(self, data):
+        # Whatever was recorded before this write but not read now is gone
+        self._partial = b''
+        while self._next_read() is not None:
+            self._cursor += 1
+
+        if self._cursor >= len(self.records):
+            raise EOFError("End of capture %s after %d writes" % (self.path, self.writes))
+
+        (timestamp, kind, recorded) = self.records[self._cursor]
+        self._cursor += 1
+        self.writes += 1
+        if bytes(data) != recorded:
+            self.mismatches += 1
+
+        self._advance(timestamp)
+        return len(data)
+
+
+
+def _open_tty(step):
+    """
+    Open a local serial port.
+    """
+
+    return serial.Serial(step.serial_port,
+        step.baud_rate,
+        step.bytesize,
+        step.parity,
+        step.stopbits,
+        step.read_timeout,
+        step.xonxoff,
+        step.rtscts,
+        step.write_timeout,
+        step.dsrdtr,
+        step.inter_byte_timeout,
+        step.exclusive)
+
+
+
+def _open_socket(step):
+    """
+    Open a socket://host:port URL with TCPTransport.
+    """
+
+    return TCPTransport.from_url(step.serial_port, timeout=step.read_timeout,
+        write_timeout=step.write_timeout).open()
+
+
+
+def _open_url(step):
+    """
+    Open any other URL pyserial knows (rfc2217://, loop://, spy://, ...).
+    Network connections get keep-alive; pyserial's RFC 2217 client already
+    turns Nagle off.
+    """
+
+    port = serial.serial_for_url(step.serial_port,
+        baudrate=step.baud_rate,
+        bytesize=step.bytesize,
+        parity=step.parity,
+        stopbits=step.stopbits,
+        timeout=step.read_timeout,
+        xonxoff=step.xonxoff,
+        rtscts=step.rtscts,
+        write_timeout=step.write_timeout,
+        dsrdtr=step.dsrdtr,
+        inter_byte_timeout=step.inter_byte_timeout)
+
+    sock = getattr(port, "_socket", None)
+    if sock is not None:
+        _set_keepalive(sock)
+    return port
+
+
+
+def _open_replay(step):
+    """
+    Open a replay://path?speed=N URL with ReplayTransport.
+    """
+
+    return ReplayTransport.from_url(step.serial_port, step.read_timeout).open()
+
+
+
+# How SteppIR.open() reaches the controller, by URL scheme. Anything without
+# "://" is a local serial port, schemes not listed here go to pyserial's
+# serial_for_url(). Add your own with register_transport().
+TRANSPORTS = {
+    "socket": _open_socket,
+    "replay": _open_replay,
+    }
+
+
+
+def register_transport(scheme, opener):
+    """
+    Add a transport for URLs starting with "scheme://".
+
+    Parameters:
+    -----------
+    scheme: str
+        URL scheme, e.g. "socket"
+
+    opener: function
+        Called with the SteppIR object, returns an open port that has
+        read(), write(), in_waiting, is_open and close() like serial.Serial
+    """
+
+    TRANSPORTS[scheme] = opener
+
+
+
+def open_transport(step):
+    """
+    Open the port or URL in step.serial_port with the matching transport.
+    """
+
+    if "://" not in step.serial_port:
+        return _open_tty(step)
+    scheme = step.serial_port.split("://", 1)[0]
+    return TRANSPORTS.get(scheme, _open_url)(step)
+
+
+
+# Baud rates the controller's Data Out port can be set to
+BAUD_RATES = (1200, 2400, 4800, 9600, 19200)
+
+
+
+def probe_baudrate(port, baudrate, samples=20, timeout=None, give_up=3):
+    """
+    Send status queries to the controller at one baud rate and count the
+    valid replies. Run it while the antenna is idle: A reply that differs
+    from the others counts as an error. Replies while the motors are running
+    (their frequency changes from one to the next) are left out of the
+    count and reported as "moving".
+
+    Parameters:
+    -----------
+    port: str
+        Serial port or URL
+
+    baudrate: int
+        Baud rate to try
+
+    samples: int
+        Number of status queries to send
+
+    timeout: float
+        Read timeout per reply in seconds, default long enough for the
+        reply at this rate plus the controller's turnaround
+
+    give_up: int
+        Stop early after this many failures in a row with no valid reply
+        yet: Nothing answers at a wrong rate.
+
+    Returns:
+    --------
+    result: dict
+        "sent", "valid" and "error_rate" (failed / sent), and "moving": The
+        number of replies left out because the motors were running
+    """
+
+    if timeout is None:
+        timeout = 0.2 + 2 * StatusDecoder.FRAME_LENGTH * 10.0 / baudrate
+
+    sent = 0
+    moving = 0
+    frames = {}
+    with serial.serial_for_url(port, baudrate=baudrate, timeout=timeout, write_timeout=timeout) as link:
+        link.reset_input_buffer()
+        for i in range(samples):
+            start = time.monotonic()
+            sent += 1
+            link.write(b'?A\r')
+            frame = link.read(StatusDecoder.FRAME_LENGTH)
+            if (len(frame) == StatusDecoder.FRAME_LENGTH) and (frame[-1] == StatusDecoder.TERMINATOR) \
+                    and (frame[2] == 0x00):
+                if StatusFrame.decode(frame).active_motors:
+                    sent -= 1
+                    moving += 1
+                else:
+                    frames[frame] = frames.get(frame, 0) + 1
+            else:
+                link.reset_input_buffer()
+                if (not frames) and (sent >= give_up):
+                    break
+
+            # Stay within the controller's status rate limit
+            delay = start + SteppIR.status_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    # The protocol has no checksum, but an idle controller sends the same
+    # reply every time: Anything other than the most common one is corrupt
+    valid = max(frames.values()) if frames else 0
+    return {"sent": sent, "valid": valid, "error_rate": (sent - valid) / sent if sent else 0.0,
+        "moving": moving}
+
+
+
+def discover_baudrate(port, rates=BAUD_RATES, samples=20, cache=None, quick=False):
+    """
+    Find the baud rate the controller is set to, measure how clean the link
+    is at that rate, and recommend the fastest rate that has been clean.
+
+    The controller answers at exactly one rate, the one set on its front
+    panel; the protocol can't change it. The rate found last time (from
+    "cache") is tried first. Measurements are kept in the cache across runs,
+    so after trying the controller at a few settings the recommendation is
+    the fastest rate that gave no errors on this cable. A measurement taken
+    while the antenna was moving isn't kept: The replies differ anyway.
+
+    Parameters:
+    -----------
+    port: str
+        Serial port or URL
+
+    rates: tuple
+        Baud rates to try
+
+    samples: int
+        Status queries per rate
+
+    cache: str
+        Optional. JSON file to remember the rate and measurements in
+
+    quick: Boolean
+        Just check the rate from the cache with a single query and return
+        it if the controller answers, without measuring or saving anything.
+        The other rates are only tried if it doesn't.
+
+    Returns:
+    --------
+    result: dict
+        "baudrate": The rate the controller answered at, None if none did
+        "rates": {rate: probe_baudrate() result} for the rates tried now
+        "recommended": The fastest rate with no errors over all runs, None
+            if there is none yet
+        "history": {rate: {"sent", "valid"}} totals over all runs
+    """
+
+    data = {}
+    if cache is not None:
+        try:
+            with open(cache) as input_file:
+                data = json.load(input_file)
+        except FileNotFoundError:
+            pass
+    entry = data.setdefault("ports", {}).setdefault(port, {})
+    history = entry.setdefault("measurements", {})
+
+    # Last known rate first
+    known = entry.get("baudrate")
+    order = sorted(rates, key=lambda rate: rate != known)
+
+    found = None
+    results = {}
+    if quick and (known in rates):
+        result = probe_baudrate(port, known, 1)
+        results[known] = result
+        if result["valid"] or result["moving"]:
+            found = known
+
+    if found is None:
+        for rate in order:
+            result = probe_baudrate(port, rate, samples)
+            results[rate] = result
+            if result["valid"] or result["moving"]:
+                found = rate
+                break
+
+    save = (found is not None) and (found != known or not quick)
+    if save and not results[found]["moving"]:
+        totals = history.setdefault(str(found), {"sent": 0, "valid": 0})
+        totals["sent"] += results[found]["sent"]
+        totals["valid"] += results[found]["valid"]
+    if found is not None:
+        entry["baudrate"] = found
+
+    clean = [int(rate) for (rate, totals) in history.items() if totals["sent"] and totals["valid"] == totals["sent"]]
+    recommended = max(clean) if clean else None
+
+    if save and (cache is not None):
+        temporary = cache + ".tmp"
+        with open(temporary, 'w') as output:
+            json.dump(data, output, indent=1, sort_keys=True)
+        os.replace(temporary, cache)
+
+    return {"baudrate": found, "rates": results, "recommended": recommended,
+        "history": {int(rate): dict(totals) for (rate, totals) in history.items()}}
+
+
+
+class SteppIR:
+    """
+    Serial interface for controlling SteppIR controllers like the SDA-100.
+
+    For details on the serial interface, see "Transceiver interface operation
+    for Steppir"
+    (https://consumer.steppir.com/wp-content/uploads/2011/10/Transceiver-Interface-Operation-5-28-09.pdf).
+
+    Note: The document is no longer available from SteppIR, but versions can
+    still be found around the 'net. The most recent one found:
+    Transceiver-Interface-Operation-6_23_2011.pdf
+
+    For the SDA-2000 controller there is a protocol document dated 10/09/2018
+    that is otherwise similar to the above documents but included a few more
+    protocol details that may only be found in the SDA-2000 controller.
+    """
+
+    # Class variables
+    serial_port = None
+    baud_rate = None
+    bytesize = None
+    parity = None
+    stopbits = None
+    read_timeout = None
+    xonxoff = None
+    rtscts = None
+    write_timeout = None
+    dsrdtr = None
+    inter_byte_timeout = None
+    exclusive = None
+    serial = None
+    command_gap = 0.1
+    status_interval = 0.1
+    status_ttl = 0.0
+    completion_timeout = 1.5
+    autotrack = None
+    metrics = None
+    travel_model = None
+    capture = None
+    baud_cache = None
+
+    # Reconnect backoff after the port fails to open: reconnect_base seconds,
+    # doubling per failure up to reconnect_max
+    reconnect_base = 0.25
+    reconnect_max = 30.0
+
+
+
+    def __init__(self, port, baudrate, bytesize, parity, stopbits, read_timeout, xonxoff, rtscts, write_timeout, dsrdtr, inter_byte_timeout, exclusive, command_gap=0.1, status_interval=0.1, status_ttl=0.0, metrics=None, travel_model=None, capture=None, baud_cache=None, completion_timeout=1.5):
+        """
+        Set serial parameters.
+
+        Parameters:
+        -----------
+        serial_interface: str
+            Path to serial interface, e.g. /dev/ttyUSB0, or a URL for a
+            remote one: "socket://host:port" for a raw TCP serial server,
+            "rfc2217://host:port" for an RFC 2217 server, or any other
+            pyserial URL such as "loop://". See TRANSPORTS.
+
+        baud_rate: int
+            Baud rate, must match baud rate set in controller. None to find
+            it with discover_baudrate() when the port is first opened.
+
+        bytesize: int
+            Should be 8
+
+        parity: str
+            Should be 'N'
+
+        stopbits: int
+            Should be 1
+
+        read_timeout: float
+            Serial read timeout in seconds, float
+
+        xonxoff: Boolean
+            Software handshaking, should be False
+
+        rtscts: Boolean
+            RTS/CTS hardware handshaking, should be False
+
+        write_timeout: float
+            Serial write timeout in seconds, float
+
+        dsrdtr: Boolean
+            DSR/DTR Hardware handshaking, should be False
+
+        inter_byte_timeout: float
+            Should be None
+
+        exclusive: Boolean
+            Serial port exclusive access, should be False
+
+        command_gap: float
+            Minimum time in seconds between the end of one exchange with the
+            controller and the start of the next. The protocol docs call for
+            at least 100ms. Firmware that handles commands faster can use a
+            smaller value.
+
+        status_interval: float
+            Minimum time in seconds between the start of two status queries.
+            0.1 keeps us at or below the 10 status queries per second the
+            controller can handle.
+
+        status_ttl: float
+            How long in seconds a status reply may be reused by get_status()
+            before the controller is asked again. 0 disables the cache, but
+            concurrent status requests are still shared.
+
+        metrics: SteppIRMetrics
+            Optional. Collects counters, latency histograms and gauges. None
+            (the default) turns instrumentation off.
+
+        travel_model: TravelModel
+            Optional. Learns how long moves take on this antenna and delays
+            the first completion poll until shortly before the predicted
+            finish. None (the default) polls from the start.
+
+        capture: CaptureTap
+            Optional. Records all serial traffic to a capture file that can
+            be replayed later with a "replay://" URL.
+
+        baud_cache: str
+            Optional. JSON file where discover_baudrate() remembers the rate
+            it found, when "baud_rate" is None
+
+        completion_timeout: float
+            Default time in seconds wait_for_completion() waits for the
+            controller to show a command, and so how long set_frequency(),
+            apply() and the set_dir_*() methods wait before sending it again.
+            The controller can take up to a second to reflect a SET in its
+            status, so this needs to be comfortably longer than that.
+        """
+
+        # Set the Class variables based on the parameters received
+        self.serial_port = port
+        self.baud_rate = baudrate
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self.read_timeout = read_timeout
+        self.xonxoff = xonxoff
+        self.rtscts = rtscts
+        self.write_timeout = write_timeout
+        self.dsrdtr = dsrdtr
+        self.inter_byte_timeout = inter_byte_timeout
+        self.exclusive = exclusive
+        self.baud_cache = baud_cache
+
+        # The serial port is opened lazily on first use and then kept open
+        # across calls. The lock serializes access from multiple threads.
+        self.serial = None
+        self._lock = threading.RLock()
+        self._decoder = StatusDecoder()
+        self._open_failures = 0
+        self._open_error = None
+        self._reopen_at = 0.0
+
+        # Pacing between commands. Timestamps come from the monotonic clock
+        # and start at "now" so a command sent right after construction still
+        # respects the gap. A replay transport swaps in its own clock.
+        self._clock = time.monotonic
+        self._sleep = time.sleep
+        self.command_gap = command_gap
+        self.status_interval = status_interval
+        self.completion_timeout = completion_timeout
+        self._last_command = self._clock()
+        self._last_status = self._last_command
+
+        # Instrumentation, off unless a SteppIRMetrics object is given
+        self.metrics = metrics
+
+        # Learned motor travel times, off unless a TravelModel is given
+        self.travel_model = travel_model
+
+        # Retract or calibrate in progress, see start_retract()
+        self._homing = None
+
+        # AUTOTRACK as we last set it: None until a command says, False after
+        # AUTOTRACK OFF or a retract (the controller ignores tuning then)
+        self.autotrack = None
+
+        # Traffic capture, off unless a CaptureTap is given
+        self.capture = capture
+
+        # Status cache, shared between threads
+        self.status_ttl = status_ttl
+        self._status_cond = threading.Condition()
+        self._status = None
+        self._status_time = None
+        self._status_epoch = 0
+        self._status_query_epoch = None
+        self._status_generation = 0
+        self._status_inflight = False
+
+
+
+    def open(self):
+        """
+        Open the serial port if it isn't open already. Calling this is
+        optional: The port is opened automatically on first use and then kept
+        open across calls until close() is called.
+
+        After a failed open, further attempts fail straight away until a
+        backoff delay has passed ("reconnect_base" seconds, doubling with
+        each failure up to "reconnect_max").
+
+        Parameters:
+        -----------
+        -none-
+
+        Returns:
+        --------
+        port: serial.Serial
+            The open serial port
+        """
+
+        with self._lock:
+            if self.serial is None or not self.serial.is_open:
+                # Back off after failures, so a controller that is down
+                # (say, a remote link) isn't hammered with reconnects
+                now = time.monotonic()
+                if now < self._reopen_at:
+                    raise serial.SerialException("%s unavailable (%s), retrying in %.1f seconds"
+                        % (self.serial_port, self._open_error, self._reopen_at - now))
+                try:
+                    if (self.baud_rate is None) and (self.serial_port.split("://", 1)[0] not in TRANSPORTS):
+                        self._discover_baudrate()
+                    self.serial = open_transport(self)
+                except (serial.SerialException, OSError) as error:
+                    self._open_error = error
+                    self._open_failures += 1
+                    self._reopen_at = now + min(self.reconnect_max, self.reconnect_base * 2 ** (self._open_failures - 1))
+                    raise
+                self._open_failures = 0
+                self._reopen_at = 0.0
+
+                # Replays run on the recording's time line, which starts
+                # with the first exchange: No pacing delay before it
+                clock = getattr(self.serial, "clock", None)
+                if clock is not None:
+                    self._clock = clock
+                    self._sleep = self.serial.sleep
+                    self._last_command = self._last_status = clock() - max(self.command_gap, self.status_interval)
+                    self._invalidate_status()
+
+                if self.capture is not None:
+                    self.capture.record(b'O', self.serial_port.encode('utf-8', 'replace'))
+                    self.serial = _TappedPort(self.serial, self.capture)
+            return self.serial
+
+
+
+    def _discover_baudrate(self):
+        """
+        Find the controller's baud rate. The one in "baud_cache" is taken
+        if the controller answers a single query at it, the others are only
+        measured when it doesn't.
+        """
+
+        result = discover_baudrate(self.serial_port, samples=5, cache=self.baud_cache, quick=True)
+        if result["baudrate"] is None:
+            raise serial.SerialException("No controller answered on %s at %s baud" % (self.serial_port,
+                ", ".join(str(rate) for rate in result["rates"])))
+        self.baud_rate = result["baudrate"]
+
+
+
+    def close(self):
+        """
+        Close the serial port. It will be reopened automatically by the next
+        command sent to the controller.
+
+        Parameters:
+        -----------
+        -none-
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        with self._lock:
+            if self.serial is not None:
+                try:
+                    self.serial.close()
+                finally:
+                    self.serial = None
+                    self._decoder.reset()
+
+        if self.travel_model is not None:
+            self.travel_model.flush()
+
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+
+    def _pace(self, status_query):
+        """
+        Wait only for whatever is left of the minimum gap since the last
+        exchange with the controller (and since the last status query, if
+        this is one). Returns immediately if enough time has already passed.
+
+        Parameters:
+        -----------
+        status_query: Boolean
+            True if the next command is a status query
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        now = self._clock()
+        delay = self._last_command + self.command_gap - now
+        if status_query:
+            delay = max(delay, self._last_status + self.status_interval - now)
+        if delay > 0:
+            self._sleep(delay)
+
+
+
+    def _wait(self, delay, abort=None):
+        """
+        Sleep for "delay" seconds, or until "abort" is set.
+        """
+
+        if (abort is not None) and (self._sleep is time.sleep):
+            abort.wait(delay)
+        else:
+            self._sleep(delay)
+
+
+
+    def _transact(self, output, status_query=False):
+        """
+        Write a command to the controller and, for a status query, read the
+        reply frame, using the persistent serial connection. If the port
+        throws an I/O error it is closed and reopened, and the exchange is
+        tried once more before the error is passed on to the caller.
+
+        Parameters:
+        -----------
+        output: bytes
+            Command bytes to send
+
+        status_query: Boolean
+            True if this is a status query. Status queries are rate limited
+            separately and return the reply frame.
+
+        Returns:
+        --------
+        message: bytes
+            11-byte status frame for a status query, else empty
+        """
+
+        with self._lock:
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    port = self.open()
+
+                    # Whatever complete frames arrived since the last exchange
+                    # are stale. A partial frame is kept in case it is the
+                    # start of our reply.
+                    if status_query:
+                        waiting = port.in_waiting
+                        if waiting:
+                            self._decoder.feed(port.read(waiting))
+                            while self._decoder.next_frame() is not None:
+                                pass
+
+                    # Don't run commands too close together
+                    self._pace(status_query)
+                    if status_query:
+                        self._last_status = self._clock()
+
+                    metrics = self.metrics
+                    if metrics is not None:
+                        start = time.perf_counter()
+
+                    port.write(output)
+
+                    message = b''
+                    if status_query:
+                        message = self._read_frame(port)
+
+                    if metrics is not None:
+                        kind = "status" if status_query else "command"
+                        metrics.observe("roundtrip_seconds", kind, time.perf_counter() - start)
+                        metrics.count("status_queries" if status_query else "commands")
+                    return message
+
+                except (serial.SerialException, OSError):
+                    if self.metrics is not None:
+                        self.metrics.count("io_errors")
+                    self.close()
+                    if attempt >= 2:
+                        raise
+
+                except FrameError:
+                    if self.metrics is not None:
+                        self.metrics.count("short_reads")
+                    raise
+
+                finally:
+                    self._last_command = self._clock()
+
+
+
+    def _read_frame(self, port):
+        """
+        Read from the port until the decoder has a complete status frame.
+
+        Raises ShortFrameError if the port times out first.
+        """
+
+        while True:
+            frame = self._decoder.next_frame()
+            if frame is not None:
+                return frame
+
+            data = port.read(self._decoder.needed())
+            if not data:
+                raise ShortFrameError("Incomplete status frame from controller: %d of %d bytes"
+                    % (len(self._decoder), StatusDecoder.FRAME_LENGTH))
+            self._decoder.feed(data)
+
+
+
+    @_timed
+    def get_status(self, max_age=None):
+        """
+        Get current parameters from SteppIR controller.
+
+        The controller returns 11 bytes: We break them out into individual
+        parameters and return them to the calling function. This "get_status"
+        function is used by all functions in this library that need status
+        from the controller.
+
+        The last status is cached. If it is younger than "max_age" it is
+        returned without talking to the controller. If another thread already
+        has a status query in flight we wait for it and share its result
+        instead of sending another one. set_parameters() invalidates the
+        cache, so a status read after a command always reflects it.
+
+        This command does NOT retry automatically. If no complete status
+        frame arrives before the read timeout ShortFrameError is raised.
+
+        Parameters:
+        -----------
+        max_age: float
+            Maximum age in seconds of a cached status, None to use the
+            "status_ttl" given to the constructor, 0 to always query the
+            controller
+
+        Returns:
+        --------
+        A StatusFrame, which unpacks like a tuple of these five values:
+
+        frequency: int
+            Current frequency in Hz
+
+        active_motors
+            An 8-bit value specifying motors which are currently "busy".
+	    A value of 0xff indicates the controller is in SETUP mode or
+	    has just been given a command to process.
+		Bit 0x01 Is always a '1'
+		Bit 0x02
+		Bit 0x04 Appears to indicate AUTOTRACK mode ON/OFF?
+		Bit 0x08
+		Bit 0x10
+		Bit 0x20
+		Bit 0x40
+		Bit 0x80
+
+        direction
+            An 8-bit value specifying the direction the antenna is pointing:
+                0x00 Normal direction
+                0x20 3/4 wave (For vertical antennas only)
+                0x40 180 direction from normal
+                0x80 Bidirectional antenna pattern
+                0xc0 Antenna pattern selected by the "pa" byte
+
+        dir_label
+            A printable string version of the direction:
+                "Bidirectional"
+                "180 Degrees"
+                "3/4 Wave" (For vertical antennas only)
+                "Pattern" (Pattern selected with apply(pattern=...))
+                "Normal"
+
+        interface_version
+            Two ASCII chars specifying transceiver interface version
+
+        The StatusFrame also has a "timestamp" attribute: The
+        time.monotonic() time the reply was read from the controller.
+        """
+
+        if max_age is None:
+            max_age = self.status_ttl
+
+        with self._status_cond:
+            epoch = self._status_epoch
+
+            # Serve from the cache if it is fresh enough
+            if (max_age > 0) and (self._status is not None) and (self._status_query_epoch == epoch):
+                if self._clock() - self._status_time <= max_age:
+                    return self._status
+
+            # Share the result of a query already in flight. The thread that
+            # sent it may send the next one before we wake up (polling in
+            # wait_for_completion()), so any new result ends the wait.
+            while self._status_inflight:
+                generation = self._status_generation
+                while self._status_inflight and (self._status_generation == generation):
+                    self._status_cond.wait()
+                # A command since then may have cleared it, then ask again
+                if (self._status_generation != generation) and (self._status_query_epoch >= epoch) \
+                        and (self._status is not None):
+                    return self._status
+
+            self._status_inflight = True
+
+        try:
+            status = self._read_status()
+        except:
+            with self._status_cond:
+                self._status_inflight = False
+                self._status_cond.notify_all()
+            raise
+
+        with self._status_cond:
+            self._status = status
+            self._status_time = self._clock()
+            self._status_query_epoch = epoch
+            self._status_generation += 1
+            self._status_inflight = False
+            self._status_cond.notify_all()
+
+        return status
+
+
+
+    def _invalidate_status(self):
+        """
+        Mark the cached status as stale. Queries already in flight will not
+        be shared with or cached for callers that arrive after this.
+        """
+
+        with self._status_cond:
+            self._status_epoch += 1
+            self._status = None
+
+
+
+    def _read_status(self):
+        """
+        Query the controller for status and decode the reply. See
+        get_status() for the values returned.
+        """
+
+        # Send 3-byte status command, controller returns 11-byte string
+        message = self._transact(b'?A\r', status_query=True)
+
+        # Bytes at position 2, 3, 4, 5 correspond to frequency, but the first
+        # is always 0.
+        #
+        # Active Motors. I couldn't figure out the mapping for each motor from
+        # the docs. Any info on this mapping would be appreciated. So far I'm
+        # seeing 0x07 for this parameter when the motors are busy. There are
+        # four bits defined in the docs plus another note that says this byte
+        # will get set to 0xff (all bits set) to acknowledge successful receipt
+        # of a command. For a DB18e antenna there are six stepper motors, most
+        # likely driven in pairs, so that would result in 3 bits being set if
+        # all motors are busy.
+        #
+        # Direction (or wavelength for verticals) is in the top three bits of
+        # byte 7.
+        status = StatusFrame.decode(message, self._clock())
+
+        if self.metrics is not None:
+            self.metrics.set_gauge("frequency_hz", status.frequency)
+            self.metrics.set_gauge("direction", status.direction)
+            self.metrics.set_gauge("active_motors", status.active_motors)
+
+        #print("Message:", message.hex())
+        #print(status)
+
+        return status
+
+
+
+    @_timed
+    def set_parameters(self, frequency, direction, command, pattern=0x00):
+        """
+        Send parameters to the SteppIR controller.
+
+        Here we send exactly 10 bytes to the controller. This "set_parameters"
+        function is used by all other functions in this library that need to send
+        something to the controller. Always set a valid frequency when sending
+        the set_parameters command.
+
+        This command does NOT retry automatically.
+
+        Requesting status immediately after a command: The controller sets the "ac"
+        byte (retrieved via the "get_status" command) to 0xff when it receives a
+        valid command string. It clears "ac" (minus the motor busy bits) when it is
+        done processing a command. Consider "frequency", "direction", and "ac" bytes
+        valid only when "ac" is NOT equal to 0xff. These may be SDA-2000 features
+        and not included in the SDA-100 protocol?
+
+        If "direction" is 0xc0, the byte preceeding it (called "pa", the "pattern"
+        parameter below) selects antenna pattern 0 through 15 (0x00 to 0x0F). 0x00
+        is the default for "pa". This hasn't been tried against a controller yet.
+        May be an SDA-2000 only feature?
+
+        Parameters:
+        -----------
+        frequency: int
+            Frequency in Hz
+
+        direction: int
+            The direction the antenna is pointing
+            0x00 = Normal direction
+            0x40 = 180 direction
+            0x80 = Bidirectional
+            0x20 = 3/4 wave (For vertical antennas only)
+	    0xc0 = Use pattern value in "pa" byte
+
+        command: ascii
+            '1' = Set frequency and direction
+            'R' = Turn ON AUTOTRACK. Needed after Home/Retract to re-enable full control
+            'U' = Turn OFF AUTOTRACK
+            'S' = Home the antenna (Retract the elements into the hubs)
+            'V' = Calibrate the antenna
+
+        pattern: int
+            Antenna pattern 0x00 to 0x0F sent in the "pa" byte, only used by
+            the controller when "direction" is 0xc0
+
+        Raises:
+        -------
+        HomingInProgress
+            If another thread is retracting or calibrating the antenna
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        # Only the thread retracting/calibrating may send commands until it
+        # is done
+        homing = self._homing
+        if (homing is not None) and (homing.thread is not threading.current_thread()):
+            raise HomingInProgress(homing)
+
+        # Anything cached from before this command is now stale
+        self._invalidate_status()
+
+        # Steppir "set" command: New frequency (scaled by 10), default flags
+        # at the end. The frequency is packed into four bytes but the first
+        # byte will always be 0x00, as the protocol doc requires.
+        output_string = COMMAND_STRUCT.pack(b'@A', int(frequency / 10), pattern, direction, command.encode('ascii'), b'\x00\r')
+
+        self._transact(output_string)
+
+        # A retract leaves AUTOTRACK off until it is turned back on
+        if command == 'R':
+            self.autotrack = True
+        elif command in ('U', 'S'):
+            self.autotrack = False
+
+
+
+    @_timed
+    def wait_for_completion(self, timeout=None, poll_interval=None, condition=None, settle=0.0, abort=None, expected=None, progress=None):
+        """
+        Poll the controller until it has finished processing the last command
+        and return the status as soon as it has.
+
+        The controller sets the "ac" byte (active_motors) to 0xff when it
+        receives a valid command and clears it when done. A status is
+        considered complete when "ac" is not 0xff and "condition" is true for
+        it. Polling runs as fast as the status rate limit allows unless
+        "poll_interval" asks for something slower.
+
+        Older firmware may not report the 0xff acknowledge at all, and the
+        controller can take a moment to show the motors as busy. "settle"
+        covers that: An idle reading seen before any acknowledge or busy
+        reading is only trusted once "settle" seconds have passed.
+
+        Parameters:
+        -----------
+        timeout: float
+            Maximum time to wait, in seconds. None for "completion_timeout"
+            (see __init__)
+
+        poll_interval: float
+            Time between status queries in seconds, None for the fastest
+            allowed by "status_interval"
+
+        condition: function
+            Called with the status tuple, returns True when the command is
+            done. Defaults to waiting until no motors are busy.
+
+        settle: float
+            Minimum time in seconds before an idle reading is trusted if no
+            acknowledge or busy reading was seen
+
+        abort: threading.Event
+            Optional. Checked between polls: If it is set the wait stops and
+            CommandAborted is raised
+
+        expected: float
+            Optional. Predicted seconds until the command is done (see
+            TravelModel). The first poll waits until shortly before then.
+
+        progress: function
+            Optional. Called as progress(status, elapsed, remaining) after
+            every status read. "remaining" is None unless "expected" is given.
+
+        Returns:
+        --------
+        status: tuple
+            The last status read (see get_status), whether or not the command
+            completed before the timeout. Polls that fail with a FrameError
+            are skipped; the error is only raised if no poll succeeded.
+        """
+
+        if timeout is None:
+            timeout = self.completion_timeout
+        if condition is None:
+            condition = lambda status: status[1] == 0x00
+        if poll_interval is None:
+            poll_interval = self.status_interval
+
+        start = self._clock()
+        deadline = start + timeout
+        acknowledged = False
+        status = None
+
+        # Nothing to learn from the controller while the motors are surely
+        # still running
+        if expected:
+            self._wait(min(expected * TravelModel.EARLY, timeout), abort)
+
+        while True:
+            if abort is not None and abort.is_set():
+                raise CommandAborted("Stopped waiting for the controller")
+
+            poll_time = self._clock()
+            try:
+                reply = self.get_status(max_age=0)
+            except FrameError:
+                # A garbled or short reply only costs this poll, unless we
+                # never got a good one
+                if (status is None) and (self._clock() >= deadline):
+                    raise
+                reply = None
+
+            if reply is not None:
+                status = reply
+                active_motors = status[1]
+
+                if progress is not None:
+                    elapsed = self._clock() - start
+                    progress(status, elapsed, None if expected is None else max(0.0, expected - elapsed))
+
+                if active_motors != 0x00:
+                    acknowledged = True
+
+                if active_motors != 0xff and condition(status):
+                    if acknowledged or self._clock() - start >= settle:
+                        return status
+
+            if (status is not None) and (self._clock() >= deadline):
+                return status
+
+            # The pacer enforces the status rate limit, only sleep here for
+            # a slower poll interval
+            delay = poll_time + poll_interval - self._clock()
+            if delay > 0:
+                self._wait(min(delay, max(0.0, deadline - self._clock())), abort)
+
+
+
+    def _wait_for_move(self, kind, start, end, direction_changed, condition=None, **kwargs):
+        """
+        wait_for_completion() for a command that moves the antenna from
+        "start" to "end" (Hz).
+
+        With a travel model the wait goes on until the motors have stopped,
+        with the first poll scheduled from the model's prediction and a
+        timeout that scales with it, and the time until then is recorded.
+        When "condition" is given (the controller shows the new target) it is
+        first waited for on its own, with the caller's timeout, so a dropped
+        command is still retried quickly.
+        """
+
+        model = self.travel_model
+        if model is None:
+            return self.wait_for_completion(condition=condition, **kwargs)
+
+        sent = self._clock()
+        expected = model.predict(kind, start, end, direction_changed)
+        if condition is None:
+            status = self.wait_for_completion(expected=expected, **kwargs)
+        else:
+            status = self.wait_for_completion(condition=condition, **kwargs)
+            if (status[1] == 0xff) or not condition(status):
+                return status
+
+            # The controller has the new target, now wait for the motors
+            if status[1] != 0x00:
+                remaining = None
+                if expected is not None:
+                    remaining = max(0.0, expected - (self._clock() - sent))
+                status = self.wait_for_completion(timeout=model.timeout(remaining), expected=remaining,
+                    abort=kwargs.get('abort'), progress=kwargs.get('progress'))
+
+        if status[1] == 0x00 and (condition is None or condition(status)):
+            model.record(kind, start, end, direction_changed, self._clock() - sent)
+        return status
+
+
+
+    @_timed
+    def get_frequency(self):
+        """
+        Get current frequency in Hz.
+
+        This command retries automatically.
+
+        Parameters:
+        -----------
+        -none-
+
+        Returns:
+        -------
+        frequency: int
+            Current frequency in Hz
+        """
+
+        done = False
+        loops = 0
+        while (done == False) & (loops < 3):
+
+            loops += 1
+
+            # Only the first try may be answered from the cache
+            if loops == 1:
+                (frequency, active_motors, direction, dir_label, version) = self.get_status()
+            else:
+                (frequency, active_motors, direction, dir_label, version) = self.get_status(max_age=0)
+
+            if frequency != 0:
+                done = True;
+            else:
+                print("Didn't get frequency, iteration:", loops, frequency, frequency)
+                if self.metrics is not None:
+                    self.metrics.count("retries", "get_frequency")
+
+        return frequency
+
+
+
+    @_timed
+    def set_frequency(self, frequency, abort=None):
+        """
+        Set new frequency, in Hz.
+
+        This command retries automatically.
+
+        Parameters:
+        -----------
+        frequency: int
+            Frequency in Hz
+
+        abort: threading.Event
+            Optional. Setting it from another thread stops the command
+            waiting for the controller and raises CommandAborted
+
+        Returns:
+        --------
+        status: StatusFrame
+            The last status read from the controller. Its frequency is not
+            "frequency" if the controller didn't take the command (with
+            AUTOTRACK off, for example).
+        """
+
+        # Fetch current frequency
+        (frequency_temp, active_motors, direction, dir_label, version) = self.get_status()
+        start_frequency = frequency_temp
+  
+        done = False 
+        loops = 0
+        while (done == False) & (loops < 3): 
+
+            loops += 1
+
+            # Set frequency and direction
+            self.set_parameters(frequency, direction, '1')
+
+            # Wait for the controller to process the command and report the
+            # new frequency, then check it was set correctly.
+            status = self._wait_for_move("tune", start_frequency, frequency, False,
+                condition=lambda status: status[0] == frequency, abort=abort)
+            (frequency_temp, active_motors, direction, dir_label, version) = status
+
+            if frequency == frequency_temp:
+                done = True;
+            else:
+                print("Didn't set frequency, iteration:", loops, frequency, frequency_temp)
+                if self.metrics is not None:
+                    self.metrics.count("retries", "set_frequency")
+
+        return status
+
+
+
+    @_timed
+    def apply(self, frequency=None, direction=None, pattern=None, abort=None):
+        """
+        Move the antenna to a desired frequency and/or direction using as few
+        commands as possible.
+
+        The desired state is compared with the current status (from the
+        cache if it is fresh enough, see "status_ttl"). If nothing needs to
+        change no command is sent. Otherwise frequency and direction go out
+        together in a single '1' command and are verified in one completion
+        wait, instead of a separate transaction for each as with
+        set_frequency() followed by set_dir_180().
+
+        Antenna patterns use direction 0xc0 with the pattern number in the
+        "pa" byte. The controller doesn't report the pattern back, so a
+        command is always sent when "pattern" is given.
+
+        This command retries automatically.
+
+        Parameters:
+        -----------
+        frequency: int
+            Desired frequency in Hz, None to keep the current one
+
+        direction: int
+            Desired direction (0x00, 0x20, 0x40, 0x80 or 0xc0), None to keep
+            the current one
+
+        pattern: int
+            Antenna pattern 0x00 to 0x0F. Implies direction 0xc0.
+
+        abort: threading.Event
+            Optional. Setting it from another thread stops the command
+            waiting for the controller and raises CommandAborted
+
+        Returns:
+        --------
+        status: StatusFrame
+            The last status read from the controller
+        """
+
+        if pattern is not None:
+            if not 0x00 <= pattern <= 0x0f:
+                raise ValueError("Antenna pattern must be 0x00 to 0x0F: %r" % (pattern,))
+            if direction is None:
+                direction = 0xc0
+            elif direction != 0xc0:
+                raise ValueError("An antenna pattern needs direction 0xc0, not 0x%02x" % direction)
+
+        status = self.get_status()
+        if frequency is None:
+            frequency = status.frequency
+        if direction is None:
+            direction = status.direction
+
+        def reached(status):
+            return (status.frequency == frequency) and (status.direction == direction)
+
+        # Already there
+        if (pattern is None) and reached(status):
+            return status
+
+        start = status
+
+        done = False
+        loops = 0
+        while (done == False) & (loops < 3):
+
+            loops += 1
+
+            # Set frequency, direction and pattern in one command
+            self.set_parameters(frequency, direction, '1', pattern or 0x00)
+
+            # Wait for the controller to process the command and report the
+            # new frequency and direction, then check they were set correctly.
+            status = self._wait_for_move("tune", start.frequency, frequency,
+                start.direction != direction, condition=reached, abort=abort)
+
+            if reached(status):
+                done = True
+            else:
+                print("Didn't apply frequency/direction, iteration:", loops, frequency, hex(direction), status.frequency, hex(status.direction))
+                if self.metrics is not None:
+                    self.metrics.count("retries", "apply")
+
+        return status
+
+
+
+    @_timed
+    def change_band(self, offset=1, plan=None, memory=None, abort=None):
+        """
+        Move the antenna to another band, back to the frequency and
+        direction last used there.
+
+        The current frequency and direction are stored in "memory" for the
+        band being left. The new band's are recalled from it, or the bottom
+        of the band with the current direction if it hasn't been used yet.
+        Both go out in a single apply() command.
+
+        Parameters:
+        -----------
+        offset: int
+            Bands to move: 1 for the next band up, -1 for the next band
+            down. Wraps around at the ends of the plan.
+
+        plan: BandPlan
+            Optional. The bands, default BandPlan.region()
+
+        memory: BandMemory
+            Optional. Where the last frequency/direction per band is kept
+
+        abort: threading.Event
+            Optional. Setting it from another thread stops the command
+            waiting for the controller and raises CommandAborted
+
+        Returns:
+        --------
+        status: StatusFrame
+            The last status read from the controller
+        """
+
+        if plan is None:
+            plan = BandPlan.region()
+
+        status = self.get_status()
+        band = plan.band(status.frequency)
+        if (memory is not None) and (band is not None):
+            memory.remember(band, status.frequency, status.direction)
+
+        frequency = status.frequency
+        for _ in range(abs(offset)):
+            band = plan.next(frequency) if offset > 0 else plan.previous(frequency)
+            frequency = plan.edges(band)[0]
+
+        direction = status.direction
+        recalled = memory.recall(band) if memory is not None else None
+        if recalled is not None:
+            (frequency, direction) = recalled
+
+        return self.apply(frequency, direction, abort=abort)
+
+
+
+    @_timed
+    def set_dir_normal(self, abort=None):
+        """
+        Set the beam direction to "normal" (0x00) or a vertical antenna to
+    	its normal wavelength.
+
+        This command retries automatically.
+
+        Parameters:
+        -----------
+        abort: threading.Event
+            Optional. Setting it from another thread stops the command
+            waiting for the controller and raises CommandAborted
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        # Fetch current frequency/direction
+        (frequency, active_motors, direction, dir_label, version) = self.get_status()
+
+        done = False
+        loops = 0
+        while (done == False) & (loops < 3):
+
+            loops += 1
+    
+            # Set frequency and direction
+            self.set_parameters(frequency, 0x00, '1')
+
+            # Wait for the controller to process the command and report the
+            # new direction, then check it was set correctly.
+            (frequency_temp, active_motors, direction_temp, dir_label, version) = self._wait_for_move(
+                "tune", frequency, frequency, direction != 0x00,
+                condition=lambda status: status[2] == 0x00, abort=abort)
+
+            if 0x00 == direction_temp:
+                done = True;
+            else:
+                print("Didn't set direction, iteration:", loops)
+                if self.metrics is not None:
+                    self.metrics.count("retries", "set_dir_normal")
+ 
+ 
+
+    @_timed
+    def set_dir_180(self, abort=None):
+        """
+        Set the beam direction to "180" (0x40) from normal.
+
+        This command retries automatically.
+
+        Parameters:
+        -----------
+        abort: threading.Event
+            Optional. Setting it from another thread stops the command
+            waiting for the controller and raises CommandAborted
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        # Fetch current frequency/direction
+        (frequency, active_motors, direction, dir_label, version) = self.get_status()
+
+        done = False
+        loops = 0
+        while (done == False) & (loops < 3):
+
+            loops += 1
+    
+            # Set frequency and direction
+            self.set_parameters(frequency, 0x40, '1')
+ 
+            # Wait for the controller to process the command and report the
+            # new direction, then check it was set correctly.
+            (frequency_temp, active_motors, direction_temp, dir_label, version) = self._wait_for_move(
+                "tune", frequency, frequency, direction != 0x40,
+                condition=lambda status: status[2] == 0x40, abort=abort)
+
+            if 0x40 == direction_temp:
+                done = True;
+            else:
+                print("Didn't set direction, iteration:", loops)
+                if self.metrics is not None:
+                    self.metrics.count("retries", "set_dir_180")
+ 
+ 
+
+    @_timed
+    def set_dir_bidirectional(self, abort=None):
+        """
+        Set the direction to "Bidirectional" (0x80) (normal and reverse
+        directions at the same time).
+
+        This command retries automatically.
+
+        Parameters:
+        -----------
+        abort: threading.Event
+            Optional. Setting it from another thread stops the command
+            waiting for the controller and raises CommandAborted
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        # Fetch current frequency/direction
+        (frequency, active_motors, direction, dir_label, version) = self.get_status()
+ 
+        done = False
+        loops = 0
+        while (done == False) & (loops < 3):
+
+            loops += 1
+    
+            # Set frequency and direction
+            self.set_parameters(frequency, 0x80, '1')
+ 
+            # Wait for the controller to process the command and report the
+            # new direction, then check it was set correctly.
+            (frequency_temp, active_motors, direction_temp, dir_label, version) = self._wait_for_move(
+                "tune", frequency, frequency, direction != 0x80,
+                condition=lambda status: status[2] == 0x80, abort=abort)
+
+            if 0x80 == direction_temp:
+                done = True;
+            else:
+                print("Didn't set direction, iteration:", loops)
+                if self.metrics is not None:
+                    self.metrics.count("retries", "set_dir_bidirectional")
+ 
+
+
+    @_timed
+    def set_dir_3_4(self, abort=None):
+        """
+        Set a vertical antenna to 3/4 wavelength (0x20). Not applicable to
+    	beam antennas.
+
+    	This command retries automatically.
+
+        Parameters:
+        -----------
+        abort: threading.Event
+            Optional. Setting it from another thread stops the command
+            waiting for the controller and raises CommandAborted
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        # Fetch current frequency
+        (frequency, active_motors, direction, dir_label, version) = self.get_status()
+ 
+        done = False
+        loops = 0
+        while (done == False) & (loops < 3):
+
+            loops += 1
+    
+            # Set frequency and wavelength
+            self.set_parameters(frequency, 0x20, '1')
+
+            # Wait for the controller to process the command and report the
+            # new direction, then check it was set correctly.
+            (frequency_temp, active_motors, direction_temp, dir_label, version) = self._wait_for_move(
+                "tune", frequency, frequency, direction != 0x20,
+                condition=lambda status: status[2] == 0x20, abort=abort)
+
+            if 0x20 == direction_temp:
+                done = True;
+            else:
+                print("Didn't set direction, iteration:", loops)
+                if self.metrics is not None:
+                    self.metrics.count("retries", "set_dir_3_4")
+ 
+
+
+    @_timed
+    def set_autotrack_ON(self):
+        """
+        Turn ON AUTOTRACK. Must re-enable using this command after a
+        Home/Retract command.
+
+        This command does NOT retry automatically.
+
+        Parameters:
+        -----------
+        -none-
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        # Fetch current frequency and direction
+        (frequency, active_motors, direction, dir_label, version) = self.get_status()
+    
+        # Turn on serial update
+        self.set_parameters(frequency, direction, 'R')
+ 
+
+
+    @_timed
+    def set_autotrack_OFF(self):
+        """
+        Turn OFF AUTOTRACK. With AUTOTRACK off only these commands will be
+    	accepted by the controller over the serial port:
+            AUTOTRACK ON
+            CALIBRATE
+            RETRACT
+
+    	This command does NOT retry automatically.
+
+        Parameters:
+        -----------
+        -none-
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        # Fetch current frequency and direction
+        (frequency, active_motors, direction, dir_label, version) = self.get_status()
+    
+        # Turn off serial update
+        self.set_parameters(frequency, direction, 'U')
+
+
+
+    @property
+    def homing(self):
+        """
+        The HomingOperation in progress, or None.
+        """
+
+        return self._homing
+
+
+
+    def _begin_homing(self, operation):
+        """
+        Register "operation" as the one retract/calibrate allowed to send
+        commands until it finishes.
+        """
+
+        with self._lock:
+            if self._homing is not None:
+                raise HomingInProgress(self._homing)
+            self._homing = operation
+
+
+
+    def _home(self, operation, command, timeout):
+        """
+        Run a retract ('S') or calibrate ('V') for "operation" and finish it.
+        Errors are stored in the operation, not raised.
+        """
+
+        name = operation.kind + "_antenna"
+        try:
+            # Fetch current frequency and direction
+            (frequency, active_motors, direction, dir_label, version) = self.get_status()
+
+            if self.travel_model is not None:
+                operation.expected = self.travel_model.predict(operation.kind, frequency, 0, False)
+
+            # Retract or calibrate
+            self.set_parameters(frequency, direction, command)
+
+            # Wait until the motors aren't busy. Don't trust an idle reading
+            # until the controller has had time to start the motors.
+            # Calibrating runs the elements in and back out, so it is modelled
+            # from 0 Hz like a retract.
+            status = self._wait_for_move(operation.kind, frequency, 0, False, timeout=timeout, settle=0.75,
+                abort=operation._abort, progress=operation._report)
+
+            if status.active_motors != 0x00:
+                print("Motors are busy:", hex(status.active_motors), "after", int(timeout), "seconds")
+                if self.metrics is not None:
+                    self.metrics.count("timeouts", name)
+        except BaseException as error:
+            operation._finish(error=error)
+        else:
+            operation._finish(status)
+        finally:
+            with self._lock:
+                if self._homing is operation:
+                    self._homing = None
+
+
+
+    def _start_homing(self, kind, command, timeout, progress, abort=None, background=True):
+        operation = HomingOperation(kind, abort)
+        if progress is not None:
+            operation.add_progress_callback(progress)
+
+        if not background:
+            operation.thread = threading.current_thread()
+            self._begin_homing(operation)
+            self._home(operation, command, timeout)
+            return operation
+
+        operation.thread = threading.Thread(target=self._home, args=(operation, command, timeout),
+            name="steppir-" + kind, daemon=True)
+        self._begin_homing(operation)
+        operation.thread.start()
+        return operation
+
+
+
+    def start_retract(self, progress=None):
+        """
+        Start retracting the antenna elements ("Home") and return right away.
+
+        Until the motors stop (up to 45 seconds) commands from other threads
+        raise HomingInProgress.
+
+        Parameters:
+        -----------
+        progress: function
+            Optional. Called as progress(operation) after every status read
+
+        Returns:
+        --------
+        operation: HomingOperation
+            Handle to follow, wait for or cancel the retract
+        """
+
+        return self._start_homing("retract", 'S', 45.0, progress)
+
+
+
+    def start_calibrate(self, progress=None):
+        """
+        Start calibrating the antenna to the controller and return right
+        away.
+
+        Until the motors stop (up to 90 seconds) commands from other threads
+        raise HomingInProgress.
+
+        Parameters:
+        -----------
+        progress: function
+            Optional. Called as progress(operation) after every status read
+
+        Returns:
+        --------
+        operation: HomingOperation
+            Handle to follow, wait for or cancel the calibration
+        """
+
+        return self._start_homing("calibrate", 'V', 90.0, progress)
+
+
+
+    @_timed
+    def retract_antenna(self, abort=None, progress=None):
+        """
+        Retract antenna elements into the controller hubs ("Home").
+
+    	This command does NOT retry automatically but it does wait (up to 45
+    	seconds) until the motors are not busy. See start_retract() to do this
+    	without blocking.
+
+        Parameters:
+        -----------
+        abort: threading.Event
+            Optional. Setting it from another thread stops the command
+            waiting for the controller and raises CommandAborted
+
+        progress: function
+            Optional. Called as progress(operation) after every status read
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        self._start_homing("retract", 'S', 45.0, progress, abort, background=False).result()
+ 
+
+
+    @_timed
+    def calibrate_antenna(self, abort=None, progress=None):
+        """
+        Calibrate the antenna to the controller.
+
+    	This command does NOT retry automatically but it does wait (up to 90
+    	seconds) until the motors are not busy. See start_calibrate() to do
+    	this without blocking.
+
+        Parameters:
+        -----------
+        abort: threading.Event
+            Optional. Setting it from another thread stops the command
+            waiting for the controller and raises CommandAborted
+
+        progress: function
+            Optional. Called as progress(operation) after every status read
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        self._start_homing("calibrate", 'V', 90.0, progress, abort, background=False).result()
+
+
+
+class AsyncSteppIR:
+    """
+    asyncio interface for SteppIR controllers.
+
+    Wraps a SteppIR object and offers the same methods as coroutines. All
+    serial I/O runs on one dedicated I/O thread, bridged to the event loop
+    with futures, so the event loop never blocks on the controller and
+    commands from different coroutines are serialized in the order they were
+    issued.
+
+    Long operations (set_frequency(), the set_dir_*() methods,
+    retract_antenna(), calibrate_antenna()) can be cancelled: Cancelling the
+    awaiting task stops the I/O thread waiting on the controller at its next
+    status poll. The command already sent to the controller is not undone.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Set serial parameters. Takes the same parameters as SteppIR.
+        """
+
+        self.steppir = SteppIR(*args, **kwargs)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+            thread_name_prefix="steppir-io")
+
+
+
+    async def _run(self, func, *args, **kwargs):
+        """
+        Run a blocking SteppIR method on the I/O thread and await its result.
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+            functools.partial(func, *args, **kwargs))
+
+
+
+    async def _run_abortable(self, func, *args, **kwargs):
+        """
+        Run a blocking SteppIR method which accepts an "abort" event on the
+        I/O thread. If the awaiting task is cancelled the event is set so the
+        I/O thread gives up as soon as possible.
+        """
+
+        abort = threading.Event()
+        try:
+            return await self._run(func, *args, abort=abort, **kwargs)
+        except asyncio.CancelledError:
+            abort.set()
+            raise
+
+
+
+    async def open(self):
+        """See SteppIR.open()."""
+
+        return await self._run(self.steppir.open)
+
+
+
+    async def close(self):
+        """See SteppIR.close()."""
+
+        await self._run(self.steppir.close)
+
+
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+
+    async def get_status(self, max_age=None):
+        """See SteppIR.get_status()."""
+
+        return await self._run(self.steppir.get_status, max_age)
+
+
+
+    async def set_parameters(self, frequency, direction, command, pattern=0x00):
+        """See SteppIR.set_parameters()."""
+
+        return await self._run(self.steppir.set_parameters, frequency, direction, command, pattern)
+
+
+
+    async def wait_for_completion(self, timeout=None, poll_interval=None, condition=None, settle=0.0, expected=None):
+        """See SteppIR.wait_for_completion()."""
+
+        return await self._run_abortable(self.steppir.wait_for_completion,
+            timeout, poll_interval, condition, settle, expected=expected)
+
+
+
+    async def get_frequency(self):
+        """See SteppIR.get_frequency()."""
+
+        return await self._run(self.steppir.get_frequency)
+
+
+
+    async def set_frequency(self, frequency):
+        """See SteppIR.set_frequency()."""
+
+        return await self._run_abortable(self.steppir.set_frequency, frequency)
+
+
+
+    async def apply(self, frequency=None, direction=None, pattern=None):
+        """See SteppIR.apply()."""
+
+        return await self._run_abortable(self.steppir.apply, frequency, direction, pattern)
+
+
+
+    async def change_band(self, offset=1, plan=None, memory=None):
+        """See SteppIR.change_band()."""
+
+        return await self._run_abortable(self.steppir.change_band, offset, plan, memory)
+
+
+
+    async def set_dir_normal(self):
+        """See SteppIR.set_dir_normal()."""
+
+        return await self._run_abortable(self.steppir.set_dir_normal)
+
+
+
+    async def set_dir_180(self):
+        """See SteppIR.set_dir_180()."""
+
+        return await self._run_abortable(self.steppir.set_dir_180)
+
+
+
+    async def set_dir_bidirectional(self):
+        """See SteppIR.set_dir_bidirectional()."""
+
+        return await self._run_abortable(self.steppir.set_dir_bidirectional)
+
+
+
+    async def set_dir_3_4(self):
+        """See SteppIR.set_dir_3_4()."""
+
+        return await self._run_abortable(self.steppir.set_dir_3_4)
+
+
+
+    async def set_autotrack_ON(self):
+        """See SteppIR.set_autotrack_ON()."""
+
+        return await self._run(self.steppir.set_autotrack_ON)
+
+
+
+    async def set_autotrack_OFF(self):
+        """See SteppIR.set_autotrack_OFF()."""
+
+        return await self._run(self.steppir.set_autotrack_OFF)
+
+
+
+    async def retract_antenna(self):
+        """See SteppIR.retract_antenna()."""
+
+        return await self._run_abortable(self.steppir.retract_antenna)
+
+
+
+    async def calibrate_antenna(self):
+        """See SteppIR.calibrate_antenna()."""
+
+        return await self._run_abortable(self.steppir.calibrate_antenna)
+
+
+
+# Amateur band plans, as (low edge, high edge, name) in Hz, by region. The
+# SteppIR Yagis cover 40m to 6m (see BandPlan.covering()), the 160m to 60m
+# bands are there for the verticals.
+BAND_PLANS = {
+    "IARU1": (
+        (1810000, 2000000, "160m"),
+        (3500000, 3800000, "80m"),
+        (5351500, 5366500, "60m"),
+        (7000000, 7200000, "40m"),
+        (10100000, 10150000, "30m"),
+        (14000000, 14350000, "20m"),
+        (18068000, 18168000, "17m"),
+        (21000000, 21450000, "15m"),
+        (24890000, 24990000, "12m"),
+        (28000000, 29700000, "10m"),
+        (50000000, 52000000, "6m"),
+        ),
+    "IARU2": (
+        (1800000, 2000000, "160m"),
+        (3500000, 4000000, "80m"),
+        (5351500, 5366500, "60m"),
+        (7000000, 7300000, "40m"),
+        (10100000, 10150000, "30m"),
+        (14000000, 14350000, "20m"),
+        (18068000, 18168000, "17m"),
+        (21000000, 21450000, "15m"),
+        (24890000, 24990000, "12m"),
+        (28000000, 29700000, "10m"),
+        (50000000, 54000000, "6m"),
+        ),
+    "IARU3": (
+        (1800000, 2000000, "160m"),
+        (3500000, 3900000, "80m"),
+        (5351500, 5366500, "60m"),
+        (7000000, 7300000, "40m"),
+        (10100000, 10150000, "30m"),
+        (14000000, 14350000, "20m"),
+        (18068000, 18168000, "17m"),
+        (21000000, 21450000, "15m"),
+        (24890000, 24990000, "12m"),
+        (28000000, 29700000, "10m"),
+        (50000000, 54000000, "6m"),
+        ),
+    # US 60m is five channels from 5332 to 5405 kHz
+    "US": (
+        (1800000, 2000000, "160m"),
+        (3500000, 4000000, "80m"),
+        (5330500, 5406400, "60m"),
+        (7000000, 7300000, "40m"),
+        (10100000, 10150000, "30m"),
+        (14000000, 14350000, "20m"),
+        (18068000, 18168000, "17m"),
+        (21000000, 21450000, "15m"),
+        (24890000, 24990000, "12m"),
+        (28000000, 29700000, "10m"),
+        (50000000, 54000000, "6m"),
+        ),
+    }
+
+DEFAULT_REGION = "IARU2"
+
+
+
+class BandPlan:
+    """
+    Sorted table of amateur bands with bisect lookup.
+
+    Used for the GUI's BAND UP/BAND DOWN buttons (next() and previous()),
+    the retune tolerances (RetunePolicy) and the band the CAT proxy reports.
+    Build one from a region in BAND_PLANS with region(), from a JSON config
+    file with load(), or from your own (low, high, name) tuples.
+    """
+
+    def __init__(self, bands):
+        """
+        Parameters:
+        -----------
+        bands: iterable
+            (low edge, high edge, name) tuples in Hz, in any order. Bands
+            must not overlap.
+        """
+
+        self.bands = tuple(sorted((int(low), int(high), name) for (low, high, name) in bands))
+        for (band, following) in zip(self.bands, self.bands[1:]):
+            if band[1] >= following[0]:
+                raise ValueError("Bands %s and %s overlap" % (band[2], following[2]))
+        self._lows = [band[0] for band in self.bands]
+        self._by_name = {band[2]: band for band in self.bands}
+
+
+
+    @classmethod
+    def region(cls, name=DEFAULT_REGION):
+        """
+        The band plan of a region in BAND_PLANS ("IARU1", "IARU2", "IARU3"
+        or "US").
+        """
+
+        try:
+            return cls(BAND_PLANS[name])
+        except KeyError:
+            raise ValueError("Unknown band plan region %r, expected one of %s" % (name, ", ".join(sorted(BAND_PLANS)))) from None
+
+
+
+    @classmethod
+    def load(cls, path, region=None):
+        """
+        Load a band plan from a JSON file:
+
+            {"region": "IARU1",
+             "bands": [[low_hz, high_hz, name], ...],
+             "covering": [low_hz, high_hz]}
+
+        Every key is optional: "bands" replaces or adds to the bands of
+        "region" (DEFAULT_REGION if not given) by name, and "covering"
+        limits the plan to what the antenna can tune. A "region" argument
+        overrides the file's.
+        """
+
+        with open(path) as input_file:
+            config = json.load(input_file)
+
+        bands = {band[2]: band for band in cls.region(region or config.get("region", DEFAULT_REGION)).bands}
+        for (low, high, name) in config.get("bands", []):
+            bands[name] = (low, high, name)
+        plan = cls(bands.values())
+
+        if "covering" in config:
+            plan = plan.covering(*config["covering"])
+        return plan
+
+
+
+    def covering(self, low, high):
+        """
+        A plan with only the bands that lie within "low" to "high" Hz, like
+        the range an antenna can tune.
+        """
+
+        return BandPlan(band for band in self.bands if (band[0] >= low) and (band[1] <= high))
+
+
+
+    def __iter__(self):
+        return iter(self.bands)
+
+
+
+    def __len__(self):
+        return len(self.bands)
+
+
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+
+
+    def edges(self, name):
+        """
+        (low edge, high edge) in Hz of the band called "name".
+        """
+
+        band = self._by_name[name]
+        return (band[0], band[1])
+
+
+
+    def band(self, frequency):
+        """
+        Name of the band "frequency" (Hz) is in, None if it isn't in one.
+        """
+
+        index = bisect.bisect_right(self._lows, frequency) - 1
+        if (index >= 0) and (frequency <= self.bands[index][1]):
+            return self.bands[index][2]
+        return None
+
+
+
+    def next(self, frequency):
+        """
+        Name of the band above the one "frequency" is in (or the first band
+        above "frequency"), wrapping around from the top band to the bottom.
+        """
+
+        index = bisect.bisect_right(self._lows, frequency)
+        return self.bands[index % len(self.bands)][2]
+
+
+
+    def previous(self, frequency):
+        """
+        Name of the band below the one "frequency" is in (or the first band
+        below "frequency"), wrapping around from the bottom band to the top.
+        """
+
+        index = bisect.bisect_left(self._lows, frequency) - 1
+        if (index >= 0) and (frequency <= self.bands[index][1]):
+            # Inside this band, go one further down
+            index -= 1
+        return self.bands[index % len(self.bands)][2]
+
+
+
+class BandMemory:
+    """
+    The last frequency and direction used on each band, so a band change
+    goes back to where the operator was instead of the bottom of the band.
+
+    With a path the memory is saved after every change (see
+    SteppIR.change_band()) and loaded again with BandMemory.load(path).
+    """
+
+    def __init__(self, path=None):
+        """
+        Parameters:
+        -----------
+        path: str
+            Optional. File the memory is saved to after each change.
+        """
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._bands = {}
+
+
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a memory saved by save(). A missing file gives an empty memory
+        that will be saved to "path".
+        """
+
+        memory = cls(path)
+        try:
+            with open(path) as input_file:
+                data = json.load(input_file)
+        except FileNotFoundError:
+            return memory
+
+        for (band, entry) in data.get("bands", {}).items():
+            memory._bands[band] = (int(entry["frequency"]), int(entry["direction"]))
+        return memory
+
+
+
+    def recall(self, band):
+        """
+        (frequency, direction) last used on "band", None if it hasn't been.
+        """
+
+        with self._lock:
+            return self._bands.get(band)
+
+
+
+    def remember(self, band, frequency, direction):
+        """
+        Store the frequency (Hz) and direction last used on "band", and save
+        the memory if it has a path.
+        """
+
+        with self._lock:
+            if self._bands.get(band) == (frequency, direction):
+                return
+            self._bands[band] = (frequency, direction)
+        if self.path is not None:
+            self.save()
+
+
+
+    def export(self):
+        """
+        The memory as a dict, the same layout save() writes:
+
+            {"version": 1, "bands": {name: {"frequency": hz, "direction": byte}}}
+        """
+
+        with self._lock:
+            return {"version": 1, "bands": {band: {"frequency": frequency, "direction": direction}
+                for (band, (frequency, direction)) in self._bands.items()}}
+
+
+
+    def save(self, path=None):
+        """
+        Write the memory to "path" (default the path it was created with),
+        replacing the file atomically.
+        """
+
+        path = path or self.path
+        if path is None:
+            raise ValueError("No path to save the band memory to")
+
+        data = self.export()
+        temporary = path + ".tmp"
+        with open(temporary, 'w') as output:
+            json.dump(data, output, indent=1)
+        os.replace(temporary, path)
+
+
+
+# How far in Hz the radio can move from where the antenna is tuned, per band,
+# before the elements are worth moving. The antenna's usable bandwidth grows
+# with frequency, so the higher bands get wider windows.
+RETUNE_TOLERANCES = {
+    "160m": 3000,
+    "80m": 5000,
+    "60m": 3000,
+    "40m": 10000,
+    "30m": 10000,
+    "20m": 20000,
+    "17m": 25000,
+    "15m": 25000,
+    "12m": 30000,
+    "10m": 40000,
+    "6m": 50000,
+    }
+
+
+
+class RetunePolicy:
+    """
+    Decides whether a new radio frequency is far enough from where the
+    antenna is tuned to be worth a move.
 
-            # Create byte array for the frequency. Note that this creates four
-            # bytes but the first byte will always be 0x00, as the protocol
-            # doc requires.
-            hex_frequency = struct.pack('>i', int(frequency))
+    A move within the tolerance of the band (RETUNE_TOLERANCES) is skipped,
+    which saves a serial command, motor wear and time with the elements in
+    motion for every small VFO change. A move to another band always goes
+    ahead, and off the bands of the plan the tolerance is "default".
+    """
 
-            cmd2 = bytes(command, 'utf-8')  # Multiple bytes
-            cmd3 = cmd2[0]  # 1 byte
+    def __init__(self, tolerances=None, plan=None, default=0):
+        """
+        Parameters:
+        -----------
+        tolerances: dict
+            Optional. Band name -> tolerance in Hz, replacing the entries of
+            RETUNE_TOLERANCES it names
 
-            # Steppir "set" command: New frequency, default flags at the end
-            #                 0 1   2 3 4 5             6     7                              8                             9 10
-            output_string = b'@A' + hex_frequency + b'\x00' + direction.to_bytes(1, 'big') + cmd3.to_bytes(1, 'big') + b'\x00\r'
+        plan: BandPlan
+            Optional. The bands, default BandPlan.region()
 
-            self.serial.write(output_string)
+        default: int
+            Tolerance in Hz outside the bands
+        """
 
-            # Needed to assure we don't run commands too close together
-            time.sleep(0.1)
+        self.tolerances = dict(RETUNE_TOLERANCES)
+        if tolerances:
+            self.tolerances.update(tolerances)
+        self.plan = plan if plan is not None else BandPlan.region()
+        self.default = default
 
 
 
-    def get_frequency(self):
+    def tolerance(self, frequency):
+        """
+        Retune tolerance in Hz at "frequency".
         """
-        Get current frequency in Hz.
 
-        This command retries automatically.
+        band = self.plan.band(frequency)
+        if band is None:
+            return self.default
+        return self.tolerances.get(band, self.default)
+
 
+
+    def should_retune(self, current, target):
+        """
         Parameters:
         -----------
-        -none-
+        current: int
+            Frequency the antenna is tuned to in Hz, None if unknown
+
+        target: int
+            Frequency the radio moved to in Hz
 
         Returns:
-        -------
-        frequency: int
-            Current frequency in Hz
+        --------
+        retune: Boolean
+            False if the antenna is close enough already
         """
 
-        done = False
-        loops = 0
-        while (done == False) & (loops < 3):
+        if (current is None) or (self.plan.band(current) != self.plan.band(target)):
+            return True
+        return abs(target - current) > self.tolerance(target)
 
-            loops += 1
 
-            (frequency, active_motors, direction, dir_label, version) = self.get_status()
 
-            if frequency != 0:
-                done = True;
-            else:
-                print("Didn't get frequency, iteration:", loops, frequency, frequency)
+class TuneQueue:
+    """
+    Latest-wins queue of frequency updates for a SteppIR controller.
+
+    Meant to sit between something that reports frequency changes quickly
+    (like a radio's CAT port while the operator spins the VFO) and the much
+    slower set_frequency(). Only the newest pending frequency is kept: Each
+    update replaces the one waiting before it, and an update to a different
+    frequency also aborts the verify/retry loop of the tune in progress so the
+    antenna moves on to the new target right away.
+
+    With a RetunePolicy, updates close enough to where the antenna is (or
+    is on its way to) are dropped instead of tuned.
+
+    Counters (read them directly):
+        submitted   Frequency updates received
+        coalesced   Updates replaced by a newer one before being tuned
+        superseded  Tunes aborted part way because a newer target arrived
+        deferred    Tunes put off because the antenna was calibrating
+        dropped     Tunes not sent because AUTOTRACK is off (a retract
+                    turns it off)
+        suppressed  Updates dropped by the RetunePolicy
+        failed      Tunes the controller didn't carry out
+        tuned       Tunes completed, with the controller showing the new
+                    frequency
+    """
 
-        return frequency
+    def __init__(self, policy=None, max_age=0.5):
+        """
+        Parameters:
+        -----------
+        policy: RetunePolicy
+            Optional. Skip updates within its tolerance of the antenna's
+            frequency.
+
+        max_age: float
+            How old (seconds) the controller's cached status may be when
+            the policy checks where the antenna is, see
+            SteppIR.get_status(). Commands sent clear the cache, so it is
+            never older than the last move.
+        """
 
+        self.policy = policy
+        self.max_age = max_age
+        self._cond = threading.Condition()
+        self._pending = None
+        self._active = None
+        self._abort = None
+        self.closed = False
+        self.submitted = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.deferred = 0
+        self.dropped = 0
+        self.suppressed = 0
+        self.failed = 0
+        self.tuned = 0
 
+        # Tunes are being dropped for AUTOTRACK (logged once until it is on)
+        self._dropping = False
 
-    def set_frequency(self, frequency):
-        """
-        Set new frequency, in Hz.
 
-        This command retries automatically.
+
+    def submit(self, frequency):
+        """
+        Queue a new target frequency, replacing any update still pending.
 
         Parameters:
         -----------
@@ -395,329 +3838,399 @@ class SteppIR:
         -nothing-
         """
 
-        # Fetch current frequency
-        (frequency_temp, active_motors, direction, dir_label, version) = self.get_status()
-  
-        done = False 
-        loops = 0
-        while (done == False) & (loops < 3): 
-
-            loops += 1
-
-            # Set frequency and direction
-            self.set_parameters(frequency, direction, '1')
+        with self._cond:
+            self.submitted += 1
+            if self._pending is not None:
+                self.coalesced += 1
+                self._pending = None
 
-            # Wait to assure status gets updated in the controller
-            time.sleep(0.75)
+            # Already on its way there (or close enough), nothing more to do
+            if (self._active is not None) and not self._abort.is_set():
+                if frequency == self._active:
+                    return
+                if (self.policy is not None) and not self.policy.should_retune(self._active, frequency):
+                    self.suppressed += 1
+                    return
 
-            # Check frequency and direction to assure they were set correctly.
-            (frequency_temp, active_motors, direction, dir_label, version) = self.get_status()
-
-            if frequency == frequency_temp:
-                done = True;
-            else:
-                print("Didn't set frequency, iteration:", loops, frequency, frequency_temp)
+            self._pending = frequency
+            if self._abort is not None:
+                self._abort.set()
+            self._cond.notify_all()
 
 
 
-    def set_dir_normal(self):
+    def get(self, block=True, timeout=None):
         """
-        Set the beam direction to "normal" (0x00) or a vertical antenna to
-    	its normal wavelength.
-
-        This command retries automatically.
+        Take the newest pending frequency and mark it as being tuned. Call
+        done() when finished with it.
 
         Parameters:
         -----------
-        -none-
+        block: Boolean
+            Wait for an update if none is pending
+
+        timeout: float
+            Maximum time to wait in seconds, None to wait forever
 
         Returns:
         --------
-        -nothing-
+        (frequency, abort): tuple
+            The frequency to tune to and a threading.Event which is set when
+            a newer target supersedes it, or None if nothing is pending (or
+            the queue was closed)
         """
 
-        # Fetch current frequency/direction
-        (frequency, active_motors, direction, dir_label, version) = self.get_status()
+        with self._cond:
+            if block:
+                self._cond.wait_for(lambda: (self._pending is not None) or self.closed, timeout)
+            if (self._pending is None) or self.closed:
+                return None
+
+            frequency = self._pending
+            self._pending = None
+            self._active = frequency
+            self._abort = threading.Event()
+            return frequency, self._abort
 
-        done = False
-        loops = 0
-        while (done == False) & (loops < 3):
 
-            loops += 1
-    
-            # Set frequency and direction
-            self.set_parameters(frequency, 0x00, '1')
 
-            # Wait to assure status gets updated in the controller
-            time.sleep(0.75)
+    def done(self):
+        """
+        Mark the frequency returned by get() as finished.
+        """
 
-            # Check direction to assure it was set correctly
-            (frequency_temp, active_motors, direction_temp, dir_label, version) = self.get_status()
+        with self._cond:
+            self._active = None
+            self._abort = None
 
-            if 0x00 == direction_temp:
-                done = True;
-            else:
-                print("Didn't set direction, iteration:", loops)
- 
- 
 
-    def set_dir_180(self):
+
+    def tune(self, step, block=True, timeout=None):
         """
-        Set the beam direction to "180" (0x40) from normal.
+        Take the newest pending frequency and tune the antenna to it.
 
-        This command retries automatically.
+        The controller ignores tuning with AUTOTRACK off, which is how a
+        retract leaves it. Frequencies that arrive then (or while a retract
+        is running) are dropped until set_autotrack_ON(). During a calibrate
+        the frequency is kept and tuned once the antenna is done.
 
         Parameters:
         -----------
-        -none-
+        step: SteppIR
+            Controller to tune
+
+        block: Boolean
+            Wait for an update if none is pending
+
+        timeout: float
+            Maximum time to wait for an update in seconds, None to wait
+            forever
 
         Returns:
         --------
-        -nothing-
+        frequency: int
+            The frequency tuned to, or None if nothing was pending, the
+            antenna was close enough already (see RetunePolicy), the tune
+            was superseded by a newer target, AUTOTRACK is off or the
+            controller didn't reach it
         """
 
-        # Fetch current frequency/direction
-        (frequency, active_motors, direction, dir_label, version) = self.get_status()
+        item = self.get(block, timeout)
+        if item is None:
+            return None
+        (frequency, abort) = item
+
+        homing = None
+        try:
+            if step.autotrack is False:
+                self._drop(frequency)
+                return None
+            self._dropping = False
+
+            if self.policy is not None:
+                current = step.get_status(max_age=self.max_age).frequency
+                if not self.policy.should_retune(current, frequency):
+                    with self._cond:
+                        self.suppressed += 1
+                    return None
+            status = step.set_frequency(frequency, abort=abort)
+        except CommandAborted:
+            with self._cond:
+                self.superseded += 1
+            return None
+        except HomingInProgress as error:
+            homing = error.operation
+            if homing.kind == "retract":
+                # AUTOTRACK will be off when it is done
+                self._drop(frequency)
+            else:
+                # Keep the frequency (unless a newer one came in) and try
+                # again once the antenna is done
+                with self._cond:
+                    self.deferred += 1
+                    if (self._pending is None) and not self.closed:
+                        self._pending = frequency
+        finally:
+            self.done()
+
+        if homing is not None:
+            while not (homing.wait(0.5) or self.closed):
+                pass
+            return None
+
+        with self._cond:
+            if status.frequency != frequency:
+                self.failed += 1
+                return None
+            self.tuned += 1
+        return frequency
 
-        done = False
-        loops = 0
-        while (done == False) & (loops < 3):
 
-            loops += 1
-    
-            # Set frequency and direction
-            self.set_parameters(frequency, 0x40, '1')
- 
-            # Wait to assure status gets updated in the controller
-            time.sleep(0.75)
 
-            # Check direction to assure it was set correctly
-            (frequency_temp, active_motors, direction_temp, dir_label, version) = self.get_status()
+    def _drop(self, frequency):
+        """
+        Count a frequency not tuned because AUTOTRACK is (or will be) off,
+        and say why the first time.
+        """
 
-            if 0x40 == direction_temp:
-                done = True;
-            else:
-                print("Didn't set direction, iteration:", loops)
- 
- 
+        with self._cond:
+            self.dropped += 1
+        if not self._dropping:
+            print("Not tuning to %8.6f MHz: AUTOTRACK is off (a retract turns it off), turn it on to follow the radio"
+                % (frequency / 1000000))
+            self._dropping = True
 
-    def set_dir_bidirectional(self):
+
+
+    def close(self):
+        """
+        Drop any pending update, abort the tune in progress and wake up
+        anything waiting in get().
         """
-        Set the direction to "Bidirectional" (0x80) (normal and reverse
-        directions at the same time).
 
-        This command retries automatically.
+        with self._cond:
+            self.closed = True
+            self._pending = None
+            if self._abort is not None:
+                self._abort.set()
+            self._cond.notify_all()
 
-        Parameters:
-        -----------
-        -none-
 
-        Returns:
-        --------
-        -nothing-
-        """
 
-        # Fetch current frequency/direction
-        (frequency, active_motors, direction, dir_label, version) = self.get_status()
- 
-        done = False
-        loops = 0
-        while (done == False) & (loops < 3):
+class FleetResult:
+    """
+    Outcome of one controller's part in a SteppIRFleet operation.
 
-            loops += 1
-    
-            # Set frequency and direction
-            self.set_parameters(frequency, 0x80, '1')
- 
-            # Wait to assure status gets updated in the controller
-            time.sleep(0.75)
+    Attributes:
+        name        Name of the controller in the fleet
+        value       What the method returned, None if it raised
+        error       The exception it raised, None if it succeeded
+        seconds     How long it took
+    """
 
-            # Check direction to assure it was set correctly
-            (frequency_temp, active_motors, direction_temp, dir_label, version) = self.get_status()
+    __slots__ = ('name', 'value', 'error', 'seconds')
 
-            if 0x80 == direction_temp:
-                done = True;
-            else:
-                print("Didn't set direction, iteration:", loops)
- 
+    def __init__(self, name, value=None, error=None, seconds=0.0):
+        self.name = name
+        self.value = value
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
 
+    def __repr__(self):
+        if self.error is not None:
+            return "FleetResult(%r, error=%r, seconds=%.3f)" % (self.name, self.error, self.seconds)
+        return "FleetResult(%r, value=%r, seconds=%.3f)" % (self.name, self.value, self.seconds)
+
+
+
+class SteppIRFleet:
+    """
+    Several SteppIR controllers (each on its own serial port, with its own
+    pacing) driven concurrently.
+
+    Operations are issued to all controllers at once on a small worker pool
+    (one thread per controller), so a band change takes as long as the
+    slowest antenna instead of the sum of all of them. Results and errors
+    are gathered per controller; one antenna failing doesn't stop the
+    others.
+
+        fleet = steppir.SteppIRFleet.from_ports({
+            "20m beam": "/dev/ttyUSB0",
+            "40m yagi": "/dev/ttyUSB1",
+            "vertical": "/dev/ttyUSB2"})
+        results = fleet.band_change(14074000)
+        print(fleet.status())
+    """
 
-    def set_dir_3_4(self):
+    def __init__(self, controllers):
+        """
+        Parameters:
+        -----------
+        controllers: dict
+            Name to SteppIR object for each controller
         """
-        Set a vertical antenna to 3/4 wavelength (0x20). Not applicable to
-    	beam antennas.
 
-    	This command retries automatically.
+        self.controllers = dict(controllers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.controllers)),
+            thread_name_prefix="steppir-fleet")
+
+
+
+    @classmethod
+    def from_ports(cls, ports, baudrate=1200, **kwargs):
+        """
+        Build a fleet from serial ports, using the recommended serial
+        settings (see the README) for each controller.
 
         Parameters:
         -----------
-        -none-
+        ports: dict
+            Name to serial port for each controller
 
-        Returns:
-        --------
-        -nothing-
+        baudrate: int
+            Baud rate, the same for all controllers
+
+        Any other keyword arguments are passed on to SteppIR().
         """
 
-        # Fetch current frequency
-        (frequency, active_motors, direction, dir_label, version) = self.get_status()
- 
-        done = False
-        loops = 0
-        while (done == False) & (loops < 3):
+        return cls({name: SteppIR(port, baudrate, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None, **kwargs)
+            for (name, port) in ports.items()})
 
-            loops += 1
-    
-            # Set frequency and wavelength
-            self.set_parameters(frequency, 0x20, '1')
 
-            # Wait to assure status gets updated in the controller
-            time.sleep(0.75)
 
-            # Check direction to assure it was set correctly
-            (frequency_temp, active_motors, direction_temp, dir_label, version) = self.get_status()
+    def __getitem__(self, name):
+        return self.controllers[name]
 
-            if 0x20 == direction_temp:
-                done = True;
-            else:
-                print("Didn't set direction, iteration:", loops)
- 
 
 
-    def set_autotrack_ON(self):
-        """
-        Turn ON AUTOTRACK. Must re-enable using this command after a
-        Home/Retract command.
+    def __enter__(self):
+        return self
 
-        This command does NOT retry automatically.
 
-        Parameters:
-        -----------
-        -none-
 
-        Returns:
-        --------
-        -nothing-
-        """
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-        # Fetch current frequency and direction
-        (frequency, active_motors, direction, dir_label, version) = self.get_status()
-    
-        # Turn on serial update
-        self.set_parameters(frequency, direction, 'R')
- 
 
 
-    def set_autotrack_OFF(self):
+    def close(self):
+        """
+        Close all serial ports and stop the worker threads.
         """
-        Turn OFF AUTOTRACK. With AUTOTRACK off only these commands will be
-    	accepted by the controller over the serial port:
-            AUTOTRACK ON
-            CALIBRATE
-            RETRACT
 
-    	This command does NOT retry automatically.
+        for controller in self.controllers.values():
+            controller.close()
+        self._executor.shutdown(wait=True)
+
+
+
+    def _call(self, name, func, args, kwargs):
+        start = time.monotonic()
+        try:
+            return FleetResult(name, value=func(*args, **kwargs), seconds=time.monotonic() - start)
+        except Exception as error:
+            return FleetResult(name, error=error, seconds=time.monotonic() - start)
+
+
+
+    def run(self, method, *args, names=None, **kwargs):
+        """
+        Call a SteppIR method on several controllers at once and wait for
+        all of them.
 
         Parameters:
         -----------
-        -none-
+        method: str
+            Name of the SteppIR method, e.g. "set_autotrack_ON"
+
+        names: list
+            Controllers to use, None for all of them
+
+        Any other arguments are passed on to the method.
 
         Returns:
         --------
-        -nothing-
+        results: dict
+            Controller name to FleetResult
         """
 
-        # Fetch current frequency and direction
-        (frequency, active_motors, direction, dir_label, version) = self.get_status()
-    
-        # Turn off serial update
-        self.set_parameters(frequency, direction, 'U')
+        if names is None:
+            names = list(self.controllers)
+        futures = [self._executor.submit(self._call, name, getattr(self.controllers[name], method), args, kwargs)
+            for name in names]
+        return {result.name: result for result in (future.result() for future in futures)}
 
 
 
-    def retract_antenna(self):
+    def band_change(self, targets, direction=None, wait_motors=False, abort=None):
         """
-        Retract antenna elements into the controller hubs ("Home").
-
-    	This command does NOT retry automatically but it does wait until the motors
-    	are not busy.
+        Move every antenna at the same time, each with a single combined
+        command (see SteppIR.apply()).
 
         Parameters:
         -----------
-        -none-
+        targets: int or dict
+            A frequency in Hz for all controllers, or a dict of controller
+            name to frequency, or to a (frequency, direction) tuple
+
+        direction: int
+            Direction for controllers without one in "targets", None to
+            leave them as they are
+
+        wait_motors: Boolean
+            Also wait (up to 45 seconds) until each antenna's motors have
+            stopped, not just until its controller reports the new settings
+
+        abort: threading.Event
+            Optional. Setting it stops all controllers waiting for their
+            antennas and makes them report CommandAborted
 
         Returns:
         --------
-        -nothing-
+        results: dict
+            Controller name to FleetResult, with the final StatusFrame as
+            its value
         """
 
-        # Fetch current frequency and direction
-        (frequency, active_motors, direction, dir_label, version) = self.get_status()
-
-        # Wait to assure status gets updated in the controller
-        time.sleep(0.75)
+        if not isinstance(targets, dict):
+            targets = {name: targets for name in self.controllers}
 
-        # Retract tapes
-        self.set_parameters(frequency, direction, 'S')
-   
-        done = False
-        loops = 0
-        while (done == False) & (loops < 60):
+        def change(controller, frequency, direction):
+            status = controller.apply(frequency, direction, abort=abort)
+            if wait_motors:
+                status = controller.wait_for_completion(45.0, settle=0.75, abort=abort)
+            return status
 
-            loops += 1
- 
-            # Wait to assure status gets updated in the controller
-            time.sleep(0.75)
+        futures = []
+        for (name, target) in targets.items():
+            if isinstance(target, tuple):
+                (frequency, target_direction) = target
+            else:
+                (frequency, target_direction) = (target, direction)
+            futures.append(self._executor.submit(self._call, name, change,
+                (self.controllers[name], frequency, target_direction), {}))
 
-            # Check that motors aren't busy
-            (frequency_temp, active_motors, direction_temp, dir_label, version) = self.get_status()
+        return {result.name: result for result in (future.result() for future in futures)}
 
-            if active_motors == 0x00:
-                done = True;
-            else:
-                print("Motors are busy:", hex(active_motors), "Iteration:", loops)
- 
 
 
-    def calibrate_antenna(self):
+    def status(self, max_age=None):
         """
-        Calibrate the antenna to the controller.
-
-    	This command does NOT retry automatically but it does wait until the
-    	motors are not busy.
+        Status of every controller, queried concurrently.
 
         Parameters:
         -----------
-        -none-
+        max_age: float
+            See SteppIR.get_status()
 
         Returns:
         --------
-        -nothing-
+        results: dict
+            Controller name to FleetResult, with a StatusFrame as its value
         """
 
-        # Fetch current frequency and direction
-        (frequency, active_motors, direction, dir_label, version) = self.get_status()
- 
-        # Wait to assure status gets updated in the controller
-        time.sleep(0.75)
-
-        # Calibrate the antenna to the controller
-        self.set_parameters(frequency, direction, 'V')
-
-        done = False
-        loops = 0
-        while (done == False) & (loops < 120):
-
-            loops += 1
- 
-            # Wait to assure status gets updated in the controller
-            time.sleep(0.75)
-
-            # Check that motors aren't busy
-            (frequency_temp, active_motors, direction_temp, dir_label, version) = self.get_status()
-
-            if active_motors == 0x00:
-                done = True;
-            else:
-                print("Motors are busy:", hex(active_motors), "Iteration:", loops)
-
-
+        return self.run("get_status", max_age)
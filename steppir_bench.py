@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the SteppIR library, run against the simulated SDA-100 in
+steppir_sim.py so the numbers are reproducible without hardware.
+
+For each baud rate it measures:
+
+    - p50/p95/p99 latency of get_status(), set_parameters(), set_frequency()
+      and each set_dir_*() method
+    - Sustained status polls per second
+    - Retune lag while a synthetic VFO sweeps across the band, with the
+      frequency updates going through a TuneQueue like the GUI does
+
+Results are written as JSON (to stdout, or to the file given with --output)
+so different releases can be compared:
+
+    steppir_bench.py --output bench.json
+"""
+
+import json
+import math
+import platform
+import sys
+import threading
+import time
+
+import steppir
+import steppir_sim
+
+
+
+BAUD_RATES = (1200, 2400, 4800, 9600, 19200)
+
+
+
+def percentiles(samples):
+    """
+    Summarize latency samples (in seconds) with nearest-rank percentiles.
+
+    Parameters:
+    -----------
+    samples: list
+        Latencies in seconds
+
+    Returns:
+    --------
+    summary: dict
+        "count", "mean", "min", "p50", "p95", "p99" and "max", in seconds
+    """
+
+    if not samples:
+        return {"count": 0}
+
+    ordered = sorted(samples)
+    count = len(ordered)
+
+    def rank(p):
+        return ordered[min(count - 1, max(0, math.ceil(p / 100.0 * count) - 1))]
+
+    return {
+        "count": count,
+        "mean": sum(ordered) / count,
+        "min": ordered[0],
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "max": ordered[-1],
+        }
+
+
+
+def time_calls(func, arguments):
+    """
+    Call "func" once per entry in "arguments" and return the latencies.
+    """
+
+    samples = []
+    for args in arguments:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+
+def open_steppir(port, baudrate):
+    return steppir.SteppIR(port, baudrate, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None)
+
+
+
+def bench_latency(step, samples):
+    """
+    Latency of the individual library calls.
+    """
+
+    results = {}
+
+    results["get_status"] = percentiles(time_calls(
+        lambda: step.get_status(max_age=0), [()] * samples))
+
+    frequencies = [14000000 + 10000 * (i % 2) for i in range(samples)]
+    results["set_parameters"] = percentiles(time_calls(
+        lambda frequency: step.set_parameters(frequency, 0x00, '1'), [(f,) for f in frequencies]))
+
+    # Let the simulated motors finish before timing the verifying setters
+    step.wait_for_completion(30.0)
+
+    frequencies = [14100000 + 10000 * (i % 2) for i in range(samples)]
+    results["set_frequency"] = percentiles(time_calls(step.set_frequency, [(f,) for f in frequencies]))
+
+    # Move away (untimed) before each call so every timed call really
+    # changes direction
+    for (name, away) in (("set_dir_normal", step.set_dir_180),
+            ("set_dir_180", step.set_dir_normal),
+            ("set_dir_bidirectional", step.set_dir_normal),
+            ("set_dir_3_4", step.set_dir_normal)):
+        method = getattr(step, name)
+        latencies = []
+        for i in range(samples):
+            away()
+            start = time.perf_counter()
+            method()
+            latencies.append(time.perf_counter() - start)
+        results[name] = percentiles(latencies)
+
+    return results
+
+
+
+def bench_status_rate(step, seconds):
+    """
+    Sustained status queries per second.
+    """
+
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        step.get_status(max_age=0)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+
+def bench_retune(step, sim, seconds, update_interval, start_frequency, span):
+    """
+    Sweep a simulated VFO across "span" Hz over "seconds", sending an update
+    every "update_interval" seconds through a TuneQueue, and measure how far
+    behind the antenna stays.
+
+    Lag is sampled every 10ms as the age of the frequency the antenna is
+    heading for (the time since the radio was on it). The settle time is how
+    long after the sweep stops until the antenna reaches the final frequency.
+    """
+
+    queue = steppir.TuneQueue()
+    submitted = {}
+
+    def worker():
+        while not queue.closed:
+            queue.tune(step)
+
+    step.set_frequency(start_frequency)
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+
+    lags = []
+    updates = max(1, int(seconds / update_interval))
+    start = time.perf_counter()
+    next_sample = start
+    for i in range(updates + 1):
+        frequency = start_frequency + span * i // updates
+        frequency -= frequency % 10
+        now = time.perf_counter()
+        submitted.setdefault(frequency, now)
+        queue.submit(frequency)
+
+        # Sample the lag until the next update is due
+        next_update = start + (i + 1) * update_interval
+        while True:
+            now = time.perf_counter()
+            if now >= next_sample:
+                heading = submitted.get(sim.frequency)
+                if heading is not None:
+                    lags.append(now - heading)
+                next_sample += 0.01
+            if now >= next_update:
+                break
+            time.sleep(min(0.005, next_update - now))
+
+    # Time until the antenna is on the last frequency and stopped
+    final = frequency
+    sweep_end = time.perf_counter()
+    deadline = sweep_end + 60.0
+    while ((sim.frequency != final) or sim.busy()) and (time.perf_counter() < deadline):
+        time.sleep(0.005)
+    settle = time.perf_counter() - sweep_end
+
+    queue.close()
+    thread.join()
+
+    return {
+        "updates": queue.submitted,
+        "coalesced": queue.coalesced,
+        "superseded": queue.superseded,
+        "tuned": queue.tuned,
+        "lag": percentiles(lags),
+        "settle": settle,
+        }
+
+
+
+def run(baud_rates=BAUD_RATES, samples=20, poll_seconds=3.0, sweep_seconds=5.0,
+        update_interval=0.05, seed=1):
+    """
+    Run all benchmarks at each baud rate.
+
+    Parameters:
+    -----------
+    baud_rates: list
+        Baud rates to test (simulated serial line time)
+
+    samples: int
+        Number of calls timed per method
+
+    poll_seconds: float
+        Duration of the status polling test
+
+    sweep_seconds: float
+        Duration of the VFO sweep
+
+    update_interval: float
+        Seconds between VFO updates during the sweep
+
+    seed: int
+        Random seed for the simulator
+
+    Returns:
+    --------
+    report: dict
+        Settings and results, ready for json.dump()
+    """
+
+    report = {
+        "benchmark": "steppir",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "baud_rates": list(baud_rates),
+            "samples": samples,
+            "poll_seconds": poll_seconds,
+            "sweep_seconds": sweep_seconds,
+            "update_interval": update_interval,
+            "seed": seed,
+            },
+        "results": {},
+        }
+
+    for baudrate in baud_rates:
+        with steppir_sim.SDA100Simulator(baudrate=baudrate, seed=seed) as sim:
+            with open_steppir(sim.port, baudrate) as step:
+                result = bench_latency(step, samples)
+                result["status_polls_per_second"] = bench_status_rate(step, poll_seconds)
+                result["retune"] = bench_retune(step, sim, sweep_seconds, update_interval, 14000000, 350000)
+                result["simulator"] = {
+                    "status_queries": sim.status_queries,
+                    "commands": sim.commands,
+                    "dropped": sim.dropped,
+                    "ignored": sim.ignored,
+                    }
+        report["results"][str(baudrate)] = result
+        print("Finished", baudrate, "baud", file=sys.stderr)
+
+    return report
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the SteppIR library against a simulated SDA-100")
+    parser.add_argument('--baud', type=int, action='append', help="baud rate to test (repeat for several), default all")
+    parser.add_argument('--samples', type=int, default=20, help="calls timed per method")
+    parser.add_argument('--poll-seconds', type=float, default=3.0, help="duration of the status polling test")
+    parser.add_argument('--sweep-seconds', type=float, default=5.0, help="duration of the VFO sweep")
+    parser.add_argument('--update-interval', type=float, default=0.05, help="seconds between VFO updates")
+    parser.add_argument('--seed', type=int, default=1, help="simulator random seed")
+    parser.add_argument('--output', default=None, help="JSON output file, default stdout")
+    args = parser.parse_args()
+
+    report = run(args.baud or BAUD_RATES, args.samples, args.poll_seconds, args.sweep_seconds,
+        args.update_interval, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
@@ -0,0 +1,1079 @@
+#!/usr/bin/env python3
+
+"""
+CAT proxy: Shares a radio's Kenwood-style CAT port (for example linHPSDR's)
+with any number of CAT programs (WSJT-X, Fldigi, Js8call, loggers...) and
+reports the radio's frequency so a SteppIR can follow it.
+
+Everything runs on one selectors event loop: The connection to the radio,
+the listening socket, and every client. Client commands are forwarded to the
+radio one complete ";"-terminated command at a time, so commands from
+different programs never get mixed up. The radio answers queries in the
+order it receives them, so each reply goes back to the client that asked.
+Anything the radio sends on its own goes to the client that last used that
+command, or to everyone if nobody has.
+
+Output is buffered per client and sent without blocking. A client that stops
+reading is disconnected once MAX_OUTPUT bytes are waiting for it, and reading
+from clients pauses while the radio is slow to take their commands.
+
+Both directions go through a CATTokenizer, and the radio's replies plus the
+clients' frequency changes are decoded into typed messages (VFOFrequency,
+RadioInfo, VFOSelect) that keep a RadioState up to date. on_frequency gets
+the transmit frequency, so the antenna follows split operation too.
+
+With a cache_ttl, replies to read-only queries like FA; and IF; are kept and
+the same query from any client is answered from them for that many seconds,
+so programs polling many times a second don't load the radio. Commands that
+set something are always forwarded and empty the cache. Reads that take a
+parameter (MD0; for the main receiver's mode) are told from commands that set
+something with QUERY_PARAMETERS.
+
+The radio is connected to without blocking the loop, and reconnected every
+RECONNECT_INTERVAL seconds while it is down. Until it is back, queries from
+clients are answered with "?;" (the radio's "can't do that") and commands
+that set something are dropped and counted.
+
+    proxy = steppir_cat.CATProxy(on_frequency=tune_queue.submit)
+    proxy.serve_forever()
+"""
+
+import collections
+import errno
+import os
+import selectors
+import socket
+import steppir
+import time
+
+
+
+# The radio's CAT port, and the port CAT programs connect to instead
+RADIO_HOST = "127.0.0.1"
+RADIO_CAT_PORT = 21000
+CAT_HOST = "127.0.0.1"
+CAT_LISTENER_PORT = 19090
+
+# Disconnect clients that stop reading once this much output is queued
+MAX_OUTPUT = 65536
+
+# Stop reading from clients while this much is waiting to go to the radio,
+# start again once it is down to RADIO_LOW_WATER
+RADIO_HIGH_WATER = 4096
+RADIO_LOW_WATER = 1024
+
+# A query the radio hasn't answered after this many seconds is forgotten
+PENDING_TIMEOUT = 2.0
+
+# Seconds between attempts to connect to the radio, and how long one
+# attempt may take
+RECONNECT_INTERVAL = 2.0
+
+# Queries that only read the radio's state, and can be answered from the
+# cache while the last reply is fresh
+CACHED_COMMANDS = frozenset((b'FA', b'FB', b'IF', b'FR', b'FT', b'MD', b'ID', b'PS', b'AI'))
+
+# Commands whose read form takes a parameter saying what to read (which
+# receiver or meter), with the parameter lengths that make it a read: "MD0;"
+# asks for the main receiver's mode while "MD02;" sets it. Any other command
+# only reads without parameters ("FA;"), with them it sets something.
+QUERY_PARAMETERS = {
+    b'AG': (1,),        # AF gain of receiver P1
+    b'MD': (0, 1),      # Mode, of receiver P1 on newer radios
+    b'RM': (0, 1),      # Meter reading, of meter P1 on newer radios
+    b'SM': (1,),        # S meter of receiver P1
+    b'SQ': (1,),        # Squelch of receiver P1
+}
+
+
+
+# VFO numbers used by IF, FR and FT
+VFO_NAMES = ('A', 'B', 'M')
+
+
+
+class CATTokenizer:
+    """
+    Incremental tokenizer for Kenwood-style CAT traffic.
+
+    Bytes are fed in as they arrive from a socket, in pieces of any size, and
+    complete ";"-terminated messages are taken out with next_message(). TCP
+    doesn't keep message boundaries, so one recv() can hold several messages
+    or part of one; the rest of a message is kept until it arrives.
+
+    The buffer is searched in place and only compacted once per feed(), so a
+    burst of messages costs one copy each. Line endings some programs put
+    between messages are skipped, and more than MAX_MESSAGE bytes without a
+    ";" are thrown away as garbage.
+    """
+
+    MAX_MESSAGE = 128
+    TERMINATOR = 0x3b   # ";"
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._start = 0
+        self.messages = 0
+        self.discarded = 0
+
+
+
+    def __len__(self):
+        return len(self._buffer) - self._start
+
+
+
+    def reset(self):
+        """
+        Throw away everything buffered.
+        """
+
+        self.discarded += len(self)
+        self._buffer.clear()
+        self._start = 0
+
+
+
+    def feed(self, data):
+        """
+        Add received bytes.
+
+        Parameters:
+        -----------
+        data: bytes
+            Received bytes, any length
+
+        Returns:
+        --------
+        -nothing-
+        """
+
+        if self._start:
+            del self._buffer[:self._start]
+            self._start = 0
+        self._buffer += data
+
+
+
+    def next_message(self):
+        """
+        Take the next complete message out of the buffer.
+
+        Returns:
+        --------
+        message: bytes
+            The message with its ";", or None if no complete message is
+            buffered yet
+        """
+
+        while (self._start < len(self._buffer)) and (self._buffer[self._start] in b' \r\n'):
+            self._start += 1
+
+        end = self._buffer.find(self.TERMINATOR, self._start)
+        if end < 0:
+            if len(self) > self.MAX_MESSAGE:
+                self.reset()
+            return None
+
+        message = bytes(self._buffer[self._start:end + 1])
+        self._start = end + 1
+        self.messages += 1
+        return message
+
+
+
+class CATMessage:
+    """
+    One message from a Kenwood-style CAT stream.
+
+    Attributes are "command" (the two-letter command as a str) and "message"
+    (the raw bytes, ";" included). parse_message() returns one of the
+    subclasses below for the messages it understands.
+    """
+
+    __slots__ = ('command', 'message')
+
+    def __init__(self, command, message):
+        self.command = command
+        self.message = message
+
+    def __repr__(self):
+        return "CATMessage(%r)" % self.message
+
+
+
+class VFOFrequency(CATMessage):
+    """
+    FA/FB: Frequency of VFO "A" or "B", in Hz.
+    """
+
+    __slots__ = ('vfo', 'frequency')
+
+    def __init__(self, command, message, vfo, frequency):
+        super().__init__(command, message)
+        self.vfo = vfo
+        self.frequency = frequency
+
+    def __repr__(self):
+        return "VFOFrequency(vfo=%r, frequency=%d)" % (self.vfo, self.frequency)
+
+
+
+class RadioInfo(CATMessage):
+    """
+    IF: The radio's status in one message. "frequency" is the displayed
+    frequency in Hz, "vfo" the VFO in use ("A", "B" or "M" for memory),
+    "split" and "transmitting" are Booleans and "mode" is the radio's mode
+    number.
+    """
+
+    __slots__ = ('frequency', 'mode', 'vfo', 'split', 'transmitting')
+
+    def __init__(self, command, message, frequency, mode, vfo, split, transmitting):
+        super().__init__(command, message)
+        self.frequency = frequency
+        self.mode = mode
+        self.vfo = vfo
+        self.split = split
+        self.transmitting = transmitting
+
+    def __repr__(self):
+        return "RadioInfo(frequency=%d, mode=%d, vfo=%r, split=%r, transmitting=%r)" % (
+            self.frequency, self.mode, self.vfo, self.split, self.transmitting)
+
+
+
+class VFOSelect(CATMessage):
+    """
+    FR/FT: The VFO used to "receive" (FR) or "transmit" (FT). Different
+    receive and transmit VFOs mean the radio is working split.
+    """
+
+    __slots__ = ('function', 'vfo')
+
+    def __init__(self, command, message, function, vfo):
+        super().__init__(command, message)
+        self.function = function
+        self.vfo = vfo
+
+    def __repr__(self):
+        return "VFOSelect(function=%r, vfo=%r)" % (self.function, self.vfo)
+
+
+
+def is_query(command):
+    """
+    Tell a command that reads something from the radio (and is answered)
+    from one that sets something, using QUERY_PARAMETERS.
+
+    Parameters:
+    -----------
+    command: bytes
+        One complete command, ";" included
+
+    Returns:
+    --------
+    query: Boolean
+        True for a read
+    """
+
+    return (len(command) - 3) in QUERY_PARAMETERS.get(bytes(command[:2]), (0,))
+
+
+
+def _vfo(code):
+    index = code - 0x30
+    if 0 <= index < len(VFO_NAMES):
+        return VFO_NAMES[index]
+    return None
+
+
+
+def parse_message(message):
+    """
+    Decode one message from a CATTokenizer.
+
+    Parameters:
+    -----------
+    message: bytes
+        The message, ";" included
+
+    Returns:
+    --------
+    event: CATMessage
+        VFOFrequency, RadioInfo or VFOSelect if the message is one of those
+        with its parameters, otherwise a plain CATMessage (queries, other
+        commands, and anything malformed)
+    """
+
+    command = message[:2].decode('ascii', 'replace')
+    params = message[2:-1]
+
+    if (command in ('FA', 'FB')) and (len(params) == 11) and params.isdigit():
+        return VFOFrequency(command, message, command[1], int(params))
+
+    # IF: 11 frequency, 5 step, 5 RIT/XIT offset, RIT, XIT, 3 memory channel,
+    # TX/RX, mode, VFO, scan, split, tone, 2 tone number, shift
+    if (command == 'IF') and (len(params) >= 31) and params[0:11].isdigit():
+        vfo = _vfo(params[28])
+        if (vfo is not None) and params[26:28].isdigit():
+            return RadioInfo(command, message, int(params[0:11]), params[27] - 0x30, vfo,
+                params[30] == 0x31, params[26] == 0x31)
+
+    if (command in ('FR', 'FT')) and (len(params) == 1):
+        vfo = _vfo(params[0])
+        if vfo is not None:
+            return VFOSelect(command, message, 'receive' if command == 'FR' else 'transmit', vfo)
+
+    return CATMessage(command, message)
+
+
+
+class RadioState:
+    """
+    The radio's VFOs as far as the CAT traffic has shown them.
+
+    The antenna should be where the radio transmits, so "tune_frequency" is
+    the frequency of the transmit VFO: VFO A until the radio reports split
+    or another VFO.
+    """
+
+    def __init__(self):
+        self.frequencies = {}
+        self.receive_vfo = 'A'
+        self.transmit_vfo = 'A'
+        self.mode = None
+        self.transmitting = False
+
+
+
+    @property
+    def split(self):
+        return self.receive_vfo != self.transmit_vfo
+
+
+
+    @property
+    def tune_frequency(self):
+        return self.frequencies.get(self.transmit_vfo)
+
+
+
+    def update(self, event):
+        """
+        Take in one parsed message.
+
+        Parameters:
+        -----------
+        event: CATMessage
+            From parse_message(). Messages that don't carry VFO information
+            are ignored.
+
+        Returns:
+        --------
+        changed: Boolean
+            True if the message was about frequencies or VFOs
+        """
+
+        if isinstance(event, VFOFrequency):
+            self.frequencies[event.vfo] = event.frequency
+        elif isinstance(event, RadioInfo):
+            self.receive_vfo = event.vfo
+            if event.split and (event.vfo != 'M'):
+                self.transmit_vfo = 'B' if event.vfo == 'A' else 'A'
+            else:
+                self.transmit_vfo = event.vfo
+            # While transmitting split the radio shows the transmit frequency
+            if event.transmitting:
+                self.frequencies[self.transmit_vfo] = event.frequency
+            else:
+                self.frequencies[event.vfo] = event.frequency
+            self.mode = event.mode
+            self.transmitting = event.transmitting
+        elif isinstance(event, VFOSelect):
+            if event.function == 'receive':
+                self.receive_vfo = event.vfo
+            else:
+                self.transmit_vfo = event.vfo
+        else:
+            return False
+        return True
+
+
+
+class _Client:
+    """
+    Connection state for one CAT client.
+    """
+
+    def __init__(self, conn, address):
+        self.conn = conn
+        self.address = address
+        self.tokenizer = CATTokenizer()
+        self.output = bytearray()
+        self.closed = False
+
+        # Queries waiting for a reply from the radio
+        self.pending = 0
+
+        # Reads answered from the cache, and reads forwarded to the radio
+        self.hits = 0
+        self.misses = 0
+
+
+
+    @property
+    def hit_rate(self):
+        reads = self.hits + self.misses
+        return self.hits / reads if reads else 0.0
+
+
+
+class CATProxy:
+    """
+    Event-loop CAT proxy between one radio and many CAT clients.
+    """
+
+    def __init__(self, radio_host=RADIO_HOST, radio_port=RADIO_CAT_PORT, host=CAT_HOST, port=CAT_LISTENER_PORT,
+            on_frequency=None, poll_interval=None, cache_ttl=0.0, plan=None):
+        """
+        Parameters:
+        -----------
+        radio_host: str
+            Host of the radio's CAT port
+
+        radio_port: int
+            TCP port of the radio's CAT port
+
+        host: str
+            Address to listen on for CAT clients
+
+        port: int
+            TCP port to listen on for CAT clients
+
+        on_frequency: function
+            Optional. Called with the frequency in Hz whenever the radio's
+            transmit frequency changes, whether the radio reported it (FA,
+            FB, IF) or a client set it. Runs on the event loop thread.
+
+        poll_interval: float
+            Optional. Ask the radio for its frequency ("IF;") when no client
+            has for this many seconds, so the antenna follows the radio even
+            with no CAT program connected. None to never ask.
+
+        cache_ttl: float
+            Seconds a reply to a read-only query (CACHED_COMMANDS, with the
+            same parameters if any) is used to answer the same query from
+            any client instead of asking the radio again. Any command that sets something throws the cache
+            away. 0 to always ask the radio.
+
+        plan: steppir.BandPlan
+            Optional. Bands for "band", the band the transmit frequency is
+            in. Default steppir.BandPlan.region().
+        """
+
+        self.radio_address = (radio_host, radio_port)
+        self.address = (host, port)
+        self.on_frequency = on_frequency
+        self.poll_interval = poll_interval
+        self.cache_ttl = cache_ttl
+
+        self.plan = plan if plan is not None else steppir.BandPlan.region()
+        self.frequency = None
+        self.band = None
+        self.radio = RadioState()
+        self.clients = set()
+
+        # Counters
+        self.commands = 0
+        self.replies = 0
+        self.unsolicited = 0
+        self.dropped_clients = 0
+        self.dropped_commands = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self._selector = selectors.DefaultSelector()
+        self._listener = None
+        self._radio = None
+        self._tokenizer = CATTokenizer()
+        self._radio_output = bytearray()
+        self._reconnect_at = 0.0
+
+        # Socket still connecting to the radio, and when to give up on it
+        self._connecting = None
+        self._connect_deadline = 0.0
+
+        # Commands from clients are being dropped (logged once per outage)
+        self._dropping = False
+        self._last_query = 0.0
+        self._paused = False
+        self._running = False
+
+        # Queries sent to the radio and not answered yet, oldest first:
+        # (client or None for our own polls, query, time sent)
+        self._pending = collections.deque()
+
+        # Client that last sent each command, for replies nobody is waiting
+        # for
+        self._last_sender = {}
+
+        # Last reply from the radio to each query of CACHED_COMMANDS:
+        # query -> (message, time received)
+        self._cache = {}
+        self._last_write = 0.0
+
+        # Wakes up the event loop for shutdown()
+        (self._wakeup_read, self._wakeup_write) = socket.socketpair()
+        self._wakeup_read.setblocking(False)
+        self._wakeup_write.setblocking(False)
+
+
+
+    # --- Radio side ---
+
+    def _connect_radio(self):
+        """
+        Start connecting to the radio. The socket is watched for writing,
+        and _radio_connected() takes over once the connection is made or
+        has failed.
+        """
+
+        try:
+            (family, kind, proto, name, address) = socket.getaddrinfo(*self.radio_address,
+                type=socket.SOCK_STREAM)[0]
+            radio = socket.socket(family, kind, proto)
+        except OSError as error:
+            self._radio_failed(error)
+            return
+        radio.setblocking(False)
+        result = radio.connect_ex(address)
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            radio.close()
+            self._radio_failed(OSError(result, os.strerror(result)))
+            return
+        self._connecting = radio
+        self._connect_deadline = time.monotonic() + RECONNECT_INTERVAL
+        self._selector.register(radio, selectors.EVENT_WRITE, "connecting")
+
+
+
+    def _radio_connected(self):
+        radio = self._connecting
+        self._connecting = None
+        self._selector.unregister(radio)
+        result = radio.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if result:
+            radio.close()
+            self._radio_failed(OSError(result, os.strerror(result)))
+            return
+        radio.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._radio = radio
+        self._tokenizer.reset()
+        self._radio_output.clear()
+        self._selector.register(radio, selectors.EVENT_READ, "radio")
+        self._resume_clients()
+        print("    Connected to radio at %s:%d" % self.radio_address)
+        if self._dropping:
+            print("    %d CAT commands dropped so far while the radio was away" % self.dropped_commands)
+            self._dropping = False
+
+
+
+    def _check_connect(self, now):
+        """
+        Give up on a connection attempt the radio hasn't answered in time.
+        """
+
+        if (self._connecting is not None) and (now >= self._connect_deadline):
+            self._selector.unregister(self._connecting)
+            self._connecting.close()
+            self._connecting = None
+            self._radio_failed(socket.timeout("timed out"))
+
+
+
+    def _radio_failed(self, error):
+        print("    Can't connect to radio CAT port:", error)
+        self._reconnect_at = time.monotonic() + RECONNECT_INTERVAL
+
+
+
+    def _close_radio(self):
+        if self._radio is None:
+            return
+        print("    Lost radio CAT connection")
+        self._selector.unregister(self._radio)
+        self._radio.close()
+        self._radio = None
+        self._radio_output.clear()
+        self._cache.clear()
+
+        # The radio won't answer the queries still waiting now
+        for (client, query, sent) in self._pending:
+            if client is not None:
+                client.pending -= 1
+                self._write(client, b'?;')
+        self._pending.clear()
+        self._reconnect_at = time.monotonic() + RECONNECT_INTERVAL
+        self._resume_clients()
+
+
+
+    def _send_radio(self, command, client):
+        """
+        Queue one complete command for the radio. Queries (see is_query())
+        are remembered so the reply can be routed back to "client".
+
+        With no radio connected, queries get "?;" right away and other
+        commands are dropped.
+        """
+
+        if self._radio is None:
+            if client is not None:
+                if not self._dropping:
+                    print("    Radio not connected, answering CAT clients with ?;")
+                    self._dropping = True
+                self.dropped_commands += 1
+                if is_query(command):
+                    self._write(client, b'?;')
+            return
+        prefix = bytes(command[:2])
+        if is_query(command):
+            self._pending.append((client, bytes(command), time.monotonic()))
+            self._last_query = time.monotonic()
+            if client is not None:
+                client.pending += 1
+        if client is not None:
+            self._last_sender[prefix] = client
+            self.commands += 1
+
+        self._radio_output += command
+        self._flush_radio()
+        if self._radio is None:
+            # The radio went away while sending, _close_radio() has cleaned up
+            return
+        if len(self._radio_output) > RADIO_HIGH_WATER:
+            self._pause_clients()
+
+
+
+    def _flush_radio(self):
+        try:
+            sent = self._radio.send(self._radio_output)
+            del self._radio_output[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close_radio()
+            return
+
+        events = selectors.EVENT_READ
+        if self._radio_output:
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(self._radio, events, "radio")
+        if self._paused and len(self._radio_output) <= RADIO_LOW_WATER:
+            self._resume_clients()
+
+
+
+    def _read_radio(self):
+        try:
+            data = self._radio.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close_radio()
+            return
+
+        self._tokenizer.feed(data)
+        while True:
+            message = self._tokenizer.next_message()
+            if message is None:
+                break
+            self._radio_message(message)
+
+
+
+    def _radio_message(self, message):
+        """
+        Handle one complete message from the radio and route it to the
+        client that asked for it.
+        """
+
+        prefix = message[:2]
+        now = time.monotonic()
+
+        # Forget queries the radio never answered
+        while self._pending and (now - self._pending[0][2] > PENDING_TIMEOUT):
+            client = self._pending.popleft()[0]
+            if client is not None:
+                client.pending -= 1
+
+        # The oldest query with the same command gets the reply. "?;" is the
+        # radio rejecting the oldest query.
+        for (index, (client, query, sent)) in enumerate(self._pending):
+            if (query[:2] == prefix) or (message == b'?;'):
+                del self._pending[index]
+                self.replies += 1
+                # A reply to a query asked before the last command that set
+                # something may already be out of date
+                if sent >= self._last_write:
+                    self._remember(message, now, query)
+                if client is not None:
+                    client.pending -= 1
+                    self._write(client, message)
+                return
+
+        # Sent by the radio on its own (auto information) or a reply to a
+        # command we didn't recognise as a query
+        self._remember(message, now)
+        self.unsolicited += 1
+        client = self._last_sender.get(prefix)
+        if (client is not None) and not client.closed:
+            self._write(client, message)
+        else:
+            for client in list(self.clients):
+                self._write(client, message)
+
+
+
+    def _remember(self, message, now, query=None):
+        """
+        Update RadioState and the cache from a current reply to "query".
+        Without a query (the radio sent it on its own) it is only cached for
+        commands that have a single read form.
+        """
+
+        self._update_radio(parse_message(message))
+        prefix = message[:2]
+        if (prefix not in CACHED_COMMANDS) or (len(message) <= 3):
+            return
+        if query is None:
+            if prefix in QUERY_PARAMETERS:
+                return
+            query = prefix + b';'
+        self._cache[query] = (message, now)
+
+
+
+    def _update_radio(self, event):
+        """
+        Track the radio's VFOs, and hand the transmit frequency to
+        on_frequency whenever it changes.
+        """
+
+        if not self.radio.update(event):
+            return
+        frequency = self.radio.tune_frequency
+        if (frequency is not None) and (frequency != self.frequency):
+            self.frequency = frequency
+            band = self.plan.band(frequency)
+            if band != self.band:
+                self.band = band
+                print("    Radio on", band or "%8.6f MHz, outside the band plan" % (frequency / 1000000))
+            if self.on_frequency is not None:
+                self.on_frequency(frequency)
+
+
+
+    def _poll(self):
+        """
+        Ask the radio where it is: IF gives the frequency, VFO and split in
+        one reply, and when split the transmit VFO's frequency is asked for
+        too.
+        """
+
+        self._send_radio(b'IF;', None)
+        if self.radio.split and (self.radio.transmit_vfo != 'M'):
+            self._send_radio(b'F' + self.radio.transmit_vfo.encode('ascii') + b';', None)
+
+
+
+    # --- Client side ---
+
+    def _accept(self):
+        (conn, address) = self._listener.accept()
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(conn, address)
+        self.clients.add(client)
+        self._set_events(client)
+        print('    Connected by', address)
+
+
+
+    def _close_client(self, client):
+        if client.closed:
+            return
+        client.closed = True
+        self.clients.discard(client)
+        try:
+            self._selector.unregister(client.conn)
+        except (KeyError, ValueError):
+            pass
+        client.conn.close()
+        if client.hits or client.misses:
+            print('    Disconnected %s, %d of %d reads from cache (%.0f%%)' % (client.address,
+                client.hits, client.hits + client.misses, 100 * client.hit_rate))
+        else:
+            print('    Disconnected', client.address)
+
+
+
+    def _client_events(self, client):
+        events = 0 if self._paused else selectors.EVENT_READ
+        if client.output:
+            events |= selectors.EVENT_WRITE
+        return events
+
+
+
+    def _pause_clients(self):
+        """
+        Stop reading client commands until the radio catches up.
+        """
+
+        if self._paused:
+            return
+        self._paused = True
+        for client in self.clients:
+            self._set_events(client)
+
+
+
+    def _resume_clients(self):
+        if not self._paused:
+            return
+        self._paused = False
+        for client in list(self.clients):
+            self._set_events(client)
+
+
+
+    def _set_events(self, client):
+        """
+        Register the client for the events it needs now: Reading unless
+        paused, writing while output is waiting.
+        """
+
+        events = self._client_events(client)
+        try:
+            if events:
+                try:
+                    self._selector.modify(client.conn, events, client)
+                except KeyError:
+                    self._selector.register(client.conn, events, client)
+            else:
+                self._selector.unregister(client.conn)
+        except (KeyError, ValueError):
+            pass
+
+
+
+    def _write(self, client, data):
+        if client.closed:
+            return
+        client.output += data
+        if len(client.output) > MAX_OUTPUT:
+            print("    Dropping CAT client that isn't reading:", client.address)
+            self.dropped_clients += 1
+            self._close_client(client)
+            return
+        self._flush_client(client)
+
+
+
+    def _flush_client(self, client):
+        try:
+            sent = client.conn.send(client.output)
+            del client.output[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close_client(client)
+            return
+        self._set_events(client)
+
+
+
+    def _read_client(self, client):
+        try:
+            data = client.conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close_client(client)
+            return
+
+        # Forward complete commands only, so commands from different
+        # clients never interleave. Commands that set a VFO's frequency
+        # (the radio doesn't answer those) are tracked like replies.
+        client.tokenizer.feed(data)
+        while True:
+            command = client.tokenizer.next_message()
+            if command is None:
+                break
+            if not is_query(command):
+                # Setting something may change any of the cached replies
+                self._cache.clear()
+                self._last_write = time.monotonic()
+                self._update_radio(parse_message(command))
+            elif self._cached_reply(command, client):
+                continue
+            self._send_radio(command, client)
+
+
+
+    def _cached_reply(self, command, client):
+        """
+        Answer a read-only query from the cache if the last reply is fresh.
+        Only done when the client has no queries waiting at the radio, so it
+        still gets its replies in the order it asked.
+
+        Returns:
+        --------
+        answered: Boolean
+            False if the query has to go to the radio
+        """
+
+        prefix = command[:2]
+        if not self.cache_ttl or (prefix not in CACHED_COMMANDS):
+            return False
+
+        entry = self._cache.get(bytes(command))
+        if (entry is not None) and (client.pending == 0) and (time.monotonic() - entry[1] <= self.cache_ttl):
+            client.hits += 1
+            self.cache_hits += 1
+            self._write(client, entry[0])
+            return True
+
+        client.misses += 1
+        self.cache_misses += 1
+        return False
+
+
+
+    def stats(self):
+        """
+        Cache statistics, overall and for each connected client.
+
+        Returns:
+        --------
+        stats: dict
+            "hits" and "misses" (read-only queries answered from the cache
+            and sent to the radio), "hit_rate", and "clients": A list with
+            the same for each client plus its "address"
+        """
+
+        reads = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": self.cache_hits / reads if reads else 0.0,
+            "clients": [{"address": client.address, "hits": client.hits, "misses": client.misses,
+                "hit_rate": client.hit_rate} for client in self.clients],
+        }
+
+
+
+    # --- Event loop ---
+
+    def serve_forever(self):
+        """
+        Listen for CAT clients, keep the radio connected and pass traffic
+        between them until shutdown() is called.
+        """
+
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(self.address)
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self.address = self._listener.getsockname()[:2]
+
+        self._selector.register(self._listener, selectors.EVENT_READ, "listener")
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ, "wakeup")
+
+        self._running = True
+        try:
+            while self._running:
+                now = time.monotonic()
+                self._check_connect(now)
+                if (self._radio is None) and (self._connecting is None) and (now >= self._reconnect_at):
+                    self._connect_radio()
+
+                if (self._radio is not None) and self.poll_interval and (now - self._last_query >= self.poll_interval):
+                    self._poll()
+
+                for (key, events) in self._selector.select(timeout=0.5):
+                    if key.data == "listener":
+                        self._accept()
+                    elif key.data == "wakeup":
+                        try:
+                            self._wakeup_read.recv(4096)
+                        except BlockingIOError:
+                            pass
+                    elif key.data == "connecting":
+                        self._radio_connected()
+                    elif key.data == "radio":
+                        if events & selectors.EVENT_READ:
+                            self._read_radio()
+                        if (events & selectors.EVENT_WRITE) and (self._radio is not None):
+                            self._flush_radio()
+                    else:
+                        client = key.data
+                        if events & selectors.EVENT_READ:
+                            self._read_client(client)
+                        if (events & selectors.EVENT_WRITE) and not client.closed:
+                            self._flush_client(client)
+        finally:
+            for client in list(self.clients):
+                self._close_client(client)
+            for radio in (self._radio, self._connecting):
+                if radio is not None:
+                    self._selector.unregister(radio)
+                    radio.close()
+            self._radio = None
+            self._connecting = None
+            self._selector.close()
+            self._listener.close()
+
+
+
+    def shutdown(self):
+        """
+        Stop serve_forever(). Safe to call from any thread.
+        """
+
+        self._running = False
+        try:
+            self._wakeup_write.send(b'\0')
+        except OSError:
+            pass
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Share a radio's CAT port with many CAT programs")
+    parser.add_argument('--radio-host', default=RADIO_HOST, help="host of the radio's CAT port")
+    parser.add_argument('--radio-port', type=int, default=RADIO_CAT_PORT, help="TCP port of the radio's CAT port")
+    parser.add_argument('--host', default=CAT_HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=CAT_LISTENER_PORT, help="TCP port to listen on")
+    parser.add_argument('--poll', type=float, default=None, help="ask the radio for its frequency this often when idle")
+    parser.add_argument('--cache-ttl', type=float, default=0.0, help="answer read-only queries from replies this many seconds old")
+    args = parser.parse_args()
+
+    proxy = CATProxy(args.radio_host, args.radio_port, args.host, args.port,
+        on_frequency=lambda frequency: print("Frequency %8.6f MHz" % (frequency / 1000000)),
+        poll_interval=args.poll, cache_ttl=args.cache_ttl)
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+"""
+Simulated SteppIR SDA-100 controller on a pseudo-terminal.
+
+Opens a pty pair and answers the same serial protocol as the real controller
+(see get_status() and set_parameters() in steppir.py) on the slave side, so a
+steppir.SteppIR object can be pointed at the simulator's "port" unchanged:
+
+    import steppir
+    import steppir_sim
+
+    with steppir_sim.SDA100Simulator() as sim:
+        step = steppir.SteppIR(sim.port, 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None)
+        step.set_frequency(14074000)
+
+It models:
+
+    - Motor travel time, based on how far the frequency moves and whether the
+      direction changes.
+    - The 0xff "ac" acknowledge byte after a command is received.
+    - A delay before a new frequency/direction shows up in the status reply.
+    - The AUTOTRACK state machine: 'R' turns AUTOTRACK on, 'U' turns it off,
+      'S' (retract/home) and 'V' (calibrate) work either way, retracting turns
+      AUTOTRACK off, and '1' (set frequency/direction) is ignored while
+      AUTOTRACK is off.
+    - Randomly dropped commands and corrupted status replies.
+    - A fixed baud rate: With "baudrate" set, anything sent while the port
+      is opened at a different rate is ignored, like a real UART would see
+      only framing errors.
+
+Run it from the command line to get a simulated controller for the GUI or
+other programs; it prints the port to connect to.
+"""
+
+import os
+import random
+import select
+import struct
+import termios
+import threading
+import time
+import tty
+
+
+
+# Status reply sent to a "?A\r" query:
+#   0 1      2 3 4 5     6              7          8 9       10
+#   header   frequency   active_motors  direction  version   \r
+STATUS_STRUCT = struct.Struct('>2sIBB2sc')
+
+# "Set" command received from the library:
+#   0 1   2 3 4 5     6   7          8        9      10
+#   @ A   frequency   pa  direction  command  0x00   \r
+COMMAND_STRUCT = struct.Struct('>2sIBBcBc')
+
+# Motor busy bits reported while the elements are moving
+MOTORS_BUSY = 0x07
+
+
+
+class SDA100Simulator:
+    """
+    Simulated SDA-100 controller answering on the slave side of a pty.
+    """
+
+    def __init__(self, frequency=14000000, direction=0x00, autotrack=True, version=b'10',
+            status_delay=0.1, ack_time=0.1, drop_rate=0.0,
+            travel_base=0.2, travel_per_mhz=0.05, direction_time=0.5,
+            retract_time=5.0, header=b'@A', seed=None, baudrate=None, corrupt_rate=0.0):
+        """
+        Set up the simulated controller. Call start() (or use it as a context
+        manager) to open the pty and start answering.
+
+        Parameters:
+        -----------
+        frequency: int
+            Frequency the antenna starts out tuned to, in Hz
+
+        direction: int
+            Starting direction (0x00, 0x20, 0x40 or 0x80)
+
+        autotrack: Boolean
+            Starting AUTOTRACK state
+
+        version: bytes
+            Two ASCII chars reported as the transceiver interface version
+
+        status_delay: float
+            Seconds before a new frequency/direction shows up in the status
+
+        ack_time: float
+            Seconds "ac" reads 0xff after a command is received, 0 to never
+            send the acknowledge (like older firmware)
+
+        drop_rate: float
+            Fraction (0.0 to 1.0) of commands silently ignored
+
+        travel_base: float
+            Seconds of motor travel for any move
+
+        travel_per_mhz: float
+            Additional seconds of motor travel per MHz of frequency change
+
+        direction_time: float
+            Additional seconds of motor travel for a direction change
+
+        retract_time: float
+            Seconds to retract the elements from the highest frequency (scaled
+            by frequency). Calibrating takes a retract plus the trip back out.
+
+        header: bytes
+            Two bytes sent at the start of each status reply
+
+        seed: int
+            Seed for the dropped-command and corruption random generator
+
+        baudrate: int
+            If set, model the time each command and reply spends on a serial
+            line at this rate (10 bits per byte), and ignore everything sent
+            while the port is set to another rate. A pty itself has no baud
+            rate, so without this every byte arrives instantly.
+
+        corrupt_rate: float
+            Fraction (0.0 to 1.0) of status replies with one bit flipped, as
+            by a noisy cable
+        """
+
+        self.status_delay = status_delay
+        self.ack_time = ack_time
+        self.drop_rate = drop_rate
+        self.travel_base = travel_base
+        self.travel_per_mhz = travel_per_mhz
+        self.direction_time = direction_time
+        self.retract_time = retract_time
+        self.header = header
+        self.baudrate = baudrate
+        self.corrupt_rate = corrupt_rate
+        self.version = version
+        self._random = random.Random(seed)
+
+        # Controller state. "reported" values are what the status shows, they
+        # switch to the target values "status_delay" after a command.
+        self.autotrack = autotrack
+        self.frequency = frequency
+        self.direction = direction
+        self.pattern = 0x00
+        self._reported_frequency = frequency
+        self._reported_direction = direction
+        self._report_at = 0.0
+        self._ack_until = 0.0
+        self._busy_until = 0.0
+
+        # Counters
+        self.status_queries = 0
+        self.commands = 0
+        self.dropped = 0
+        self.ignored = 0
+        self.corrupted = 0
+        self.wrong_rate = 0
+
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+
+
+    def start(self):
+        """
+        Open the pty pair and start answering on it. The device to connect
+        to is then in "port".
+        """
+
+        (self._master, self._slave) = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sda100-sim", daemon=True)
+        self._thread.start()
+        return self
+
+
+
+    def stop(self):
+        """
+        Stop answering and close the pty pair.
+        """
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = None
+        self._slave = None
+
+
+
+    def __enter__(self):
+        return self.start()
+
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+
+    def busy(self, now=None):
+        """
+        True while the simulated motors are moving.
+        """
+
+        if now is None:
+            now = time.monotonic()
+        return now < self._busy_until
+
+
+
+    def status(self, now=None):
+        """
+        Build the 11-byte status reply for the current state.
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            if now >= self._report_at:
+                self._reported_frequency = self.frequency
+                self._reported_direction = self.direction
+
+            if now < self._ack_until:
+                active_motors = 0xff
+            elif now < self._busy_until:
+                active_motors = MOTORS_BUSY
+            else:
+                active_motors = 0x00
+
+            return STATUS_STRUCT.pack(self.header, self._reported_frequency // 10, active_motors,
+                self._reported_direction, self.version, b'\r')
+
+
+
+    def command(self, frequency, direction, command, now=None, pattern=0x00):
+        """
+        Apply a "set" command as the controller would.
+
+        Parameters:
+        -----------
+        frequency: int
+            Frequency in Hz
+
+        direction: int
+            Direction byte
+
+        command: bytes
+            Command byte: b'1', b'R', b'U', b'S' or b'V'
+
+        now: float
+            Optional time.monotonic() time the command arrived
+
+        pattern: int
+            The "pa" byte, antenna pattern used with direction 0xc0
+
+        Returns:
+        --------
+        accepted: Boolean
+            False if the command was dropped or ignored
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            self.commands += 1
+            if self._random.random() < self.drop_rate:
+                self.dropped += 1
+                return False
+
+            travel = 0.0
+            if command == b'1':
+                if not self.autotrack:
+                    self.ignored += 1
+                    return False
+                travel = self.travel_base + abs(frequency - self.frequency) / 1e6 * self.travel_per_mhz
+                if (direction & 0xe0) != self.direction:
+                    travel += self.direction_time
+                self.frequency = frequency
+                self.direction = direction & 0xe0
+                self.pattern = pattern
+            elif command == b'R':
+                self.autotrack = True
+            elif command == b'U':
+                self.autotrack = False
+            elif command == b'S':
+                travel = self.travel_base + self.retract_time * self.frequency / 54e6
+                self.autotrack = False
+                self.frequency = 0
+            elif command == b'V':
+                travel = 2 * (self.travel_base + self.retract_time * self.frequency / 54e6)
+            else:
+                self.ignored += 1
+                return False
+
+            self._report_at = now + self.status_delay
+            self._ack_until = now + self.ack_time
+            # A new target replaces the move in progress: The motors head
+            # for it right away, so they are busy for its travel time only
+            if travel > 0:
+                self._busy_until = now + travel
+            return True
+
+
+
+    def _wire_time(self, length):
+        """
+        Seconds "length" bytes spend on the serial line at "baudrate".
+        """
+
+        if not self.baudrate:
+            return 0.0
+        return length * 10.0 / self.baudrate
+
+
+
+    def _line_rate_ok(self):
+        """
+        False if the port is opened at a different baud rate than the
+        simulated controller's.
+        """
+
+        if not self.baudrate:
+            return True
+        speed = getattr(termios, "B%d" % self.baudrate, None)
+        return termios.tcgetattr(self._slave)[5] == speed
+
+
+
+    def _reply(self, request_length, reply):
+        """
+        Send a reply once the request and the reply would have crossed the
+        serial line.
+        """
+
+        if self.corrupt_rate and self._random.random() < self.corrupt_rate:
+            self.corrupted += 1
+            reply = bytearray(reply)
+            reply[self._random.randrange(len(reply))] ^= 1 << self._random.randrange(8)
+            reply = bytes(reply)
+
+        delay = self._wire_time(request_length + len(reply))
+        if delay > 0:
+            time.sleep(delay)
+        os.write(self._master, reply)
+
+
+
+    def _run(self):
+        """
+        Read commands from the master side of the pty and answer them.
+        """
+
+        buffer = bytearray()
+        while not self._stop.is_set():
+            (readable, _, _) = select.select([self._master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 256)
+            except OSError:
+                continue
+            if not self._line_rate_ok():
+                self.wrong_rate += len(data)
+                continue
+            buffer += data
+
+            while buffer:
+                if buffer[:3] == b'?A\r':
+                    del buffer[:3]
+                    self.status_queries += 1
+                    self._reply(3, self.status())
+                elif buffer[:2] == b'@A':
+                    if len(buffer) < COMMAND_STRUCT.size:
+                        break
+                    (_, frequency, pa, direction, command, _, _) = COMMAND_STRUCT.unpack(buffer[:COMMAND_STRUCT.size])
+                    del buffer[:COMMAND_STRUCT.size]
+                    delay = self._wire_time(COMMAND_STRUCT.size)
+                    if delay > 0:
+                        time.sleep(delay)
+                    self.command(frequency * 10, direction, command, pattern=pa)
+                elif (len(buffer) < 3) and (b'?A\r'.startswith(bytes(buffer)) or b'@A'.startswith(bytes(buffer))):
+                    # Start of a command, wait for the rest
+                    break
+                else:
+                    # Not a command we know: Resynchronize on the next byte
+                    del buffer[:1]
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulated SteppIR SDA-100 controller on a pseudo-terminal")
+    parser.add_argument('--frequency', type=int, default=14000000, help="starting frequency in Hz")
+    parser.add_argument('--status-delay', type=float, default=0.1, help="seconds before status reflects a command")
+    parser.add_argument('--ack-time', type=float, default=0.1, help="seconds 'ac' reads 0xff after a command, 0 for none")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="fraction of commands to ignore")
+    parser.add_argument('--baudrate', type=int, default=None, help="model serial line time at this baud rate, ignore other rates")
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help="fraction of status replies to corrupt")
+    parser.add_argument('--seed', type=int, default=None, help="random seed for dropped commands")
+    args = parser.parse_args()
+
+    with SDA100Simulator(frequency=args.frequency, status_delay=args.status_delay,
+            ack_time=args.ack_time, drop_rate=args.drop_rate, baudrate=args.baudrate,
+            corrupt_rate=args.corrupt_rate, seed=args.seed) as sim:
+        print("Simulated SDA-100 on", sim.port)
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
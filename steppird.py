@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+
+"""
+steppird: A network daemon that owns the SteppIR controller's serial port and
+shares it with any number of clients (loggers, contest programs, the GUI, web
+dashboards...).
+
+Only the daemon talks to the controller. Commands from clients are run one at
+a time from a priority queue (AUTOTRACK/RETRACT/CALIBRATE ahead of tuning).
+Status is polled by the daemon alone and served to clients from its cache, so
+each status reply crosses the serial link once no matter how many clients
+are connected. Clients that SUBSCRIBE get the new status pushed to them when
+it changes instead of having to poll.
+
+The protocol is line based ASCII over TCP (port 19091 by default). Each
+command is one line; replies are one line:
+
+    STATUS                      -> STATUS frequency=14074000 direction=0x00 active_motors=0x00 label=Normal version=10 age=0.21
+    FREQ 14074000               -> OK FREQ          (after the antenna reports the new frequency)
+    DIR NORMAL|180|BIDIR|3/4    -> OK DIR
+    APPLY 14074000 180          -> OK APPLY         (frequency and direction in one command)
+    PATTERN 3                   -> OK PATTERN
+    AUTOTRACK ON|OFF            -> OK AUTOTRACK
+    RETRACT                     -> OK RETRACT       (once the elements are in)
+    CALIBRATE                   -> OK CALIBRATE
+    SUBSCRIBE                   -> OK SUBSCRIBE, then EVENT STATUS ... lines on every change
+    UNSUBSCRIBE                 -> OK UNSUBSCRIBE
+    QUIT                        -> connection closed
+
+Errors are reported as "ERR <command> <message>".
+
+RETRACT and CALIBRATE run in the background for up to a minute or two. The
+daemon keeps polling and serving STATUS meanwhile, and subscribers get
+
+    EVENT HOMING kind=retract active_motors=0x07 elapsed=12.3 remaining=20.1
+
+after every status read until it is done ("remaining=unknown" without a
+travel model). Commands that would move the antenna get an ERR until then.
+
+Run it with the serial port of the controller:
+
+    steppird.py --serial /dev/ttyUSB0 --baud 1200
+"""
+
+import itertools
+import queue
+import selectors
+import socket
+import threading
+import time
+
+import steppir
+
+
+
+HOST = "127.0.0.1"
+PORT = 19091
+
+# Lower numbers run first
+PRIORITY_CONTROL = 0
+PRIORITY_TUNE = 1
+
+# Disconnect clients that stop reading once this much output is queued
+MAX_OUTPUT = 65536
+
+DIRECTIONS = {
+    "NORMAL": 0x00,
+    "3/4": 0x20,
+    "180": 0x40,
+    "BIDIR": 0x80,
+    }
+
+
+
+def format_status(status, now=None):
+    """
+    Format a StatusFrame as a STATUS line (without the line ending).
+    """
+
+    if now is None:
+        now = time.monotonic()
+    age = (now - status.timestamp) if status.timestamp is not None else 0.0
+    return "STATUS frequency=%d direction=0x%02x active_motors=0x%02x label=%s version=%s age=%.2f" % (
+        status.frequency, status.direction, status.active_motors, status.dir_label.replace(" ", "_"),
+        status.version.decode('ascii', 'replace'), age)
+
+
+
+class _Client:
+    """
+    Connection state for one TCP client.
+    """
+
+    def __init__(self, conn, address):
+        self.conn = conn
+        self.address = address
+        self.input = bytearray()
+        self.output = bytearray()
+        self.subscribed = False
+        self.closed = False
+
+
+
+class SteppIRDaemon:
+    """
+    Shares one SteppIR controller with many TCP clients.
+
+    The network side runs on a selectors event loop in the thread that calls
+    serve_forever(). The serial side runs on a single worker thread which
+    takes commands from a priority queue and polls status when idle.
+    """
+
+    def __init__(self, step, host=HOST, port=PORT, poll_interval=0.5):
+        """
+        Parameters:
+        -----------
+        step: steppir.SteppIR
+            The controller. The daemon should be the only user of it.
+
+        host: str
+            Address to listen on
+
+        port: int
+            TCP port to listen on
+
+        poll_interval: float
+            Seconds between status polls while idle
+        """
+
+        self.step = step
+        self.host = host
+        self.port = port
+        self.poll_interval = poll_interval
+
+        self.status = None
+        self._last_event = None
+        self._status_lock = threading.Lock()
+        self._commands = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._stopping = threading.Event()
+        self._worker = None
+
+        # Replies from the worker thread are handed to the event loop through
+        # this queue and a wakeup socket pair
+        self._outbox = queue.Queue()
+        (self._wakeup_read, self._wakeup_write) = socket.socketpair()
+        self._wakeup_read.setblocking(False)
+        self._wakeup_write.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._listener = None
+        self._clients = set()
+
+
+
+    # --- Serial side (worker thread) ---
+
+    def _poll(self):
+        """
+        Read the controller status once and tell subscribers if it changed.
+        """
+
+        try:
+            status = self.step.get_status(max_age=self.poll_interval)
+        except (steppir.FrameError, OSError) as error:
+            print("Status poll failed:", error)
+            return
+
+        self._publish(status)
+
+
+
+    def _publish(self, status):
+        """
+        Keep "status" for STATUS and tell subscribers if it changed. Called
+        from the worker and from retract/calibrate threads.
+        """
+
+        with self._status_lock:
+            self.status = status
+            key = (status.frequency, status.direction, status.active_motors)
+            if key == self._last_event:
+                return
+            self._last_event = key
+        self._send(None, "EVENT " + format_status(status))
+
+
+
+    def _homing_progress(self, operation):
+        """
+        Progress callback of a retract/calibrate: Publish the status it read.
+        """
+
+        if operation.status is None:
+            return
+        self._publish(operation.status)
+        remaining = operation.remaining
+        self._send(None, "EVENT HOMING kind=%s active_motors=0x%02x elapsed=%.1f remaining=%s" % (
+            operation.kind, operation.active_motors, operation.elapsed,
+            "%.1f" % remaining if remaining is not None else "unknown"))
+
+
+
+    def _homing_done(self, client, name, operation):
+        try:
+            status = operation.result(0)
+        except Exception as error:
+            self._send(client, "ERR %s %s" % (name, error))
+            return
+        if status is not None:
+            self._publish(status)
+        self._send(client, "OK " + name)
+
+
+
+    def _run_worker(self):
+        next_poll = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                (priority, sequence, job) = self._commands.get(timeout=max(0.0, next_poll - time.monotonic()))
+            except queue.Empty:
+                self._poll()
+                next_poll = time.monotonic() + self.poll_interval
+                continue
+
+            if job is None:
+                break
+
+            (client, name, func, args, kwargs) = job
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                self._send(client, "ERR %s %s" % (name, error))
+            else:
+                if isinstance(result, steppir.HomingOperation):
+                    # Runs on its own thread, reply when it is done
+                    result.add_done_callback(lambda operation, client=client, name=name:
+                        self._homing_done(client, name, operation))
+                else:
+                    self._send(client, "OK " + name)
+
+            # Commands change state, let subscribers know right away
+            self._poll()
+            next_poll = time.monotonic() + self.poll_interval
+
+
+
+    def submit(self, client, priority, name, func, *args, **kwargs):
+        """
+        Queue a command for the controller. The reply goes to "client".
+        """
+
+        self._commands.put((priority, next(self._sequence), (client, name, func, args, kwargs)))
+
+
+
+    # --- Network side (event loop) ---
+
+    def _send(self, client, line):
+        """
+        Queue a reply line for a client, or for all subscribers if "client"
+        is None. Safe to call from any thread.
+        """
+
+        self._outbox.put((client, line))
+        try:
+            self._wakeup_write.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+
+
+    def _deliver(self):
+        """
+        Move queued reply lines into the client output buffers.
+        """
+
+        try:
+            while self._wakeup_read.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+        while True:
+            try:
+                (client, line) = self._outbox.get_nowait()
+            except queue.Empty:
+                break
+
+            data = (line + "\n").encode('ascii')
+            if client is None:
+                targets = [c for c in self._clients if c.subscribed]
+            else:
+                targets = [client] if client in self._clients else []
+            for target in targets:
+                self._write(target, data)
+
+
+
+    def _write(self, client, data):
+        if client.closed:
+            return
+        client.output += data
+        if len(client.output) > MAX_OUTPUT:
+            print("Dropping client that isn't reading:", client.address)
+            self._close_client(client)
+            return
+        self._flush(client)
+
+
+
+    def _flush(self, client):
+        try:
+            sent = client.conn.send(client.output)
+            del client.output[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close_client(client)
+            return
+
+        events = selectors.EVENT_READ
+        if client.output:
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(client.conn, events, client)
+
+
+
+    def _accept(self):
+        (conn, address) = self._listener.accept()
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(conn, address)
+        self._clients.add(client)
+        self._selector.register(conn, selectors.EVENT_READ, client)
+
+
+
+    def _close_client(self, client):
+        if client.closed:
+            return
+        client.closed = True
+        self._clients.discard(client)
+        try:
+            self._selector.unregister(client.conn)
+        except (KeyError, ValueError):
+            pass
+        client.conn.close()
+
+
+
+    def _read(self, client):
+        try:
+            data = client.conn.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close_client(client)
+            return
+
+        client.input += data
+        while not client.closed:
+            end = client.input.find(b'\n')
+            if end < 0:
+                break
+            line = client.input[:end].decode('ascii', 'replace').strip()
+            del client.input[:end + 1]
+            if line:
+                self._handle(client, line)
+
+
+
+    def _handle(self, client, line):
+        """
+        Carry out one command line from a client.
+        """
+
+        words = line.split()
+        name = words[0].upper()
+        args = words[1:]
+        step = self.step
+
+        try:
+            if name == "STATUS":
+                if self.status is None:
+                    self._write(client, b"ERR STATUS No status from the controller yet\n")
+                else:
+                    self._write(client, (format_status(self.status) + "\n").encode('ascii'))
+            elif name == "SUBSCRIBE":
+                client.subscribed = True
+                self._write(client, b"OK SUBSCRIBE\n")
+                if self.status is not None:
+                    self._write(client, ("EVENT " + format_status(self.status) + "\n").encode('ascii'))
+            elif name == "UNSUBSCRIBE":
+                client.subscribed = False
+                self._write(client, b"OK UNSUBSCRIBE\n")
+            elif name == "QUIT":
+                self._close_client(client)
+            elif name == "FREQ":
+                self.submit(client, PRIORITY_TUNE, name, step.apply, int(args[0]), None)
+            elif name == "DIR":
+                self.submit(client, PRIORITY_TUNE, name, step.apply, None, DIRECTIONS[args[0].upper()])
+            elif name == "APPLY":
+                self.submit(client, PRIORITY_TUNE, name, step.apply, int(args[0]), DIRECTIONS[args[1].upper()])
+            elif name == "PATTERN":
+                self.submit(client, PRIORITY_TUNE, name, step.apply, pattern=int(args[0], 0))
+            elif name == "AUTOTRACK":
+                if args[0].upper() == "ON":
+                    self.submit(client, PRIORITY_CONTROL, name, step.set_autotrack_ON)
+                elif args[0].upper() == "OFF":
+                    self.submit(client, PRIORITY_CONTROL, name, step.set_autotrack_OFF)
+                else:
+                    raise ValueError("AUTOTRACK needs ON or OFF")
+            elif name == "RETRACT":
+                self.submit(client, PRIORITY_CONTROL, name, step.start_retract, progress=self._homing_progress)
+            elif name == "CALIBRATE":
+                self.submit(client, PRIORITY_CONTROL, name, step.start_calibrate, progress=self._homing_progress)
+            else:
+                self._write(client, ("ERR %s Unknown command\n" % name).encode('ascii'))
+        except (IndexError, KeyError, ValueError) as error:
+            self._write(client, ("ERR %s Bad arguments: %s\n" % (name, error)).encode('ascii'))
+
+
+
+    def serve_forever(self):
+        """
+        Open the listening socket, start the worker thread and serve clients
+        until shutdown() is called.
+        """
+
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((self.host, self.port))
+        self._listener.listen()
+        self._listener.setblocking(False)
+        (self.host, self.port) = self._listener.getsockname()[:2]
+
+        self._selector.register(self._listener, selectors.EVENT_READ, "listener")
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ, "wakeup")
+
+        self._worker = threading.Thread(target=self._run_worker, name="steppird-serial", daemon=True)
+        self._worker.start()
+
+        try:
+            while not self._stopping.is_set():
+                for (key, events) in self._selector.select(timeout=1.0):
+                    if key.data == "listener":
+                        self._accept()
+                    elif key.data == "wakeup":
+                        self._deliver()
+                    else:
+                        client = key.data
+                        if events & selectors.EVENT_READ:
+                            self._read(client)
+                        if (events & selectors.EVENT_WRITE) and not client.closed:
+                            self._flush(client)
+        finally:
+            for client in list(self._clients):
+                self._close_client(client)
+            self._selector.close()
+            self._listener.close()
+            self._commands.put((-1, -1, None))
+            self._worker.join()
+            self.step.close()
+
+
+
+    def shutdown(self):
+        """
+        Stop serve_forever(). Safe to call from any thread.
+        """
+
+        self._stopping.set()
+        self._commands.put((-1, -1, None))
+        try:
+            self._wakeup_write.send(b'\0')
+        except OSError:
+            pass
+
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Share a SteppIR controller with many network clients")
+    parser.add_argument('--serial', default="/dev/ttyUSB0", help="serial port of the controller")
+    parser.add_argument('--baud', type=int, default=1200, help="baud rate set in the controller")
+    parser.add_argument('--host', default=HOST, help="address to listen on")
+    parser.add_argument('--port', type=int, default=PORT, help="TCP port to listen on")
+    parser.add_argument('--poll', type=float, default=0.5, help="seconds between status polls")
+    args = parser.parse_args()
+
+    step = steppir.SteppIR(
+        args.serial,# port
+        args.baud,  # baudrate
+        8,          # bytesize
+        'N',        # parity
+        1,          # stopbits
+        2.0,        # read_timeout
+        False,      # xonxoff
+        False,      # rtscts
+        2.0,        # write_timeout
+        False,      # dsrdtr
+        None,       # inter_byte_timeout
+        True)       # exclusive port access
+
+    daemon = SteppIRDaemon(step, args.host, args.port, args.poll)
+    print("steppird listening on %s:%d" % (args.host, args.port))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
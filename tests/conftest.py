@@ -0,0 +1,161 @@
+"""
+Shared fixtures: The modules live at the top of the tree. Tests that only
+need something to answer on the serial port use FakeController, the ones
+that need a controller that behaves like the real thing use the SDA-100
+simulator on a pty.
+"""
+
+import os
+import struct
+import sys
+import threading
+import time
+
+import pytest
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import steppir
+
+
+
+class FakeController:
+    """
+    Stands in for serial.Serial. Status queries are answered at once from
+    "frequency", "active_motors" and "direction", '1' commands take effect
+    at once unless "frozen" is set, and every write is recorded with the
+    time it was made.
+    """
+
+    def __init__(self, frequency=14000000, active_motors=0x00, direction=0x00):
+        self.frequency = frequency
+        self.active_motors = active_motors
+        self.direction = direction
+        self.frozen = False
+        self.fail_writes = 0
+        self.writes = []
+        self.ports = []
+        self._lock = threading.Lock()
+
+
+
+    def __call__(self, *args, **kwargs):
+        port = FakePort(self)
+        self.ports.append(port)
+        return port
+
+
+
+    @property
+    def status_queries(self):
+        return sum(1 for (timestamp, data) in self.writes if data == b'?A\r')
+
+
+
+    @property
+    def commands(self):
+        return [data for (timestamp, data) in self.writes if data[:2] == b'@A']
+
+
+
+    def reply(self, data):
+        """
+        Record a write and return the bytes the controller answers with.
+        """
+
+        with self._lock:
+            self.writes.append((time.monotonic(), bytes(data)))
+            if data == b'?A\r':
+                return b'@A' + struct.pack('>IBB2s', self.frequency // 10, self.active_motors,
+                    self.direction, b'10') + b'\r'
+            if (len(data) == 11) and (data[8:9] == b'1') and not self.frozen:
+                self.frequency = struct.unpack('>I', data[2:6])[0] * 10
+                self.direction = data[7]
+            return b''
+
+
+
+class FakePort:
+    """
+    One open "serial port" on a FakeController.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.is_open = True
+        self._input = bytearray()
+
+
+
+    def _check(self):
+        if not self.is_open:
+            raise serial.SerialException("Port is closed")
+
+
+
+    @property
+    def in_waiting(self):
+        self._check()
+        return len(self._input)
+
+
+
+    def reset_input_buffer(self):
+        self._input.clear()
+
+
+
+    def write(self, data):
+        self._check()
+        if self.controller.fail_writes:
+            self.controller.fail_writes -= 1
+            raise serial.SerialException("Write failed")
+        self._input += self.controller.reply(data)
+        return len(data)
+
+
+
+    def read(self, size=1):
+        self._check()
+        data = bytes(self._input[:size])
+        del self._input[:size]
+        return data
+
+
+
+    def close(self):
+        self.is_open = False
+
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    controller = FakeController()
+    monkeypatch.setattr(serial, "Serial", controller)
+    return controller
+
+
+
+@pytest.fixture
+def fake_step(fake):
+    controller = steppir.SteppIR("/dev/fake", 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None)
+    yield controller
+    controller.close()
+
+
+
+@pytest.fixture
+def sim():
+    steppir_sim = pytest.importorskip("steppir_sim")
+    with steppir_sim.SDA100Simulator(frequency=14000000, status_delay=0.05, ack_time=0.05,
+            travel_base=0.1, travel_per_mhz=0.02, direction_time=0.1, retract_time=1.0, seed=1) as simulator:
+        yield simulator
+
+
+
+@pytest.fixture
+def step(sim):
+    controller = steppir.SteppIR(sim.port, 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None)
+    yield controller
+    controller.close()
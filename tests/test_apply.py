@@ -0,0 +1,43 @@
+"""
+apply(): Frequency, direction and pattern in as few commands as possible.
+"""
+
+import pytest
+
+
+
+def test_frequency_and_direction_in_one_command(sim, step):
+    status = step.apply(21074000, 0x40)
+    assert (status.frequency, status.direction) == (21074000, 0x40)
+    assert (sim.frequency, sim.direction) == (21074000, 0x40)
+    assert sim.commands == 1
+
+
+
+def test_nothing_to_do(sim, step):
+    status = step.apply(14000000, 0x00)
+    assert status.frequency == 14000000
+    assert sim.commands == 0
+
+
+
+def test_keeps_what_is_not_given(sim, step):
+    step.apply(direction=0x80)
+    assert (sim.frequency, sim.direction) == (14000000, 0x80)
+    step.apply(frequency=18100000)
+    assert (sim.frequency, sim.direction) == (18100000, 0x80)
+    assert sim.commands == 2
+
+
+
+def test_pattern(sim, step):
+    # The controller doesn't report the pattern, so it is always sent
+    step.apply(pattern=0x05)
+    step.apply(pattern=0x05)
+    assert sim.commands == 2
+    assert (sim.direction, sim.pattern) == (0xc0, 0x05)
+
+    with pytest.raises(ValueError):
+        step.apply(pattern=0x10)
+    with pytest.raises(ValueError):
+        step.apply(direction=0x40, pattern=0x01)
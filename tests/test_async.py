@@ -0,0 +1,107 @@
+"""
+AsyncSteppIR: Coroutines run on the I/O thread, and cancelling one stops
+the I/O thread waiting on the controller.
+"""
+
+import asyncio
+import threading
+import time
+
+import steppir
+
+
+
+def make_async():
+    return steppir.AsyncSteppIR("/dev/fake", 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None)
+
+
+
+def test_status_and_set_frequency(fake):
+    async def main():
+        async with make_async() as step:
+            status = await step.get_status()
+            assert status[0] == 14000000
+            await step.set_frequency(21074000)
+            return await step.get_frequency()
+
+    assert asyncio.run(main()) == 21074000
+    assert fake.frequency == 21074000
+
+
+
+def test_runs_on_one_io_thread(fake):
+    threads = set()
+
+    async def main():
+        step = make_async()
+        get_status = step.steppir.get_status
+        def spy(*args):
+            threads.add(threading.current_thread())
+            return get_status(*args)
+        step.steppir.get_status = spy
+        results = await asyncio.gather(*(step.get_status() for i in range(5)))
+        await step.close()
+        return results
+
+    results = asyncio.run(main())
+    assert len(results) == 5
+    assert len(threads) == 1
+    assert threading.main_thread() not in threads
+
+
+
+def test_cancel_sets_abort(fake):
+    started = threading.Event()
+    aborts = []
+
+    def set_frequency(frequency, abort=None):
+        aborts.append(abort)
+        started.set()
+        if abort.wait(5):
+            raise steppir.CommandAborted("Stopped waiting for the controller")
+
+    async def main():
+        step = make_async()
+        step.steppir.set_frequency = set_frequency
+        task = asyncio.ensure_future(step.set_frequency(21074000))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        # The I/O thread is free again straight away
+        start = time.monotonic()
+        status = await step.get_status()
+        await step.close()
+        return (status, time.monotonic() - start)
+
+    (status, elapsed) = asyncio.run(main())
+    assert aborts[0].is_set()
+    assert status[0] == 14000000
+    assert elapsed < 1.0
+
+
+
+def test_cancel_stops_waiting_for_the_controller(fake):
+    # The controller never shows the new frequency
+    fake.frozen = True
+
+    async def main():
+        step = make_async()
+        task = asyncio.ensure_future(step.set_frequency(21074000))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        start = time.monotonic()
+        await step.get_status()
+        await step.close()
+        return time.monotonic() - start
+
+    # Without the abort the I/O thread would keep polling for seconds
+    assert asyncio.run(main()) < 0.8
@@ -0,0 +1,116 @@
+"""
+BandPlan lookups at and around the band edges, loading plans, and
+BandMemory.
+"""
+
+import json
+
+import pytest
+
+import steppir
+
+
+
+@pytest.fixture
+def plan():
+    return steppir.BandPlan.region("IARU2")
+
+
+
+def test_band_edges(plan):
+    assert plan.band(14000000) == "20m"
+    assert plan.band(14350000) == "20m"
+    assert plan.band(13999999) is None
+    assert plan.band(14350001) is None
+    assert plan.band(1800000) == "160m"
+    assert plan.band(1799999) is None
+    assert plan.band(54000000) == "6m"
+    assert plan.band(54000001) is None
+    assert plan.band(0) is None
+    assert plan.edges("17m") == (18068000, 18168000)
+
+
+
+def test_next(plan):
+    assert plan.next(14000000) == "17m"
+    assert plan.next(14350000) == "17m"
+    # Between bands: the first band above
+    assert plan.next(15000000) == "17m"
+    assert plan.next(0) == "160m"
+    # Wraps from the top band to the bottom
+    assert plan.next(50000000) == "160m"
+    assert plan.next(60000000) == "160m"
+
+
+
+def test_previous(plan):
+    assert plan.previous(14000000) == "30m"
+    assert plan.previous(14350000) == "30m"
+    # Between bands: the first band below
+    assert plan.previous(15000000) == "20m"
+    assert plan.previous(60000000) == "6m"
+    # Wraps from the bottom band to the top
+    assert plan.previous(1800000) == "6m"
+    assert plan.previous(0) == "6m"
+
+
+
+def test_covering(plan):
+    yagi = plan.covering(6800000, 54000000)
+    assert [band[2] for band in yagi] == ["40m", "30m", "20m", "17m", "15m", "12m", "10m", "6m"]
+    assert "80m" not in yagi
+    assert yagi.previous(7000000) == "6m"
+
+
+
+def test_overlap_and_unknown_region():
+    with pytest.raises(ValueError):
+        steppir.BandPlan([(14000000, 14350000, "20m"), (14300000, 14400000, "oops")])
+    with pytest.raises(ValueError):
+        steppir.BandPlan.region("Mars")
+
+
+
+def test_load(tmp_path):
+    path = tmp_path / "plan.json"
+    path.write_text(json.dumps({"region": "IARU1", "bands": [[3500000, 4000000, "80m"], [70000000, 70500000, "4m"]],
+        "covering": [3000000, 80000000]}))
+    plan = steppir.BandPlan.load(str(path))
+    assert "160m" not in plan
+    assert plan.edges("80m") == (3500000, 4000000)
+    assert plan.edges("40m") == (7000000, 7200000)
+    assert plan.band(70200000) == "4m"
+    assert plan.next(52000000) == "4m"
+
+    # The argument overrides the file's region
+    assert steppir.BandPlan.load(str(path), region="US").edges("60m") == (5330500, 5406400)
+
+
+
+def test_band_memory_round_trip(tmp_path):
+    path = str(tmp_path / "bands.json")
+    memory = steppir.BandMemory.load(path)
+    assert memory.recall("20m") is None
+
+    memory.remember("20m", 14074000, 0x40)
+    memory.remember("15m", 21074000, 0x00)
+    assert memory.recall("20m") == (14074000, 0x40)
+
+    loaded = steppir.BandMemory.load(path)
+    assert loaded.recall("20m") == (14074000, 0x40)
+    assert loaded.recall("15m") == (21074000, 0x00)
+    assert loaded.export() == memory.export()
+
+
+
+def test_change_band(sim, step, tmp_path):
+    plan = steppir.BandPlan.region("IARU2").covering(6800000, 54000000)
+    memory = steppir.BandMemory(str(tmp_path / "bands.json"))
+    memory.remember("17m", 18100000, 0x00)
+
+    status = step.change_band(1, plan, memory)
+    assert status.frequency == 18100000
+    assert memory.recall("20m") == (14000000, 0x00)
+
+    status = step.change_band(-1, plan, memory)
+    assert status.frequency == 14000000
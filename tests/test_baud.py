@@ -0,0 +1,114 @@
+"""
+Baud rate discovery and link quality against a simulator set to 4800 baud.
+"""
+
+import json
+
+import pytest
+import serial
+
+import steppir
+
+steppir_sim = pytest.importorskip("steppir_sim")
+
+RATES = (1200, 4800, 9600)
+
+
+
+@pytest.fixture
+def sim4800():
+    with steppir_sim.SDA100Simulator(status_delay=0.05, ack_time=0.05, travel_base=0.1, travel_per_mhz=0.02,
+            baudrate=4800, seed=1) as simulator:
+        yield simulator
+
+
+
+def test_probe(sim4800):
+    result = steppir.probe_baudrate(sim4800.port, 4800, samples=5)
+    assert (result["sent"], result["valid"], result["error_rate"]) == (5, 5, 0.0)
+
+    # Nothing answers at a wrong rate: Given up after a few tries
+    result = steppir.probe_baudrate(sim4800.port, 1200, samples=5, give_up=2)
+    assert (result["sent"], result["valid"], result["error_rate"]) == (2, 0, 1.0)
+    assert sim4800.wrong_rate > 0
+
+
+
+def test_discover(sim4800, tmp_path):
+    cache = str(tmp_path / "baud.json")
+    result = steppir.discover_baudrate(sim4800.port, RATES, samples=5, cache=cache)
+    assert result["baudrate"] == 4800
+    assert list(result["rates"]) == [1200, 4800]
+    assert result["recommended"] == 4800
+    assert result["history"] == {4800: {"sent": 5, "valid": 5}}
+
+    with open(cache) as input_file:
+        assert json.load(input_file)["ports"][sim4800.port]["baudrate"] == 4800
+
+    # The known rate is tried first next time
+    result = steppir.discover_baudrate(sim4800.port, RATES, samples=5, cache=cache)
+    assert list(result["rates"]) == [4800]
+
+
+
+def test_nothing_answers(sim4800):
+    result = steppir.discover_baudrate(sim4800.port, (1200, 2400), samples=3)
+    assert result["baudrate"] is None
+    assert result["recommended"] is None
+
+
+
+def test_steppir_finds_the_rate(sim4800, tmp_path):
+    step = steppir.SteppIR(sim4800.port, None, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None,
+        baud_cache=str(tmp_path / "baud.json"))
+    try:
+        assert step.get_status()[0] == 14000000
+        assert step.baud_rate == 4800
+    finally:
+        step.close()
+
+
+
+def test_steppir_no_answer():
+    # Set to a rate the library doesn't try
+    with steppir_sim.SDA100Simulator(baudrate=300) as sim:
+        step = steppir.SteppIR(sim.port, None, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None)
+        try:
+            with pytest.raises(serial.SerialException, match="No controller answered"):
+                step.get_status()
+        finally:
+            step.close()
+
+
+
+def test_quick_checks_the_known_rate_once(sim4800, tmp_path):
+    cache = str(tmp_path / "baud.json")
+    steppir.discover_baudrate(sim4800.port, RATES, samples=5, cache=cache)
+    with open(cache) as input_file:
+        saved = input_file.read()
+
+    queries = sim4800.status_queries
+    result = steppir.discover_baudrate(sim4800.port, RATES, samples=5, cache=cache, quick=True)
+    assert result["baudrate"] == 4800
+    assert list(result["rates"]) == [4800]
+    assert sim4800.status_queries == queries + 1
+    # Nothing measured, nothing saved
+    with open(cache) as input_file:
+        assert input_file.read() == saved
+
+
+
+def test_moving_replies_are_left_out(sim4800, tmp_path):
+    sim4800.travel_base = 5.0
+    sim4800.command(21074000, 0x00, b'1')
+    assert sim4800.busy()
+
+    result = steppir.probe_baudrate(sim4800.port, 4800, samples=5)
+    assert result["moving"] == 5
+    assert (result["sent"], result["valid"], result["error_rate"]) == (0, 0, 0.0)
+
+    # Found, but the measurement isn't kept
+    cache = str(tmp_path / "baud.json")
+    result = steppir.discover_baudrate(sim4800.port, RATES, samples=5, cache=cache)
+    assert result["baudrate"] == 4800
+    assert result["history"] == {}
@@ -0,0 +1,50 @@
+"""
+The benchmark harness: percentiles, and short runs of the benchmarks
+against the simulator.
+"""
+
+import pytest
+
+steppir_bench = pytest.importorskip("steppir_bench")
+
+
+
+def test_percentiles():
+    summary = steppir_bench.percentiles([float(i) for i in range(1, 101)])
+    assert summary["count"] == 100
+    assert summary["min"] == 1.0
+    assert summary["max"] == 100.0
+    assert summary["p50"] == 50.0
+    assert summary["p95"] == 95.0
+    assert summary["p99"] == 99.0
+    assert summary["mean"] == pytest.approx(50.5)
+
+    assert steppir_bench.percentiles([]) == {"count": 0}
+    assert steppir_bench.percentiles([0.5])["p99"] == 0.5
+
+
+
+def test_status_rate(sim, step):
+    # The library keeps to the 10 queries per second the controller allows
+    rate = steppir_bench.bench_status_rate(step, 0.5)
+    assert 5 < rate <= 11
+
+
+
+def test_retune(sim, step):
+    result = steppir_bench.bench_retune(step, sim, 1.0, 0.05, 14000000, 100000)
+    assert result["updates"] > 10
+    assert result["coalesced"] + result["superseded"] > 0
+    assert result["lag"]["count"] > 0
+    assert sim.frequency == 14100000
+
+
+
+def test_new_move_replaces_the_one_in_progress(sim):
+    # A long move, then a short retune: Only the short one's travel counts
+    now = 1000.0
+    sim.command(28000000, 0x00, b'1', now)
+    assert sim.busy(now + 0.3)
+    sim.command(28010000, 0x00, b'1', now + 0.01)
+    assert sim.busy(now + 0.05)
+    assert not sim.busy(now + 0.2)
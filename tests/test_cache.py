@@ -0,0 +1,181 @@
+"""
+The status cache, and status queries shared between threads.
+"""
+
+import threading
+import time
+
+import steppir
+
+
+
+class HeldQuery:
+    """
+    Wraps SteppIR._read_status so the first query waits until "released" is
+    set (and then fails if asked to), to line up other callers behind it.
+    """
+
+    def __init__(self, step, fail=False):
+        self.read_status = step._read_status
+        self.fail = fail
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.calls = 0
+        step._read_status = self
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls == 1:
+            self.started.set()
+            self.released.wait(5)
+            if self.fail:
+                raise IOError("held query failed")
+        return self.read_status()
+
+
+
+def in_thread(function, results):
+    def run():
+        try:
+            results.append(function())
+        except Exception as error:
+            results.append(error)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+
+def test_concurrent_queries_are_shared(fake, fake_step):
+    fake_step.get_status()
+    before = fake.status_queries
+
+    results = []
+    start = threading.Barrier(8)
+    threads = [in_thread(lambda: (start.wait(), fake_step.get_status(max_age=0))[1], results) for i in range(8)]
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8
+    assert all(status[0] == 14000000 for status in results)
+    assert fake.status_queries - before < 8
+
+
+
+def test_cache(fake, fake_step):
+    status = fake_step.get_status()
+    before = fake.status_queries
+    assert fake_step.get_status(max_age=10) is status
+    assert fake.status_queries == before
+
+    # Too old for the caller
+    time.sleep(0.05)
+    fake_step.get_status(max_age=0.01)
+    assert fake.status_queries == before + 1
+
+
+
+def test_status_ttl(fake):
+    step = steppir.SteppIR("/dev/fake", 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None,
+        status_ttl=10.0)
+    status = step.get_status()
+    assert step.get_status() is status
+    # max_age=0 always asks the controller
+    assert step.get_status(max_age=0) is not status
+    step.close()
+    assert fake.status_queries == 2
+
+
+
+def test_command_throws_the_cache_away(fake, fake_step):
+    status = fake_step.get_status()
+    fake_step.set_parameters(21074000, 0x00, '1')
+    fresh = fake_step.get_status(max_age=10)
+    assert fresh is not status
+    assert fresh[0] == 21074000
+
+
+
+def test_waiter_asks_again_after_failed_query(fake, fake_step):
+    held = HeldQuery(fake_step, fail=True)
+    (first, second) = ([], [])
+    thread = in_thread(lambda: fake_step.get_status(max_age=0), first)
+    assert held.started.wait(5)
+    waiter = in_thread(lambda: fake_step.get_status(max_age=0), second)
+    time.sleep(0.2)
+    held.released.set()
+    thread.join()
+    waiter.join()
+
+    assert isinstance(first[0], IOError)
+    # The waiter queries the controller itself
+    assert second[0][0] == 14000000
+    assert held.calls == 2
+
+
+
+def test_query_from_before_a_command_is_not_shared(fake, fake_step):
+    held = HeldQuery(fake_step)
+    (first, second) = ([], [])
+    thread = in_thread(lambda: fake_step.get_status(max_age=0), first)
+    assert held.started.wait(5)
+    fake_step._invalidate_status()
+    waiter = in_thread(lambda: fake_step.get_status(max_age=0), second)
+    time.sleep(0.2)
+    held.released.set()
+    thread.join()
+    waiter.join()
+
+    assert first[0][0] == 14000000
+    assert second[0][0] == 14000000
+    assert held.calls == 2
+
+
+
+def test_waiter_never_gets_none(fake, fake_step):
+    class InvalidatingCondition(threading.Condition):
+        # A command clears the cache right as the shared query finishes
+        armed = True
+        def notify_all(self):
+            if self.armed:
+                self.armed = False
+                fake_step._invalidate_status()
+            super().notify_all()
+
+    fake_step._status_cond = InvalidatingCondition()
+    held = HeldQuery(fake_step)
+    (first, second) = ([], [])
+    thread = in_thread(lambda: fake_step.get_status(max_age=0), first)
+    assert held.started.wait(5)
+    waiter = in_thread(lambda: fake_step.get_status(max_age=0), second)
+    time.sleep(0.2)
+    held.released.set()
+    thread.join()
+    waiter.join()
+
+    assert first[0][0] == 14000000
+    assert second[0] is not None
+    assert second[0][0] == 14000000
+    assert held.calls == 2
+
+
+
+def test_waiter_is_not_starved_by_back_to_back_queries(fake, fake_step):
+    # Another thread polls without a break, like wait_for_completion() does
+    stop = threading.Event()
+    def poll():
+        while not stop.is_set():
+            fake_step.get_status(max_age=0)
+    poller = threading.Thread(target=poll)
+    poller.start()
+    try:
+        time.sleep(0.2)
+        results = []
+        waiter = in_thread(lambda: fake_step.get_status(max_age=0), results)
+        # Shares the next reply instead of waiting for the polling to stop
+        waiter.join(0.5)
+        assert results and results[0][0] == 14000000
+    finally:
+        stop.set()
+        poller.join()
+        waiter.join()
@@ -0,0 +1,84 @@
+"""
+Capturing traffic with CaptureTap and playing it back with ReplayTransport.
+"""
+
+import pytest
+
+import steppir
+
+
+
+def session(step):
+    """
+    The same calls, live and replayed.
+    """
+
+    results = [step.get_status()]
+    step.set_frequency(21074000)
+    results.append(step.get_status(max_age=0))
+    step.set_dir_180()
+    results.append(step.get_status(max_age=0))
+    return [tuple(status) for status in results]
+
+
+
+def test_round_trip(sim, tmp_path):
+    path = str(tmp_path / "session.cap")
+    with steppir.CaptureTap(path) as tap:
+        step = steppir.SteppIR(sim.port, 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None,
+            capture=tap)
+        live = session(step)
+        step.close()
+
+    records = steppir.read_capture(path)
+    assert records[0][1:] == (b'O', sim.port.encode())
+    kinds = [kind for (timestamp, kind, data) in records]
+    assert kinds.count(b'W') == sim.status_queries + sim.commands
+    assert [timestamp for (timestamp, kind, data) in records] == sorted(timestamp for (timestamp, kind, data) in records)
+    assert b''.join(data for (timestamp, kind, data) in records if kind == b'W').count(b'?A\r') == sim.status_queries
+
+    # Replayed as fast as possible, the library makes the same calls
+    step = steppir.SteppIR("replay://%s?speed=0" % path, 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None)
+    replayed = session(step)
+    assert replayed == live
+    assert step.serial.mismatches == 0
+    assert step.serial.writes == kinds.count(b'W')
+
+    # Nothing more was recorded
+    with pytest.raises(EOFError):
+        step.set_parameters(14000000, 0x00, '1')
+    step.close()
+
+
+
+def test_truncated_capture(sim, tmp_path):
+    path = tmp_path / "session.cap"
+    with steppir.CaptureTap(str(path)) as tap:
+        step = steppir.SteppIR(sim.port, 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None,
+            capture=tap)
+        step.get_status()
+        step.get_status(max_age=0)
+        step.close()
+
+    complete = steppir.read_capture(str(path))
+    # A crash in the middle of the last record
+    path.write_bytes(path.read_bytes()[:-3])
+    assert steppir.read_capture(str(path)) == complete[:-1]
+
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b'something else\n')
+    with pytest.raises(ValueError):
+        steppir.read_capture(str(path))
+
+
+
+def test_replay_url(tmp_path):
+    path = str(tmp_path / "empty.cap")
+    steppir.CaptureTap(path).close()
+    transport = steppir.ReplayTransport.from_url("replay://%s?speed=10" % path)
+    assert (transport.path, transport.speed) == (path, 10.0)
+    with pytest.raises(ValueError):
+        steppir.ReplayTransport.from_url("replay://")
@@ -0,0 +1,124 @@
+"""
+CATTokenizer, parse_message() and RadioState.
+"""
+
+import steppir_cat
+
+
+
+def if_message(frequency, transmitting=False, mode=2, vfo=0, split=False):
+    """
+    An IF; reply: 11 frequency, 5 step, 5 RIT/XIT offset, RIT, XIT, 3 memory
+    channel, TX/RX, mode, VFO, scan, split, tone, 2 tone number, shift.
+    """
+
+    return b'IF%011d     +000000000%d%d%d0%d0000;' % (frequency, transmitting, mode, vfo, split)
+
+
+
+def messages(tokenizer):
+    result = []
+    while True:
+        message = tokenizer.next_message()
+        if message is None:
+            return result
+        result.append(message)
+
+
+
+def test_tokenizer_split_and_merged():
+    tokenizer = steppir_cat.CATTokenizer()
+    tokenizer.feed(b'FA000140')
+    assert tokenizer.next_message() is None
+    tokenizer.feed(b'74000;FB00007074000;I')
+    assert messages(tokenizer) == [b'FA00014074000;', b'FB00007074000;']
+    tokenizer.feed(b'F;')
+    assert messages(tokenizer) == [b'IF;']
+    assert tokenizer.messages == 3
+    assert len(tokenizer) == 0
+
+
+
+def test_tokenizer_skips_line_endings():
+    tokenizer = steppir_cat.CATTokenizer()
+    tokenizer.feed(b'FA;\r\nIF;\n  MD;')
+    assert messages(tokenizer) == [b'FA;', b'IF;', b'MD;']
+
+
+
+def test_tokenizer_drops_garbage():
+    tokenizer = steppir_cat.CATTokenizer()
+    tokenizer.feed(b'x' * (steppir_cat.CATTokenizer.MAX_MESSAGE + 1))
+    assert tokenizer.next_message() is None
+    assert tokenizer.discarded == steppir_cat.CATTokenizer.MAX_MESSAGE + 1
+    tokenizer.feed(b'FA;')
+    assert messages(tokenizer) == [b'FA;']
+
+
+
+def test_tokenizer_reset():
+    tokenizer = steppir_cat.CATTokenizer()
+    tokenizer.feed(b'FA0001')
+    tokenizer.reset()
+    tokenizer.feed(b'FB;')
+    assert messages(tokenizer) == [b'FB;']
+    assert tokenizer.discarded == 6
+
+
+
+def test_parse_vfo_frequency():
+    event = steppir_cat.parse_message(b'FB00021074000;')
+    assert isinstance(event, steppir_cat.VFOFrequency)
+    assert (event.command, event.vfo, event.frequency) == ('FB', 'B', 21074000)
+    assert event.message == b'FB00021074000;'
+
+
+
+def test_parse_radio_info():
+    event = steppir_cat.parse_message(if_message(14074000, transmitting=True, mode=2, vfo=1, split=True))
+    assert isinstance(event, steppir_cat.RadioInfo)
+    assert event.frequency == 14074000
+    assert event.mode == 2
+    assert event.vfo == 'B'
+    assert event.split is True
+    assert event.transmitting is True
+
+    # The layout the proxy tests' radio sends
+    event = steppir_cat.parse_message(b'IF00014074000     +00000000002000000;')
+    assert (event.frequency, event.mode, event.vfo, event.split, event.transmitting) == (14074000, 2, 'A', False, False)
+
+
+
+def test_parse_vfo_select():
+    event = steppir_cat.parse_message(b'FT1;')
+    assert isinstance(event, steppir_cat.VFOSelect)
+    assert (event.function, event.vfo) == ('transmit', 'B')
+    event = steppir_cat.parse_message(b'FR0;')
+    assert (event.function, event.vfo) == ('receive', 'A')
+
+
+
+def test_parse_everything_else():
+    for message in (b'FA;', b'IF;', b'MD2;', b'FA0001407400;', b'FAabcdefghijk;', b'FT9;', b'IF0001;', b'?;'):
+        event = steppir_cat.parse_message(message)
+        assert type(event) is steppir_cat.CATMessage
+        assert event.message == message
+
+
+
+def test_radio_state_follows_split():
+    radio = steppir_cat.RadioState()
+    for message in (b'FA00014074000;', b'FB00014080000;'):
+        assert radio.update(steppir_cat.parse_message(message))
+    assert radio.tune_frequency == 14074000
+    assert not radio.split
+
+    assert radio.update(steppir_cat.parse_message(b'FT1;'))
+    assert radio.split
+    assert radio.tune_frequency == 14080000
+
+    assert radio.update(steppir_cat.parse_message(if_message(7074000)))
+    assert not radio.split
+    assert radio.tune_frequency == 7074000
+
+    assert not radio.update(steppir_cat.parse_message(b'MD2;'))
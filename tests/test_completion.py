@@ -0,0 +1,108 @@
+"""
+wait_for_completion(): The 0xff acknowledge, busy motors, "settle" and the
+timeout.
+"""
+
+import time
+
+import pytest
+
+import steppir
+
+
+
+def script(step, *replies):
+    """
+    Make get_status() return "replies" (frequency, active_motors) in turn,
+    repeating the last one, and count the calls.
+    """
+
+    calls = []
+
+    def get_status(max_age=None):
+        calls.append(time.monotonic())
+        (frequency, active_motors) = replies[min(len(calls), len(replies)) - 1]
+        return (frequency, active_motors, 0x00, "Normal", b'10')
+
+    step.get_status = get_status
+    return calls
+
+
+
+def test_waits_for_ack_then_idle(fake_step):
+    calls = script(fake_step, (14000000, 0xff), (14000000, 0x07), (21000000, 0x07), (21000000, 0x00))
+    status = fake_step.wait_for_completion(timeout=5.0, poll_interval=0.0)
+    assert status[:2] == (21000000, 0x00)
+    assert len(calls) == 4
+
+
+
+def test_idle_after_ack_returns_at_once(fake_step):
+    calls = script(fake_step, (14000000, 0xff), (14000000, 0x00))
+    start = time.monotonic()
+    status = fake_step.wait_for_completion(timeout=5.0, poll_interval=0.0, settle=2.0)
+    # The acknowledge was seen, so "settle" doesn't apply
+    assert time.monotonic() - start < 1.0
+    assert status[1] == 0x00
+    assert len(calls) == 2
+
+
+
+def test_condition(fake_step):
+    calls = script(fake_step, (14000000, 0x00), (14000000, 0x00), (21000000, 0x00))
+    status = fake_step.wait_for_completion(timeout=5.0, poll_interval=0.0,
+        condition=lambda status: status[0] == 21000000)
+    assert status[0] == 21000000
+    assert len(calls) == 3
+
+
+
+def test_settle(fake_step):
+    # Idle straight away: Only trusted once "settle" has passed
+    calls = script(fake_step, (14000000, 0x00))
+    start = time.monotonic()
+    status = fake_step.wait_for_completion(timeout=5.0, poll_interval=0.05, settle=0.3)
+    assert status[1] == 0x00
+    assert time.monotonic() - start >= 0.3
+    assert len(calls) > 1
+
+
+
+def test_timeout_returns_last_status(fake_step):
+    calls = script(fake_step, (14000000, 0xff))
+    start = time.monotonic()
+    status = fake_step.wait_for_completion(timeout=0.3, poll_interval=0.05)
+    elapsed = time.monotonic() - start
+    assert status[1] == 0xff
+    assert 0.3 <= elapsed < 1.0
+    assert len(calls) > 2
+
+
+
+def test_set_frequency_polls_instead_of_sleeping(fake, fake_step):
+    start = time.monotonic()
+    fake_step.set_frequency(21074000)
+    # The fake controller is done at once: One command, no fixed delays
+    assert time.monotonic() - start < 0.6
+    assert fake.frequency == 21074000
+    assert len(fake.commands) == 1
+
+
+
+def test_default_timeout(fake, fake_step):
+    # The controller may take up to a second to show a command
+    assert fake_step.completion_timeout >= 1.5
+    script(fake_step, (14000000, 0xff))
+    start = time.monotonic()
+    fake_step.wait_for_completion(poll_interval=0.05)
+    assert time.monotonic() - start >= fake_step.completion_timeout
+
+
+
+def test_completion_timeout(fake):
+    step = steppir.SteppIR("/dev/fake", 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None,
+        completion_timeout=0.3)
+    script(step, (14000000, 0xff))
+    start = time.monotonic()
+    step.wait_for_completion(poll_interval=0.05)
+    assert 0.3 <= time.monotonic() - start < 1.0
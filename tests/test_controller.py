@@ -0,0 +1,103 @@
+"""
+SteppIR against the SDA-100 simulator: status, tuning, direction and
+AUTOTRACK.
+"""
+
+import time
+
+import pytest
+
+import steppir
+
+
+
+def wait_idle(step, timeout=10):
+    deadline = time.monotonic() + timeout
+    status = step.get_status(max_age=0)
+    while status[1] and time.monotonic() < deadline:
+        time.sleep(0.1)
+        status = step.get_status(max_age=0)
+    return status
+
+
+
+def until(condition, timeout=2):
+    # The simulator handles commands on its own thread
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+
+def test_status(sim, step):
+    status = step.get_status()
+    assert status[0] == 14000000
+    assert status[1] == 0x00
+    assert status[2] == 0x00
+    assert step.get_frequency() == 14000000
+    assert sim.status_queries >= 2
+
+
+
+def test_set_frequency(sim, step):
+    step.set_frequency(21074000)
+    assert wait_idle(step)[0] == 21074000
+    assert sim.frequency == 21074000
+    assert sim.commands == 1
+
+
+
+def test_set_direction(sim, step):
+    step.set_dir_180()
+    status = wait_idle(step)
+    assert status[2] == 0x40
+    assert status[0] == 14000000
+
+    step.set_dir_normal()
+    assert wait_idle(step)[2] == 0x00
+
+
+
+def test_autotrack_off_ignores_tuning(sim, step):
+    step.set_autotrack_OFF()
+    assert until(lambda: not sim.autotrack)
+    step.set_frequency(21074000)
+    assert step.get_status(max_age=0)[0] == 14000000
+    assert sim.ignored >= 1
+
+    step.set_autotrack_ON()
+    assert until(lambda: sim.autotrack)
+    step.set_frequency(21074000)
+    assert wait_idle(step)[0] == 21074000
+
+
+
+def test_dropped_command_is_retried():
+    steppir_sim = pytest.importorskip("steppir_sim")
+    with steppir_sim.SDA100Simulator(status_delay=0.05, ack_time=0.05, travel_base=0.1, travel_per_mhz=0.02,
+            drop_rate=0.5, seed=3) as sim:
+        step = steppir.SteppIR(sim.port, 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None)
+        try:
+            for frequency in (21074000, 28074000, 14074000):
+                step.set_frequency(frequency)
+                assert wait_idle(step)[0] == frequency
+        finally:
+            step.close()
+        assert sim.dropped >= 1
+
+
+
+def test_slow_status_update_is_not_sent_again():
+    steppir_sim = pytest.importorskip("steppir_sim")
+    # The controller shows the new frequency a little over a second after
+    # the command
+    with steppir_sim.SDA100Simulator(status_delay=1.2, ack_time=0.05, travel_base=0.1, travel_per_mhz=0.02,
+            seed=1) as sim:
+        step = steppir.SteppIR(sim.port, 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None)
+        try:
+            step.set_frequency(21074000)
+        finally:
+            step.close()
+        assert sim.frequency == 21074000
+        assert sim.commands == 1
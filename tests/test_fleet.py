@@ -0,0 +1,67 @@
+"""
+SteppIRFleet: Several simulated controllers driven at the same time.
+"""
+
+import time
+
+import pytest
+
+import steppir
+
+steppir_sim = pytest.importorskip("steppir_sim")
+
+
+
+@pytest.fixture
+def sims():
+    simulators = [steppir_sim.SDA100Simulator(frequency=14000000, status_delay=0.05, ack_time=0.05,
+        travel_base=0.5, travel_per_mhz=0.02, seed=seed) for seed in (1, 2)]
+    for simulator in simulators:
+        simulator.start()
+    yield simulators
+    for simulator in simulators:
+        simulator.stop()
+
+
+
+def test_band_change_runs_concurrently(sims):
+    with steppir.SteppIRFleet.from_ports({"beam": sims[0].port, "vertical": sims[1].port}) as fleet:
+        start = time.monotonic()
+        results = fleet.band_change({"beam": (21074000, 0x40), "vertical": 7074000}, wait_motors=True)
+        elapsed = time.monotonic() - start
+
+        assert set(results) == {"beam", "vertical"}
+        assert all(result.ok for result in results.values())
+        assert (results["beam"].value.frequency, results["beam"].value.direction) == (21074000, 0x40)
+        assert results["vertical"].value.frequency == 7074000
+        assert (sims[0].frequency, sims[1].frequency) == (21074000, 7074000)
+        # Not one after the other
+        assert elapsed < 0.8 * sum(result.seconds for result in results.values())
+
+        status = fleet.status(max_age=0)
+        assert status["beam"].value.frequency == 21074000
+        assert fleet["vertical"].get_frequency() == 7074000
+
+
+
+def test_one_failure_does_not_stop_the_others(sims):
+    with steppir.SteppIRFleet.from_ports({"beam": sims[0].port, "missing": "/dev/no-such-steppir"}) as fleet:
+        results = fleet.band_change(18100000)
+        assert results["beam"].ok
+        assert results["beam"].value.frequency == 18100000
+        assert not results["missing"].ok
+        assert results["missing"].value is None
+        assert isinstance(results["missing"].error, Exception)
+        assert "missing" in repr(results["missing"])
+
+
+
+def test_run(sims):
+    with steppir.SteppIRFleet.from_ports({"a": sims[0].port, "b": sims[1].port}) as fleet:
+        results = fleet.run("set_autotrack_OFF", names=["b"])
+        assert list(results) == ["b"]
+        assert results["b"].ok
+        deadline = time.monotonic() + 2
+        while sims[1].autotrack and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sims[0].autotrack and not sims[1].autotrack
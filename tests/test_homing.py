@@ -0,0 +1,153 @@
+"""
+Retract and calibrate in the background: The HomingOperation handle,
+progress, cancelling, and commands refused meanwhile.
+"""
+
+import threading
+
+import pytest
+
+import steppir
+
+
+
+def test_retract(sim, step):
+    reports = []
+    done = []
+    operation = step.start_retract(progress=lambda operation: reports.append(operation.active_motors))
+    operation.add_done_callback(done.append)
+    assert operation.kind == "retract"
+    assert step.homing is operation
+
+    status = operation.result(10)
+    assert status.frequency == 0
+    assert status.active_motors == 0x00
+    assert operation.done() and not operation.cancelled()
+    assert 0x07 in reports
+    assert done == [operation]
+    assert step.homing is None
+
+    # Called right away once it is done
+    operation.add_done_callback(done.append)
+    assert done == [operation, operation]
+
+
+
+def test_commands_are_refused_while_homing(sim, step):
+    sim.retract_time = 20.0
+    operation = step.start_retract()
+    try:
+        errors = []
+        def tune():
+            try:
+                step.set_frequency(21074000)
+            except steppir.HomingInProgress as error:
+                errors.append(error)
+        thread = threading.Thread(target=tune)
+        thread.start()
+        thread.join(5)
+        assert len(errors) == 1
+        assert errors[0].operation is operation
+
+        with pytest.raises(steppir.HomingInProgress):
+            step.start_calibrate()
+    finally:
+        operation.cancel()
+        operation.wait(5)
+
+
+
+def test_cancel(sim, step):
+    sim.retract_time = 20.0
+    operation = step.start_retract()
+    assert not operation.wait(0.5)
+
+    assert operation.cancel()
+    assert operation.wait(5)
+    assert operation.cancelled()
+    with pytest.raises(steppir.CommandAborted):
+        operation.result(0)
+    assert not operation.cancel()
+
+    # The motors are still running, but the object takes commands again
+    assert sim.busy()
+    assert step.homing is None
+    step.set_autotrack_ON()
+
+
+
+def test_result_timeout(sim, step):
+    sim.retract_time = 20.0
+    operation = step.start_calibrate()
+    try:
+        with pytest.raises(TimeoutError):
+            operation.result(0.2)
+        assert operation.elapsed >= 0.2
+        assert operation.remaining is None
+    finally:
+        operation.cancel()
+        operation.wait(5)
+
+
+
+def test_blocking_retract(sim, step):
+    step.retract_antenna()
+    assert sim.frequency == 0
+    assert not sim.busy()
+    assert step.homing is None
+
+
+
+def test_retract_then_submit(sim, step):
+    queue = steppir.TuneQueue()
+    operation = step.start_retract()
+
+    # Submitted while retracting: Dropped, the retract turns AUTOTRACK off
+    queue.submit(21074000)
+    assert queue.tune(step, block=False) is None
+    assert operation.done()
+    assert (queue.dropped, queue.deferred, queue.tuned) == (1, 0, 0)
+    assert queue.get(block=False) is None
+    assert not sim.autotrack
+
+    # Submitted afterwards: Not sent to a controller that would ignore it
+    commands = sim.commands
+    queue.submit(21074000)
+    assert queue.tune(step, block=False) is None
+    assert sim.commands == commands
+    assert (queue.dropped, queue.tuned) == (2, 0)
+
+    # Until AUTOTRACK is back on
+    step.set_autotrack_ON()
+    queue.submit(21074000)
+    assert queue.tune(step, block=False) == 21074000
+    assert sim.frequency == 21074000
+    assert (queue.dropped, queue.tuned) == (2, 1)
+
+
+
+def test_calibrate_defers_the_tune(sim, step):
+    queue = steppir.TuneQueue()
+    operation = step.start_calibrate()
+    queue.submit(21074000)
+    assert queue.tune(step, block=False) is None
+    assert operation.done()
+    assert queue.deferred == 1
+
+    # Tuned once the antenna is done
+    assert queue.tune(step, block=False) == 21074000
+    assert sim.frequency == 21074000
+    assert queue.tuned == 1
+
+
+
+def test_only_verified_tunes_count(sim, step):
+    # AUTOTRACK turned off at the controller: Nothing to tell us but the
+    # status
+    sim.autotrack = False
+    step.completion_timeout = 0.3
+    queue = steppir.TuneQueue()
+    queue.submit(21074000)
+    assert queue.tune(step, block=False) is None
+    assert sim.frequency == 14000000
+    assert (queue.failed, queue.tuned) == (1, 0)
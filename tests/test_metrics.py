@@ -0,0 +1,79 @@
+"""
+SteppIRMetrics: Counters, histograms and gauges, their Prometheus export,
+and what SteppIR records in them.
+"""
+
+import pytest
+
+import steppir
+
+
+
+def test_snapshot():
+    metrics = steppir.SteppIRMetrics(buckets=(0.1, 1.0))
+    metrics.count("commands")
+    metrics.count("commands", amount=2)
+    metrics.count("retries", "set_frequency")
+    metrics.observe("method_seconds", "get_status", 0.05)
+    metrics.observe("method_seconds", "get_status", 0.5)
+    metrics.observe("method_seconds", "get_status", 5.0)
+    metrics.set_gauge("frequency_hz", 14074000)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"] == {"commands": 3, "retries": {"set_frequency": 1}}
+    histogram = snapshot["histograms"]["method_seconds"]["get_status"]
+    assert histogram["buckets"] == {0.1: 1, 1.0: 2, float('inf'): 3}
+    assert histogram["count"] == 3
+    assert histogram["sum"] == pytest.approx(5.55)
+    assert snapshot["gauges"] == {"frequency_hz": 14074000}
+
+
+
+def test_prometheus():
+    metrics = steppir.SteppIRMetrics(prefix="ant", buckets=(0.1, 1.0))
+    metrics.count("status_queries", amount=4)
+    metrics.count("timeouts", "set_dir_180")
+    metrics.observe("roundtrip_seconds", "status", 0.02)
+    metrics.set_gauge("direction", 64)
+
+    lines = metrics.prometheus().splitlines()
+    assert "# HELP ant_status_queries_total Status queries sent to the controller" in lines
+    assert "# TYPE ant_status_queries_total counter" in lines
+    assert "ant_status_queries_total 4" in lines
+    assert 'ant_timeouts_total{method="set_dir_180"} 1' in lines
+    assert "# TYPE ant_roundtrip_seconds histogram" in lines
+    assert 'ant_roundtrip_seconds_bucket{kind="status",le="0.1"} 1' in lines
+    assert 'ant_roundtrip_seconds_bucket{kind="status",le="1.0"} 1' in lines
+    assert 'ant_roundtrip_seconds_bucket{kind="status",le="+Inf"} 1' in lines
+    assert 'ant_roundtrip_seconds_sum{kind="status"} 0.02' in lines
+    assert 'ant_roundtrip_seconds_count{kind="status"} 1' in lines
+    assert "# TYPE ant_direction gauge" in lines
+    assert "ant_direction 64" in lines
+
+    assert steppir.SteppIRMetrics().prometheus() == "\n"
+
+
+
+def test_steppir_records_metrics(fake):
+    metrics = steppir.SteppIRMetrics()
+    step = steppir.SteppIR("/dev/fake", 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None,
+        metrics=metrics)
+    step.get_status()
+    step.set_parameters(21074000, 0x40, '1')
+    fake.fail_writes = 1
+    step.get_status(max_age=0)
+    step.close()
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["status_queries"] == 2
+    assert snapshot["counters"]["commands"] == 1
+    assert snapshot["counters"]["io_errors"] == 1
+    assert snapshot["histograms"]["roundtrip_seconds"]["status"]["count"] == 2
+    assert snapshot["histograms"]["method_seconds"]["get_status"]["count"] == 2
+    assert snapshot["gauges"] == {"frequency_hz": 21074000, "direction": 0x40, "active_motors": 0x00}
+
+
+
+def test_no_metrics_by_default(fake, fake_step):
+    assert fake_step.metrics is None
+    fake_step.get_status()
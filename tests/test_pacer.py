@@ -0,0 +1,69 @@
+"""
+The pacer: Commands are spaced by "command_gap", status queries by
+"status_interval", and nothing waits once enough time has passed.
+"""
+
+import time
+
+import steppir
+
+
+
+def make_step(command_gap=0.1, status_interval=0.1):
+    return steppir.SteppIR("/dev/fake", 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None,
+        command_gap=command_gap, status_interval=status_interval)
+
+
+
+def gaps(fake):
+    times = [timestamp for (timestamp, data) in fake.writes]
+    return [later - earlier for (earlier, later) in zip(times, times[1:])]
+
+
+
+def test_commands_are_spaced(fake):
+    step = make_step(command_gap=0.1, status_interval=0.1)
+    step.get_status()
+    step.set_parameters(21074000, 0x00, '1')
+    step.get_status()
+    step.get_status()
+    step.close()
+
+    assert len(fake.writes) == 4
+    assert all(gap >= 0.095 for gap in gaps(fake))
+
+
+
+def test_status_interval(fake):
+    # Status queries are limited on their own, even with no command gap
+    step = make_step(command_gap=0.0, status_interval=0.2)
+    for i in range(3):
+        step.get_status()
+    step.close()
+
+    assert all(gap >= 0.195 for gap in gaps(fake))
+
+
+
+def test_no_wait_when_idle(fake):
+    step = make_step(command_gap=0.1, status_interval=0.1)
+    step.get_status()
+    time.sleep(0.15)
+
+    start = time.monotonic()
+    step.set_parameters(21074000, 0x00, '1')
+    step.close()
+    assert time.monotonic() - start < 0.05
+
+
+
+def test_only_the_remainder_is_waited(fake):
+    step = make_step(command_gap=0.2, status_interval=0.1)
+    step.get_status()
+    time.sleep(0.1)
+
+    start = time.monotonic()
+    step.set_parameters(21074000, 0x00, '1')
+    elapsed = time.monotonic() - start
+    step.close()
+    assert 0.05 < elapsed < 0.15
@@ -0,0 +1,444 @@
+"""
+CATProxy between a fake radio and several CAT clients: Reply routing,
+unsolicited messages, and backpressure on slow clients and a slow radio.
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+
+import steppir_cat
+
+
+
+class FakeRadio:
+    """
+    A radio CAT port answering FA;, FB;, IF;, ID; and MD; "delay" seconds
+    after each query, in the order asked. Setting FA or FB changes the
+    frequency without a reply, anything else gets "?;".
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.vfo = {b'A': 14074000, b'B': 7074000}
+        self.received = []
+        self.conn = None
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def reply(self, command):
+        if command[:1] == b'F' and command[1:2] in self.vfo:
+            if len(command) == 3:
+                return b'F%s%011d;' % (command[1:2], self.vfo[command[1:2]])
+            self.vfo[command[1:2]] = int(command[2:-1])
+            return None
+        if command == b'IF;':
+            return b'IF%011d     +000000000%d%d%d0%d0000;' % (self.vfo[b'A'], 0, 2, 0, 0)
+        if command == b'ID;':
+            return b'ID019;'
+        if command[:2] == b'MD' and len(command) <= 4:
+            return b'MD' + command[2:-1] + b'2;'
+        return b'?;'
+
+    def _run(self):
+        while True:
+            try:
+                (conn, address) = self.listener.accept()
+            except OSError:
+                return
+            self.conn = conn
+            data = bytearray()
+            while True:
+                try:
+                    chunk = conn.recv(4096)
+                except OSError:
+                    break
+                if not chunk:
+                    break
+                data += chunk
+                while b';' in data:
+                    end = data.index(b';') + 1
+                    command = bytes(data[:end])
+                    del data[:end]
+                    self.received.append(command)
+                    reply = self.reply(command)
+                    if reply is not None:
+                        time.sleep(self.delay)
+                        self.send(reply)
+            conn.close()
+
+    def send(self, data):
+        with self._lock:
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                pass
+
+    def queries(self, command):
+        return self.received.count(command)
+
+    def close(self):
+        self.listener.close()
+        if self.conn is not None:
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+
+class Client:
+    """
+    A CAT program: ask() sends a command and returns the next message.
+    """
+
+    def __init__(self, proxy):
+        self.sock = socket.create_connection(proxy.address, timeout=5)
+        self.input = bytearray()
+
+    def send(self, command):
+        self.sock.sendall(command)
+
+    def read(self):
+        while b';' not in self.input:
+            data = self.sock.recv(4096)
+            if not data:
+                return b''
+            self.input += data
+        end = self.input.index(b';') + 1
+        message = bytes(self.input[:end])
+        del self.input[:end]
+        return message
+
+    def ask(self, command):
+        self.send(command)
+        return self.read()
+
+    def close(self):
+        self.sock.close()
+
+
+
+def until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+
+def run_proxy(radio_port, **options):
+    proxy = steppir_cat.CATProxy("127.0.0.1", radio_port, "127.0.0.1", 0, **options)
+    thread = threading.Thread(target=proxy.serve_forever, daemon=True)
+    thread.start()
+    assert until(lambda: proxy.address[1] != 0)
+    return (proxy, thread)
+
+
+
+@pytest.fixture
+def radio():
+    fake = FakeRadio(delay=0.05)
+    yield fake
+    fake.close()
+
+
+
+@pytest.fixture
+def proxy(radio):
+    frequencies = []
+    (server, thread) = run_proxy(radio.port, on_frequency=frequencies.append)
+    server.frequencies = frequencies
+    assert until(lambda: radio.conn is not None)
+    yield server
+    server.shutdown()
+    thread.join(5)
+
+
+
+def test_replies_go_to_the_client_that_asked(radio, proxy):
+    first = Client(proxy)
+    second = Client(proxy)
+    # Both waiting at the radio at the same time
+    first.send(b'FA;')
+    second.send(b'ID;')
+    assert second.read() == b'ID019;'
+    assert first.read() == b'FA00014074000;'
+
+    # The same query from two clients: One reply each
+    first.send(b'FB;')
+    second.send(b'FB;')
+    assert first.read() == b'FB00007074000;'
+    assert second.read() == b'FB00007074000;'
+    assert radio.queries(b'FB;') == 2
+    assert proxy.replies == 4
+    first.close()
+    second.close()
+
+
+
+def test_commands_are_forwarded(radio, proxy):
+    client = Client(proxy)
+    client.send(b'FA00021074000;')
+    assert client.ask(b'FA;') == b'FA00021074000;'
+    assert radio.received[:2] == [b'FA00021074000;', b'FA;']
+    assert proxy.frequencies[-1] == 21074000
+    client.close()
+
+
+
+def test_unsolicited_messages(radio, proxy):
+    first = Client(proxy)
+    second = Client(proxy)
+    assert first.ask(b'FA;') == b'FA00014074000;'
+
+    # Goes to the client that last used the command
+    radio.send(b'FA00018100000;')
+    assert first.read() == b'FA00018100000;'
+    assert until(lambda: proxy.unsolicited == 1)
+    assert proxy.frequencies[-1] == 18100000
+
+    # Nobody used it: Everybody gets it
+    radio.send(b'FB00010136000;')
+    assert first.read() == b'FB00010136000;'
+    assert second.read() == b'FB00010136000;'
+    first.close()
+    second.close()
+
+
+
+def test_poll(radio):
+    frequencies = []
+    (proxy, thread) = run_proxy(radio.port, on_frequency=frequencies.append, poll_interval=0.1)
+    try:
+        # No client asks, the radio is followed anyway
+        assert until(lambda: frequencies == [14074000])
+        radio.vfo[b'A'] = 21074000
+        assert until(lambda: frequencies == [14074000, 21074000])
+    finally:
+        proxy.shutdown()
+        thread.join(5)
+
+
+
+def connected(proxy, size=4096):
+    """
+    A client and a radio on socket pairs, with small buffers, registered
+    with a proxy whose event loop isn't running. Returns the client and the
+    far ends of both connections.
+    """
+
+    (client_end, client_far) = socket.socketpair()
+    (radio_end, radio_far) = socket.socketpair()
+    for sock in (client_end, radio_end):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+        sock.setblocking(False)
+    for sock in (client_far, radio_far):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        sock.setblocking(False)
+
+    client = steppir_cat._Client(client_end, "client")
+    proxy.clients.add(client)
+    proxy._set_events(client)
+    proxy._radio = radio_end
+    proxy._selector.register(radio_end, steppir_cat.selectors.EVENT_READ, "radio")
+    return (client, client_far, radio_far)
+
+
+
+def drain(sock):
+    total = 0
+    while True:
+        try:
+            data = sock.recv(65536)
+        except BlockingIOError:
+            return total
+        if not data:
+            return total
+        total += len(data)
+
+
+
+def client_events(proxy, client):
+    try:
+        return proxy._selector.get_key(client.conn).events
+    except KeyError:
+        return 0
+
+
+
+def test_slow_radio_pauses_clients():
+    proxy = steppir_cat.CATProxy("127.0.0.1", 0, "127.0.0.1", 0)
+    (client, client_far, radio_far) = connected(proxy)
+    command = b'FA00014074000;'
+    # Nobody reads the radio's side
+    for i in range(2000):
+        proxy._send_radio(command, client)
+        if proxy._paused:
+            break
+    assert proxy._paused
+    assert len(proxy._radio_output) > steppir_cat.RADIO_HIGH_WATER
+    assert not client_events(proxy, client) & steppir_cat.selectors.EVENT_READ
+
+    # Reading resumes once the radio has taken most of it
+    while len(proxy._radio_output) > steppir_cat.RADIO_LOW_WATER:
+        drain(radio_far)
+        proxy._flush_radio()
+    assert not proxy._paused
+    assert client_events(proxy, client) & steppir_cat.selectors.EVENT_READ
+
+
+
+def test_client_that_stops_reading_is_dropped():
+    proxy = steppir_cat.CATProxy("127.0.0.1", 0, "127.0.0.1", 0)
+    (client, client_far, radio_far) = connected(proxy)
+    reply = b'FA00014074000;'
+    for i in range(steppir_cat.MAX_OUTPUT):
+        proxy._write(client, reply)
+        if client.closed:
+            break
+    assert client.closed
+    assert proxy.dropped_clients == 1
+    assert client not in proxy.clients
+
+
+
+def test_cache(radio):
+    (proxy, thread) = run_proxy(radio.port, cache_ttl=1.0)
+    try:
+        assert until(lambda: radio.conn is not None)
+        first = Client(proxy)
+        second = Client(proxy)
+        assert first.ask(b'FA;') == b'FA00014074000;'
+        # Answered from the first client's reply
+        assert second.ask(b'FA;') == b'FA00014074000;'
+        assert first.ask(b'FA;') == b'FA00014074000;'
+        assert radio.queries(b'FA;') == 1
+
+        stats = proxy.stats()
+        assert (stats["hits"], stats["misses"]) == (2, 1)
+        assert stats["hit_rate"] == pytest.approx(2 / 3)
+        assert sorted((client["hits"], client["misses"]) for client in stats["clients"]) == [(1, 0), (1, 1)]
+
+        # Setting something throws the cache away
+        second.send(b'FA00021074000;')
+        assert until(lambda: b'FA00021074000;' in radio.received)
+        assert first.ask(b'FA;') == b'FA00021074000;'
+        assert radio.queries(b'FA;') == 2
+        first.close()
+        second.close()
+    finally:
+        proxy.shutdown()
+        thread.join(5)
+
+
+
+def test_parameterized_read_while_polling(radio):
+    (proxy, thread) = run_proxy(radio.port, cache_ttl=1.0, poll_interval=0.1)
+    try:
+        assert until(lambda: radio.conn is not None)
+        first = Client(proxy)
+        second = Client(proxy)
+        # Both ask at once while the proxy polls the radio itself
+        first.send(b'MD0;')
+        second.send(b'FA;')
+        assert first.read() == b'MD02;'
+        assert second.read() == b'FA00014074000;'
+
+        # MD0; is a read: It leaves the cache alone and is cached itself
+        queries = radio.queries(b'FA;')
+        assert first.ask(b'FA;') == b'FA00014074000;'
+        assert first.ask(b'MD0;') == b'MD02;'
+        assert radio.queries(b'FA;') == queries
+        assert radio.queries(b'MD0;') == 1
+        # ...but doesn't answer a different read of the same command
+        assert second.ask(b'MD;') == b'MD2;'
+        assert radio.queries(b'MD;') == 1
+
+        stats = proxy.stats()
+        assert sorted((client["hits"], client["misses"]) for client in stats["clients"]) == [(0, 2), (2, 1)]
+        first.close()
+        second.close()
+    finally:
+        proxy.shutdown()
+        thread.join(5)
+
+
+
+def test_cache_expires(radio):
+    (proxy, thread) = run_proxy(radio.port, cache_ttl=0.2)
+    try:
+        assert until(lambda: radio.conn is not None)
+        client = Client(proxy)
+        assert client.ask(b'ID;') == b'ID019;'
+        time.sleep(0.3)
+        assert client.ask(b'ID;') == b'ID019;'
+        assert radio.queries(b'ID;') == 2
+        client.close()
+    finally:
+        proxy.shutdown()
+        thread.join(5)
+
+
+
+def test_radio_down():
+    # Nothing listens on this port
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+
+    (proxy, thread) = run_proxy(port)
+    try:
+        client = Client(proxy)
+        # Queries get "can't do that" right away, commands are dropped
+        start = time.monotonic()
+        assert client.ask(b'FA;') == b'?;'
+        client.send(b'FA00021074000;')
+        assert client.ask(b'IF;') == b'?;'
+        assert time.monotonic() - start < 1.0
+        assert proxy.dropped_commands == 3
+        client.close()
+    finally:
+        proxy.shutdown()
+        thread.join(5)
+
+
+
+def test_queries_waiting_when_the_radio_goes(radio, proxy):
+    radio.delay = 10.0
+    client = Client(proxy)
+    client.send(b'FA;')
+    assert until(lambda: radio.received == [b'FA;'])
+    radio.conn.shutdown(socket.SHUT_RDWR)
+    assert client.read() == b'?;'
+    client.close()
+
+
+
+def test_radio_lost_while_clients_are_paused():
+    proxy = steppir_cat.CATProxy("127.0.0.1", 0, "127.0.0.1", 0)
+    (client, client_far, radio_far) = connected(proxy)
+    command = b'FA00014074000;'
+    for i in range(2000):
+        proxy._send_radio(command, client)
+        if proxy._paused:
+            break
+    assert proxy._paused
+
+    # The next command fails to go out: The radio is gone, and the clients
+    # are read again (their queries get "?;" until it is back)
+    radio_far.close()
+    proxy._send_radio(command, client)
+    assert proxy._radio is None
+    assert not proxy._paused
+    assert not proxy._radio_output
+    assert client_events(proxy, client) & steppir_cat.selectors.EVENT_READ
@@ -0,0 +1,59 @@
+"""
+RetunePolicy, and the TuneQueue updates it suppresses.
+"""
+
+import steppir
+
+
+
+def test_tolerance_per_band():
+    policy = steppir.RetunePolicy()
+    assert policy.tolerance(7074000) == steppir.RETUNE_TOLERANCES["40m"]
+    assert policy.tolerance(50313000) == steppir.RETUNE_TOLERANCES["6m"]
+    assert policy.tolerance(15000000) == 0
+
+    policy = steppir.RetunePolicy(tolerances={"20m": 15000}, default=1000)
+    assert policy.tolerance(14074000) == 15000
+    assert policy.tolerance(21074000) == steppir.RETUNE_TOLERANCES["15m"]
+    assert policy.tolerance(15000000) == 1000
+
+
+
+def test_should_retune():
+    policy = steppir.RetunePolicy(tolerances={"20m": 20000})
+    assert not policy.should_retune(14074000, 14074000)
+    assert not policy.should_retune(14074000, 14094000)
+    assert not policy.should_retune(14074000, 14054000)
+    assert policy.should_retune(14074000, 14094001)
+    assert policy.should_retune(None, 14074000)
+
+
+
+def test_band_change_always_retunes():
+    # Within the tolerance, but across a band edge
+    policy = steppir.RetunePolicy(tolerances={"40m": 1000000, "30m": 1000000},
+        plan=steppir.BandPlan([(7000000, 7300000, "40m"), (7300001, 7400000, "30m")]))
+    assert policy.should_retune(7299000, 7300500)
+    # From outside the plan onto a band
+    assert policy.should_retune(6999000, 7000000)
+
+
+
+def test_tune_queue_suppresses_small_moves():
+    queue = steppir.TuneQueue(policy=steppir.RetunePolicy())
+    queue.submit(14074000)
+    (frequency, abort) = queue.get(block=False)
+    assert frequency == 14074000
+
+    # The antenna is on its way to 14.074: small moves are dropped
+    queue.submit(14076000)
+    assert queue.suppressed == 1
+    assert queue.get(block=False) is None
+    assert not abort.is_set()
+
+    # A bigger one aborts the tune in progress
+    queue.submit(14200000)
+    assert abort.is_set()
+    assert queue.get(block=False)[0] == 14200000
+    queue.done()
+    assert (queue.submitted, queue.suppressed) == (3, 1)
@@ -0,0 +1,57 @@
+"""
+The serial port is opened once and kept open across calls.
+"""
+
+import pytest
+import serial
+
+import steppir
+
+
+
+def test_port_stays_open(fake, fake_step):
+    fake_step.get_status()
+    fake_step.set_parameters(21074000, 0x00, '1')
+    fake_step.get_status()
+    assert len(fake.ports) == 1
+    assert fake.ports[0].is_open
+    assert fake.status_queries == 2
+
+
+
+def test_close_and_reopen(fake, fake_step):
+    fake_step.get_status()
+    fake_step.close()
+    assert not fake.ports[0].is_open
+
+    # The next call opens it again
+    fake_step.get_status()
+    assert len(fake.ports) == 2
+    assert fake.ports[1].is_open
+
+
+
+def test_reopens_after_io_error(fake, fake_step):
+    fake_step.get_status()
+    fake.fail_writes = 1
+    fake_step.set_parameters(21074000, 0x00, '1')
+    assert len(fake.ports) == 2
+    assert not fake.ports[0].is_open
+    assert fake.frequency == 21074000
+
+
+
+def test_second_io_error_is_raised(fake, fake_step):
+    fake.fail_writes = 2
+    with pytest.raises(serial.SerialException):
+        fake_step.set_parameters(21074000, 0x00, '1')
+    assert fake.frequency == 14000000
+
+
+
+def test_context_manager(fake):
+    with steppir.SteppIR("/dev/fake", 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None) as step:
+        assert len(fake.ports) == 1
+        step.get_status()
+        assert len(fake.ports) == 1
+    assert not fake.ports[0].is_open
@@ -0,0 +1,142 @@
+"""
+StatusDecoder framing and resync, and StatusFrame's tuple compatibility.
+"""
+
+import struct
+
+import pytest
+
+import steppir
+
+
+
+def frame(frequency, active_motors=0x00, direction=0x00, version=b'10', header=b'@A'):
+    """
+    An 11-byte status reply as the controller sends it.
+    """
+
+    return header + struct.pack('>IBB2s', frequency // 10, active_motors, direction, version) + b'\r'
+
+
+
+def frames(decoder):
+    result = []
+    while True:
+        reply = decoder.next_frame()
+        if reply is None:
+            return result
+        result.append(reply)
+
+
+
+def test_decoder_whole_frame():
+    decoder = steppir.StatusDecoder()
+    decoder.feed(frame(14074000))
+    assert frames(decoder) == [frame(14074000)]
+    assert decoder.frames == 1
+    assert decoder.discarded == 0
+    assert len(decoder) == 0
+
+
+
+def test_decoder_split_frame():
+    decoder = steppir.StatusDecoder()
+    reply = frame(21074000)
+    for i in range(len(reply) - 1):
+        decoder.feed(reply[i:i + 1])
+        assert decoder.next_frame() is None
+        assert decoder.needed() == len(reply) - i - 1
+    decoder.feed(reply[-1:])
+    assert decoder.next_frame() == reply
+
+
+
+def test_decoder_resyncs_after_garbage():
+    decoder = steppir.StatusDecoder()
+    decoder.feed(b'\xff\x00garbage\r' + frame(7074000) + b'\x12\x34' + frame(28074000))
+    assert frames(decoder) == [frame(7074000), frame(28074000)]
+    assert decoder.discarded == 12
+
+
+
+def test_decoder_skips_carriage_return_in_data():
+    # 0x0d in the frequency bytes must not end the frame early
+    reply = frame(0x0d0d0d * 10)
+    decoder = steppir.StatusDecoder()
+    decoder.feed(b'\r\r' + reply)
+    assert frames(decoder) == [reply]
+
+
+
+def test_decoder_overflow_keeps_newest():
+    decoder = steppir.StatusDecoder(size=32)
+    decoder.feed(b'x' * 40)
+    decoder.feed(frame(14000000))
+    assert frames(decoder) == [frame(14000000)]
+    assert decoder.discarded >= 40
+
+
+
+def test_decoder_reset():
+    decoder = steppir.StatusDecoder()
+    decoder.feed(frame(14000000)[:5])
+    decoder.reset()
+    decoder.feed(frame(18100000))
+    assert frames(decoder) == [frame(18100000)]
+    assert decoder.discarded == 5
+
+
+
+def test_get_status_skips_stale_bytes(fake, fake_step):
+    assert fake_step.get_status()[0] == 14000000
+    # A reply nobody read and some line noise are waiting on the port
+    fake.ports[0]._input += frame(7000000) + b'\x00\x12'
+    fake.frequency = 21074000
+    assert fake_step.get_status(max_age=0)[0] == 21074000
+
+
+
+def test_status_frame_decode():
+    status = steppir.StatusFrame.decode(frame(14074000, 0x07, 0x40, b'12'), timestamp=1.5)
+    assert status.frequency == 14074000
+    assert status.active_motors == 0x07
+    assert status.direction == 0x40
+    assert status.dir_label == steppir.DIRECTION_LABELS[2]
+    assert status.version == b'12'
+    assert status.timestamp == 1.5
+
+
+
+def test_status_frame_is_a_tuple_to_old_callers():
+    status = steppir.StatusFrame(14074000, 0x00, 0x20, "180 degrees", b'10', timestamp=3.0)
+
+    (frequency, active_motors, direction, dir_label, version) = status
+    assert (frequency, active_motors, direction, dir_label, version) == (14074000, 0x00, 0x20, "180 degrees", b'10')
+    assert len(status) == 5
+    assert status[0] == 14074000
+    assert status[-1] == b'10'
+    assert status[1:3] == (0x00, 0x20)
+    assert tuple(status) == (14074000, 0x00, 0x20, "180 degrees", b'10')
+
+    # The timestamp isn't part of the tuple
+    assert status == (14074000, 0x00, 0x20, "180 degrees", b'10')
+    assert status == steppir.StatusFrame(14074000, 0x00, 0x20, "180 degrees", b'10', timestamp=9.0)
+    assert hash(status) == hash(tuple(status))
+
+
+
+def test_status_frame_is_immutable():
+    status = steppir.StatusFrame(14074000, 0x00, 0x00, "Normal", b'10')
+    with pytest.raises(AttributeError):
+        status.frequency = 7000000
+    with pytest.raises(AttributeError):
+        del status.version
+
+
+
+def test_get_status_returns_a_status_frame(fake, fake_step):
+    status = fake_step.get_status()
+    assert isinstance(status, steppir.StatusFrame)
+    assert (status.frequency, status.active_motors, status.direction) == (14000000, 0x00, 0x00)
+    assert status.version == b'10'
+    assert status.timestamp is not None
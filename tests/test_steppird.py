@@ -0,0 +1,188 @@
+"""
+steppird: The line protocol, shared status polling and SUBSCRIBE events,
+with the daemon in a thread and the SDA-100 simulator behind it.
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+
+steppird = pytest.importorskip("steppird")
+
+
+
+class Client:
+    """
+    A protocol client: send() a line, readline() the next reply.
+    """
+
+    def __init__(self, daemon):
+        self.sock = socket.create_connection((daemon.host, daemon.port), timeout=10)
+        self.file = self.sock.makefile('rb')
+
+    def send(self, line):
+        self.sock.sendall(line.encode('ascii') + b'\n')
+
+    def readline(self):
+        return self.file.readline().decode('ascii').strip()
+
+    def ask(self, line):
+        self.send(line)
+        return self.readline()
+
+    def expect(self, prefix):
+        # Skips the EVENT lines a subscriber gets in between
+        while True:
+            line = self.readline()
+            if not line or line.startswith(prefix):
+                return line
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+
+def until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+
+def fields(line):
+    return dict(word.split("=", 1) for word in line.split()[1:] if "=" in word)
+
+
+
+@pytest.fixture
+def daemon(sim, step):
+    server = steppird.SteppIRDaemon(step, "127.0.0.1", 0, poll_interval=0.1)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while ((server.port == 0) or (server.status is None)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield server
+    server.shutdown()
+    thread.join(10)
+
+
+
+def test_status(sim, daemon):
+    client = Client(daemon)
+    line = client.ask("STATUS")
+    assert line.startswith("STATUS ")
+    status = fields(line)
+    assert status["frequency"] == "14000000"
+    assert status["direction"] == "0x00"
+    assert status["label"] == "Normal"
+    assert client.ask("status").startswith("STATUS ")
+    client.close()
+
+
+
+def test_status_is_served_from_the_poll(sim, daemon):
+    clients = [Client(daemon) for i in range(5)]
+    before = sim.status_queries
+    start = time.monotonic()
+    for i in range(4):
+        for client in clients:
+            assert client.ask("STATUS").startswith("STATUS ")
+    elapsed = time.monotonic() - start
+    # Only the daemon's own polls reach the controller
+    assert sim.status_queries - before <= elapsed / daemon.poll_interval + 2
+    for client in clients:
+        client.close()
+
+
+
+def test_commands(sim, daemon):
+    client = Client(daemon)
+    assert client.ask("FREQ 21074000") == "OK FREQ"
+    assert sim.frequency == 21074000
+    assert client.ask("DIR 180") == "OK DIR"
+    assert sim.direction == 0x40
+    assert client.ask("APPLY 18100000 BIDIR") == "OK APPLY"
+    assert (sim.frequency, sim.direction) == (18100000, 0x80)
+    assert client.ask("PATTERN 3") == "OK PATTERN"
+    assert (sim.direction, sim.pattern) == (0xc0, 3)
+
+    assert client.ask("AUTOTRACK OFF") == "OK AUTOTRACK"
+    assert until(lambda: not sim.autotrack)
+    assert client.ask("AUTOTRACK ON") == "OK AUTOTRACK"
+    assert until(lambda: sim.autotrack)
+
+    assert fields(client.ask("STATUS"))["frequency"] == "18100000"
+    client.close()
+
+
+
+def test_errors(sim, daemon):
+    client = Client(daemon)
+    assert client.ask("FROB") == "ERR FROB Unknown command"
+    assert client.ask("FREQ").startswith("ERR FREQ Bad arguments")
+    assert client.ask("FREQ fourteen").startswith("ERR FREQ Bad arguments")
+    assert client.ask("DIR SIDEWAYS").startswith("ERR DIR Bad arguments")
+    assert client.ask("AUTOTRACK MAYBE").startswith("ERR AUTOTRACK Bad arguments")
+    # Still talking after the errors
+    assert client.ask("STATUS").startswith("STATUS ")
+    assert sim.commands == 0
+    client.close()
+
+
+
+def test_subscribe(sim, daemon):
+    subscriber = Client(daemon)
+    assert subscriber.ask("SUBSCRIBE") == "OK SUBSCRIBE"
+    # The current status right away
+    assert subscriber.readline().startswith("EVENT STATUS ")
+
+    other = Client(daemon)
+    assert other.ask("FREQ 7074000") == "OK FREQ"
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        line = subscriber.readline()
+        assert line.startswith("EVENT ")
+        if fields(line).get("frequency") == "7074000":
+            break
+    else:
+        pytest.fail("No event for the new frequency")
+
+    subscriber.send("UNSUBSCRIBE")
+    assert subscriber.expect("OK") == "OK UNSUBSCRIBE"
+    other.close()
+    subscriber.close()
+
+
+
+def test_quit(sim, daemon):
+    client = Client(daemon)
+    client.send("QUIT")
+    assert client.readline() == ""
+    client.close()
+
+
+
+def test_retract_runs_in_the_background(sim, daemon):
+    subscriber = Client(daemon)
+    assert subscriber.ask("SUBSCRIBE") == "OK SUBSCRIBE"
+    client = Client(daemon)
+    client.send("RETRACT")
+
+    # Progress is published while the elements come in
+    assert subscriber.expect("EVENT HOMING").startswith("EVENT HOMING kind=retract ")
+
+    # STATUS is still answered and tuning is refused until it is done
+    other = Client(daemon)
+    assert other.ask("STATUS").startswith("STATUS ")
+    assert other.ask("FREQ 21074000").startswith("ERR FREQ ")
+
+    assert client.readline() == "OK RETRACT"
+    assert sim.frequency == 0
+    assert not sim.busy()
+    for connection in (subscriber, client, other):
+        connection.close()
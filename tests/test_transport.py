@@ -0,0 +1,180 @@
+"""
+TCPTransport and socket:// URLs: Replies split across TCP segments, read
+timeouts, dropped connections, and the reconnect backoff.
+"""
+
+import socket
+import threading
+import time
+
+import pytest
+import serial
+
+import steppir
+
+
+
+class SegmentServer:
+    """
+    Accepts one connection and answers everything received with
+    "respond(data)", sent in "pieces" separate segments "gap" seconds
+    apart.
+    """
+
+    def __init__(self, respond, pieces=3, gap=0.05):
+        self.respond = respond
+        self.pieces = pieces
+        self.gap = gap
+        self.received = bytearray()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.conn = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        (self.conn, address) = self.listener.accept()
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                data = self.conn.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            self.received += data
+            reply = self.respond(bytes(self.received))
+            if reply is None:
+                continue
+            self.received.clear()
+            size = max(1, -(-len(reply) // self.pieces))
+            for offset in range(0, len(reply), size):
+                if offset:
+                    time.sleep(self.gap)
+                self.conn.sendall(reply[offset:offset + size])
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.conn.close()
+        self.listener.close()
+
+
+
+def controller(fake):
+    """
+    Answers complete status queries and commands like FakeController.
+    """
+
+    def respond(data):
+        if data == b'?A\r' or (len(data) == 11 and data[:2] == b'@A'):
+            return fake.reply(data)
+        return None
+    return respond
+
+
+
+def test_from_url():
+    transport = steppir.TCPTransport.from_url("socket://controller.example:4001", timeout=1.5)
+    assert (transport.host, transport.port, transport.timeout) == ("controller.example", 4001, 1.5)
+    for url in ("socket://controller.example", "rfc2217://controller.example:4001", "/dev/ttyUSB0"):
+        with pytest.raises(ValueError):
+            steppir.TCPTransport.from_url(url)
+
+
+
+def test_read_joins_segments():
+    server = SegmentServer(lambda data: b'0123456789A', pieces=4, gap=0.05)
+    transport = steppir.TCPTransport("127.0.0.1", server.port, timeout=2.0).open()
+    try:
+        transport.write(b'?')
+        assert transport.read(11) == b'0123456789A'
+    finally:
+        transport.close()
+        server.close()
+
+
+
+def test_read_times_out_short():
+    server = SegmentServer(lambda data: b'01234', pieces=1)
+    transport = steppir.TCPTransport("127.0.0.1", server.port, timeout=0.3).open()
+    try:
+        transport.write(b'?')
+        start = time.monotonic()
+        assert transport.read(11) == b'01234'
+        assert 0.25 < time.monotonic() - start < 1.0
+    finally:
+        transport.close()
+        server.close()
+
+
+
+def test_in_waiting_and_reset():
+    server = SegmentServer(lambda data: b'stale', pieces=1)
+    transport = steppir.TCPTransport("127.0.0.1", server.port, timeout=1.0).open()
+    try:
+        transport.write(b'?')
+        deadline = time.monotonic() + 2
+        while transport.in_waiting < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert transport.in_waiting == 5
+        transport.reset_input_buffer()
+        assert transport.in_waiting == 0
+    finally:
+        transport.close()
+        server.close()
+
+
+
+def test_closed_connection():
+    server = SegmentServer(lambda data: None)
+    transport = steppir.TCPTransport("127.0.0.1", server.port, timeout=1.0).open()
+    try:
+        server.thread.join(0.2)
+        server.conn.shutdown(socket.SHUT_RDWR)
+        with pytest.raises(serial.SerialException):
+            transport.read(11)
+    finally:
+        transport.close()
+        server.close()
+
+
+
+def test_steppir_over_socket_url(fake):
+    server = SegmentServer(controller(fake), pieces=3, gap=0.02)
+    step = steppir.SteppIR("socket://127.0.0.1:%d" % server.port, 1200, 8, 'N', 1, 2.0, False, False,
+        2.0, False, None, None)
+    try:
+        assert step.get_status()[0] == 14000000
+        step.set_frequency(21074000)
+        assert step.get_status(max_age=0)[0] == 21074000
+        assert isinstance(step.serial, steppir.TCPTransport)
+    finally:
+        step.close()
+        server.close()
+
+
+
+def test_reconnect_backoff():
+    # Nothing listens on this port
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+
+    step = steppir.SteppIR("socket://127.0.0.1:%d" % port, 1200, 8, 'N', 1, 2.0, False, False,
+        2.0, False, None, None)
+    with pytest.raises(serial.SerialException):
+        step.get_status()
+
+    # Fails straight away until the backoff delay has passed
+    with pytest.raises(serial.SerialException, match="retrying in"):
+        step.get_status()
+    time.sleep(step.reconnect_base * 2)
+    with pytest.raises(serial.SerialException, match="Could not connect"):
+        step.get_status()
@@ -0,0 +1,106 @@
+"""
+TravelModel: The least squares fit, saving, timeouts, and learning from
+the moves SteppIR makes.
+"""
+
+import os
+
+import pytest
+
+import steppir
+
+
+
+def seconds(start, end, direction_changed):
+    # 0.3 s to start, 0.12 s per MHz, 0.8 s to turn the elements around
+    return 0.3 + 0.12 * abs(end - start) / 1e6 + (0.8 if direction_changed else 0.0)
+
+
+
+def test_fit_recovers_travel_times():
+    model = steppir.TravelModel()
+    moves = [(14000000, 21000000, False), (21000000, 28000000, True), (28000000, 7000000, False),
+        (7000000, 7100000, True), (7100000, 50000000, False), (50000000, 14000000, True)]
+
+    for move in moves[:steppir.TravelModel.MIN_SAMPLES - 1]:
+        model.record("tune", *move, seconds(*move))
+        assert model.predict("tune", 14000000, 21000000, False) is None
+
+    for move in moves[steppir.TravelModel.MIN_SAMPLES - 1:]:
+        model.record("tune", *move, seconds(*move))
+
+    for move in ((14000000, 14100000, False), (7000000, 54000000, True), (21000000, 18100000, True)):
+        assert model.predict("tune", *move) == pytest.approx(seconds(*move), abs=1e-3)
+
+    # Kinds are fitted separately
+    assert model.predict("retract", 28000000, 0, False) is None
+
+
+
+def test_fit_without_direction_changes():
+    # A feature that never varies must not make the fit blow up
+    model = steppir.TravelModel()
+    for (start, end) in ((14000000, 21000000), (21000000, 28000000), (28000000, 7000000), (7000000, 14000000)):
+        model.record("tune", start, end, False, seconds(start, end, False))
+    assert model.predict("tune", 14000000, 28000000, False) == pytest.approx(seconds(14000000, 28000000, False), abs=1e-3)
+
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "travel.json")
+    model = steppir.TravelModel.load(path)
+    for (start, end) in ((14000000, 21000000), (21000000, 28000000), (28000000, 7000000)):
+        model.record("tune", start, end, False, seconds(start, end, False))
+    model.record("retract", 7000000, 0, False, 2.5)
+    model.save()
+
+    loaded = steppir.TravelModel.load(path)
+    assert loaded.export() == model.export()
+    assert loaded.predict("tune", 14000000, 18000000, False) == pytest.approx(seconds(14000000, 18000000, False), abs=1e-3)
+
+
+
+def test_steppir_learns_from_moves(sim):
+    model = steppir.TravelModel()
+    step = steppir.SteppIR(sim.port, 1200, 8, 'N', 1, 2.0, False, False, 2.0, False, None, None,
+        travel_model=model)
+    try:
+        for frequency in (21000000, 14000000, 28000000, 18100000):
+            step.set_frequency(frequency)
+    finally:
+        step.close()
+
+    samples = model.export()["models"]["tune"]["samples"]
+    assert [sample[:2] for sample in samples] == [[14000000, 21000000], [21000000, 14000000],
+        [14000000, 28000000], [28000000, 18100000]]
+    assert all(sample[3] > 0 for sample in samples)
+    assert model.predict("tune", 14000000, 21000000, False) is not None
+    assert sim.frequency == 18100000
+
+
+
+def test_timeout():
+    model = steppir.TravelModel()
+    assert model.timeout(None) == steppir.TravelModel.MAX_TRAVEL
+    assert model.timeout(0.1) == 1.0
+    assert model.timeout(5.0) == 5.0 * steppir.TravelModel.TIMEOUT_FACTOR
+    assert model.timeout(1000.0) == steppir.TravelModel.MAX_TRAVEL
+
+
+
+def test_saves_in_batches(tmp_path):
+    path = str(tmp_path / "travel.json")
+    model = steppir.TravelModel.load(path)
+    for i in range(steppir.TravelModel.SAVE_EVERY - 1):
+        model.record("tune", 14000000, 14000000 + i * 100000, False, 0.5 + i * 0.01)
+    assert not os.path.exists(path)
+
+    model.record("tune", 14000000, 21000000, False, 1.0)
+    assert os.path.exists(path)
+
+    model.record("retract", 21000000, 0, False, 4.0)
+    assert len(steppir.TravelModel.load(path).export()["models"].get("retract", {}).get("samples", [])) == 0
+    model.flush()
+    loaded = steppir.TravelModel.load(path)
+    assert loaded.export() == model.export()
+    assert loaded.predict("tune", 14000000, 21000000, False) == model.predict("tune", 14000000, 21000000, False)
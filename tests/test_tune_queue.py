@@ -0,0 +1,150 @@
+"""
+TuneQueue: The newest frequency wins, newer targets abort the tune in
+progress, and the worker sleeps until there is something to do.
+"""
+
+import threading
+import time
+
+import pytest
+
+import steppir
+
+
+
+class StubStep:
+    """
+    Records set_frequency() calls. With "hold" set each call waits for its
+    abort event (or "release") before returning.
+    """
+
+    autotrack = None
+
+    def __init__(self, hold=False):
+        self.hold = hold
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.frequencies = []
+
+    def set_frequency(self, frequency, abort=None):
+        self.frequencies.append(frequency)
+        self.started.set()
+        if self.hold:
+            while not self.release.is_set():
+                if abort.wait(0.01):
+                    raise steppir.CommandAborted("Superseded")
+        return steppir.StatusFrame(frequency, 0x00, 0x00, "Normal", b'10')
+
+
+
+def test_latest_wins():
+    queue = steppir.TuneQueue()
+    for frequency in (14074000, 14075000, 14076000):
+        queue.submit(frequency)
+    (frequency, abort) = queue.get(block=False)
+    assert frequency == 14076000
+    assert queue.get(block=False) is None
+    queue.done()
+    assert (queue.submitted, queue.coalesced) == (3, 2)
+
+
+
+def test_tune():
+    queue = steppir.TuneQueue()
+    step = StubStep()
+    queue.submit(21074000)
+    assert queue.tune(step, block=False) == 21074000
+    assert queue.tune(step, block=False) is None
+    assert step.frequencies == [21074000]
+    assert queue.tuned == 1
+
+
+
+def test_same_frequency_while_tuning_is_dropped():
+    queue = steppir.TuneQueue()
+    queue.submit(14074000)
+    (frequency, abort) = queue.get(block=False)
+    queue.submit(14074000)
+    assert not abort.is_set()
+    assert queue.get(block=False) is None
+    queue.done()
+
+
+
+def test_newer_target_aborts_the_tune_in_progress():
+    queue = steppir.TuneQueue()
+    step = StubStep(hold=True)
+    queue.submit(14074000)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(queue.tune(step)))
+    worker.start()
+    assert step.started.wait(5)
+
+    queue.submit(21074000)
+    worker.join(5)
+    assert results == [None]
+    assert queue.superseded == 1
+
+    step.release.set()
+    assert queue.tune(step, block=False) == 21074000
+    assert step.frequencies == [14074000, 21074000]
+
+
+
+def test_close():
+    queue = steppir.TuneQueue()
+    queue.submit(14074000)
+    queue.close()
+    assert queue.closed
+    assert queue.get(block=False) is None
+    assert queue.tune(StubStep()) is None
+
+
+
+def test_worker_sleeps_until_a_frequency_arrives():
+    queue = steppir.TuneQueue()
+    step = StubStep()
+    results = []
+    worker = threading.Thread(target=lambda: results.append(queue.tune(step)))
+    worker.start()
+    time.sleep(0.2)
+    assert worker.is_alive()
+    assert step.frequencies == []
+
+    queue.submit(7074000)
+    worker.join(5)
+    assert results == [7074000]
+
+
+
+def test_close_wakes_the_worker():
+    queue = steppir.TuneQueue()
+    results = []
+    worker = threading.Thread(target=lambda: results.append(queue.tune(StubStep())))
+    worker.start()
+    time.sleep(0.2)
+    queue.close()
+    worker.join(5)
+    assert not worker.is_alive()
+    assert results == [None]
+
+
+
+def test_failed_tune_leaves_the_queue_working():
+    class FailingStep(StubStep):
+        def set_frequency(self, frequency, abort=None):
+            status = super().set_frequency(frequency, abort)
+            if len(self.frequencies) == 1:
+                raise steppir.ShortFrameError("No reply")
+            return status
+
+    queue = steppir.TuneQueue()
+    step = FailingStep()
+    queue.submit(21074000)
+    # The error reaches the worker, which logs it and carries on
+    with pytest.raises(steppir.FrameError):
+        queue.tune(step, block=False)
+
+    queue.submit(21074000)
+    assert queue.tune(step, block=False) == 21074000
+    assert step.frequencies == [21074000, 21074000]